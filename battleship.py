@@ -3,13 +3,18 @@ battleship.py
 
 Contains core data structures and logic for Battleship, including:
  - Board class for storing ship positions, hits, misses
+ - BitBoard, the same board kept in integer bitmasks
+ - FleetPlacer, random fleet placement without retries
  - Utility function parse_coordinate for translating e.g. 'B5' -> (row, col)
+ - Utility function parse_fleet for reading a custom fleet, e.g. 'Carrier:5,Destroyer:2'
  - A test harness run_single_player_game() to demonstrate the logic in a local, single-player mode
 
 """
 
 import random
 
+from coordinates import CoordinateCodec, row_label
+
 BOARD_SIZE = 10
 SHIPS = [
     ("Carrier", 5),
@@ -19,18 +24,42 @@ SHIPS = [
     ("Destroyer", 2)
 ]
 
+class PlacedShip:
+    """
+    A ship on a board: its name, the (r, c) cells it covers and how many of them haven't been hit.
+    """
+    __slots__ = ('name', 'positions', 'remaining')
+
+    def __init__(self, name, positions):
+        self.name = name
+        self.positions = tuple(positions)
+        self.remaining = len(self.positions)
+
+    def is_sunk(self):
+        return self.remaining == 0
+
+    def __eq__(self, other):
+        if not isinstance(other, PlacedShip):
+            return NotImplemented
+        return (self.name, self.positions, self.remaining) == (other.name, other.positions, other.remaining)
+
+    def __repr__(self):
+        return f"PlacedShip({self.name!r}, {self.positions!r}, remaining={self.remaining})"
+
 class Board:
     """
     Represents a single Battleship board with hidden ships.
     We store:
       - self.hidden_grid: tracks real positions of ships ('S'), hits ('X'), misses ('o')
       - self.display_grid: the version we show to the player ('.' for unknown, 'X' for hits, 'o' for misses)
-      - self.placed_ships: a list of dicts, each dict with:
-          {
-             'name': <ship_name>,
-             'positions': set of (r, c),
-          }
-        used to determine when a specific ship has been fully sunk.
+      - self.placed_ships: a list of PlacedShip records (name, positions, cells not yet hit)
+      - self.ship_at: (r, c) -> the PlacedShip covering that cell, so a hit finds its ship directly
+      - self.ships_afloat: how many placed ships aren't sunk yet
+        used to determine when a specific ship, or the whole fleet, has been sunk.
+      - self.hidden_rows / self.display_rows: the rendered text of each row of either view,
+        None once a ship or a shot has changed that row (see rendered_rows())
+      - self.changes: the (r, c) of every cell change in order, its length is the board's version
+        (see changes_since())
 
     In a full 2-player networked game:
       - Each player has their own Board instance.
@@ -40,33 +69,42 @@ class Board:
 
     def __init__(self, size=BOARD_SIZE):
         self.size = size
+        self.codec = CoordinateCodec.for_size(size)
         # '.' for empty water
         self.hidden_grid = [['.' for _ in range(size)] for _ in range(size)]
         # display_grid is what the player or an observer sees (no 'S')
         self.display_grid = [['.' for _ in range(size)] for _ in range(size)]
-        self.placed_ships = []  # e.g. [{'name': 'Destroyer', 'positions': {(r, c), ...}}, ...]
-
-    def place_ships_randomly(self, ships=SHIPS):
+        self.placed_ships = []  # e.g. [PlacedShip('Destroyer', ((r, c), ...)), ...]
+        self.ship_at = {}
+        self.ships_afloat = 0
+        self.hidden_rows = [None] * size
+        self.display_rows = [None] * size
+        self.changes = []
+
+    def place_ships_randomly(self, ships=SHIPS, rng=random):
         """
         Randomly place each ship in 'ships' on the hidden_grid, storing positions for each ship.
         In a networked version, you might parse explicit placements from a player's commands
         (e.g. "PLACE A1 H BATTLESHIP") or prompt the user for board coordinates and placement orientations; 
         the self.place_ships_manually() can be used as a guide.
+        Placements come from FleetPlacer, so there are no retries however crowded the board is.
+        Raises ValueError if the ships can't all fit. Pass rng (e.g. random.Random(seed)) for a
+        repeatable fleet, the default uses the random module.
         """
-        for ship_name, ship_size in ships:
-            placed = False
-            while not placed:
-                orientation = random.randint(0, 1)  # 0 => horizontal, 1 => vertical
-                row = random.randint(0, self.size - 1)
-                col = random.randint(0, self.size - 1)
+        placer = FleetPlacer(self.size, rng)
+        for placement in placer.place(ships, self.occupied_mask()):
+            self.place_ship(*placement)
 
-                if self.can_place_ship(row, col, ship_size, orientation):
-                    occupied_positions = self.do_place_ship(row, col, ship_size, orientation)
-                    self.placed_ships.append({
-                        'name': ship_name,
-                        'positions': occupied_positions
-                    })
-                    placed = True
+    def occupied_mask(self):
+        """
+        Bit r*size + c is set for every cell a new ship can't use (ships and cells already fired at).
+        """
+        mask = 0
+        for r in range(self.size):
+            for c in range(self.size):
+                if self.hidden_grid[r][c] != '.':
+                    mask |= 1 << (r * self.size + c)
+        return mask
 
 
     def place_ships_manually(self, ships=SHIPS):
@@ -83,7 +121,7 @@ class Board:
                 orientation_str = input("  Orientation? Enter 'H' (horizontal) or 'V' (vertical): ").strip().upper()
 
                 try:
-                    row, col = parse_coordinate(coord_str)
+                    row, col = self.codec.parse(coord_str)
                 except ValueError as e:
                     print(f"  [!] Invalid coordinate: {e}")
                     continue
@@ -98,23 +136,40 @@ class Board:
                     continue
 
                 # Check if we can place the ship
-                if self.can_place_ship(row, col, ship_size, orientation):
-                    occupied_positions = self.do_place_ship(row, col, ship_size, orientation)
-                    self.placed_ships.append({
-                        'name': ship_name,
-                        'positions': occupied_positions
-                    })
+                if self.place_ship(ship_name, row, col, ship_size, orientation):
                     break
                 else:
                     print(f"  [!] Cannot place {ship_name} at {coord_str} (orientation={orientation_str}). Try again.")
 
 
+    def place_ship(self, ship_name, row, col, ship_size, orientation):
+        """
+        Place a named ship if there is room for it and record it in placed_ships.
+        Returns True if the ship was placed, False otherwise.
+        """
+        if not self.can_place_ship(row, col, ship_size, orientation):
+            return False
+        self.do_place_ship(row, col, ship_size, orientation)
+        self.add_ship(PlacedShip(ship_name, ship_cells(row, col, ship_size, orientation)))
+        return True
+
+    def add_ship(self, ship):
+        """
+        Record a placed ship so hits on its cells count towards sinking it.
+        """
+        self.placed_ships.append(ship)
+        for position in ship.positions:
+            self.ship_at[position] = ship
+        self.ships_afloat += 1
+
     def can_place_ship(self, row, col, ship_size, orientation):
         """
         Check if we can place a ship of length 'ship_size' at (row, col)
         with the given orientation (0 => horizontal, 1 => vertical).
         Returns True if the space is free, False otherwise.
         """
+        if not (0 <= row < self.size and 0 <= col < self.size):
+            return False
         if orientation == 0:  # Horizontal
             if col + ship_size > self.size:
                 return False
@@ -132,7 +187,11 @@ class Board:
     def do_place_ship(self, row, col, ship_size, orientation):
         """
         Place the ship on hidden_grid by marking 'S', and return the set of occupied positions.
+        Raises IndexError if the ship would leave the board and ValueError if one of its cells
+        is taken (call can_place_ship() first to avoid both).
         """
+        if not self.can_place_ship(row, col, ship_size, orientation):
+            self.placement_error(row, col, ship_size, orientation)
         occupied = set()
         if orientation == 0:  # Horizontal
             for c in range(col, col + ship_size):
@@ -142,8 +201,19 @@ class Board:
             for r in range(row, row + ship_size):
                 self.hidden_grid[r][col] = 'S'
                 occupied.add((r, col))
+        self.ship_changed(row, col, ship_size, orientation)
         return occupied
 
+    def placement_error(self, row, col, ship_size, orientation):
+        """
+        Raise the error for a ship that can't go at (row, col): IndexError if it would leave the
+        board, ValueError if it would cover a taken cell.
+        """
+        end_row, end_col = (row, col + ship_size - 1) if orientation == 0 else (row + ship_size - 1, col)
+        if not (0 <= row and 0 <= col and end_row < self.size and end_col < self.size):
+            raise IndexError(f"a ship of length {ship_size} at ({row}, {col}) leaves the {self.size}x{self.size} board")
+        raise ValueError(f"a ship of length {ship_size} at ({row}, {col}) covers a taken cell")
+
     def fire_at(self, row, col):
         """
         Fire at (row, col). Return a tuple (result, sunk_ship_name).
@@ -154,12 +224,16 @@ class Board:
           - ('already_shot', None) if that cell was already revealed as 'X' or 'o'
 
         The server can use this result to inform the firing player.
+        Raises IndexError if (row, col) is off the board.
         """
+        if not (0 <= row < self.size and 0 <= col < self.size):
+            raise IndexError(f"({row}, {col}) is off the {self.size}x{self.size} board")
         cell = self.hidden_grid[row][col]
         if cell == 'S':
             # Mark a hit
             self.hidden_grid[row][col] = 'X'
             self.display_grid[row][col] = 'X'
+            self.cell_changed(row, col)
             # Check if that hit sank a ship
             sunk_ship_name = self._mark_hit_and_check_sunk(row, col)
             if sunk_ship_name:
@@ -170,6 +244,7 @@ class Board:
             # Mark a miss
             self.hidden_grid[row][col] = 'o'
             self.display_grid[row][col] = 'o'
+            self.cell_changed(row, col)
             return ('miss', None)
         elif cell == 'X' or cell == 'o':
             return ('already_shot', None)
@@ -179,26 +254,79 @@ class Board:
 
     def _mark_hit_and_check_sunk(self, row, col):
         """
-        Remove (row, col) from the relevant ship's positions.
-        If that ship's positions become empty, return the ship name (it's sunk).
+        Count the hit against the ship covering (row, col).
+        If that was the ship's last cell, return the ship name (it's sunk).
         Otherwise return None.
         """
-        for ship in self.placed_ships:
-            if (row, col) in ship['positions']:
-                ship['positions'].remove((row, col))
-                if len(ship['positions']) == 0:
-                    return ship['name']
-                break
+        ship = self.ship_at.get((row, col))
+        if ship is None:
+            return None
+        ship.remaining -= 1
+        if ship.remaining == 0:
+            self.ships_afloat -= 1
+            return ship.name
         return None
 
     def all_ships_sunk(self):
         """
-        Check if all ships are sunk (i.e. every ship's positions are empty).
+        Check if all ships are sunk.
         """
-        for ship in self.placed_ships:
-            if len(ship['positions']) > 0:
-                return False
-        return True
+        return self.ships_afloat == 0
+
+    @property
+    def version(self):
+        return len(self.changes)
+
+    def cell_changed(self, row, col):
+        """
+        Record a shot at (row, col) and forget the rendered row in both views.
+        """
+        self.changes.append((row, col))
+        self.hidden_rows[row] = self.display_rows[row] = None
+
+    def ship_changed(self, row, col, ship_size, orientation):
+        """
+        Record a newly placed ship's cells and forget the rendered hidden rows it covers
+        (ships don't show in the display view).
+        """
+        self.changes.extend(ship_cells(row, col, ship_size, orientation))
+        if orientation == 0:  # Horizontal
+            self.hidden_rows[row] = None
+        else:  # Vertical
+            self.hidden_rows[row:row + ship_size] = [None] * ship_size
+
+    def cell_state(self, row, col, show_hidden=False):
+        """
+        Character of one cell in the hidden view (show_hidden) or the display view.
+        """
+        grid = self.hidden_grid if show_hidden else self.display_grid
+        return grid[row][col]
+
+    def changes_since(self, version, show_hidden=False):
+        """
+        (r, c, state) of every cell changed after the given version, once each and in the view asked for.
+        Returns None if the version is newer than the board, i.e. it came from a different board.
+        """
+        if version > len(self.changes):
+            return None
+        return [(r, c, self.cell_state(r, c, show_hidden)) for r, c in dict.fromkeys(self.changes[version:])]
+
+    def rendered_rows(self, show_hidden=False):
+        """
+        Text of every row of the hidden view (show_hidden) or the display view, e.g. 'B  . X o . S',
+        labelled and spaced like print_display_grid(). Rows are cached, so only rows a ship or a shot
+        has changed since the last call are rendered again. The returned list is the cache itself.
+        """
+        rows = self.hidden_rows if show_hidden else self.display_rows
+        if None in rows:
+            for r, text in enumerate(rows):
+                if text is None:
+                    rows[r] = self.render_row(r, show_hidden)
+        return rows
+
+    def render_row(self, r, show_hidden):
+        grid = self.hidden_grid if show_hidden else self.display_grid
+        return f"{self.codec.padded_labels[r]} {' '.join(grid[r])}"
 
     def print_display_grid(self, show_hidden_board=False):
         """
@@ -218,39 +346,361 @@ class Board:
         # Decide which grid to print
         grid_to_print = self.hidden_grid if show_hidden_board else self.display_grid
 
+        codec = self.codec
         # Column headers (1 .. N)
-        print("  " + "".join(str(i + 1).rjust(2) for i in range(self.size)))
-        # Each row labeled with A, B, C, ...
+        print(" " * codec.label_width + "".join(str(i + 1).rjust(codec.column_width) for i in range(self.size)))
+        # Each row labeled with A, B, C, ..., Z, AA, AB, ...
         for r in range(self.size):
-            row_label = chr(ord('A') + r)
             row_str = " ".join(grid_to_print[r][c] for c in range(self.size))
-            print(f"{row_label:2} {row_str}")
+            print(f"{codec.padded_labels[r]} {row_str}")
+
+class BitBoard(Board):
+    """
+    Board backend built on integer bitmasks instead of 2-D lists of characters.
+    Cell (r, c) is bit r*size + c of:
+      - self.ships: every cell covered by a ship
+      - self.afloat: ship cells that haven't been hit yet
+      - self.shot: cells that have been fired at (hits and misses)
+    Placement checks and firing are a few bitwise operations, and ships are tracked with
+    the same PlacedShip records and counters as Board.
+
+    The public methods and return values are the same as Board. hidden_grid and display_grid
+    are built from the masks when they are read, so they are snapshots: changing them
+    doesn't change the board.
+    """
+    masks = {} # board size -> (single cell bits, vertical ship masks), shared by every board of that size
+
+    def __init__(self, size=BOARD_SIZE):
+        self.size = size
+        self.codec = CoordinateCodec.for_size(size)
+        self.ships = 0
+        self.afloat = 0
+        self.shot = 0
+        self.placed_ships = []
+        self.ship_at = [None] * (size * size) # cell index (r*size + c) -> PlacedShip
+        self.ships_afloat = 0
+        self.hidden_rows = [None] * size
+        self.display_rows = [None] * size
+        self.changes = []
+        if size not in BitBoard.masks:
+            bits = [1 << i for i in range(size * size)]
+            # a vertical ship of length n is column_masks[n] shifted to its first cell
+            column_masks = [sum(1 << (k * size) for k in range(n)) for n in range(size + 1)]
+            BitBoard.masks[size] = (bits, column_masks)
+        self.bits, self.column_masks = BitBoard.masks[size]
+
+    @property
+    def hits(self):
+        return self.ships & ~self.afloat
+
+    @property
+    def misses(self):
+        return self.shot & ~self.ships
+
+    def occupied_mask(self):
+        return self.ships | self.shot
+
+    def ship_mask(self, row, col, ship_size, orientation):
+        """
+        Mask of the cells a ship would cover, or None if it would leave the board.
+        """
+        if row < 0 or col < 0 or row >= self.size or col >= self.size:
+            return None
+        if orientation == 0:  # Horizontal
+            if col + ship_size > self.size:
+                return None
+            return ((1 << ship_size) - 1) << (row * self.size + col)
+        else:  # Vertical
+            if row + ship_size > self.size:
+                return None
+            return self.column_masks[ship_size] << (row * self.size + col)
+
+    def place_ship(self, ship_name, row, col, ship_size, orientation):
+        mask = self.ship_mask(row, col, ship_size, orientation)
+        # like Board, a cell that has already been fired at isn't free either
+        if mask is None or mask & (self.ships | self.shot):
+            return False
+        self.ships |= mask
+        self.afloat |= mask
+        self.ship_changed(row, col, ship_size, orientation)
+        self.add_ship(PlacedShip(ship_name, ship_cells(row, col, ship_size, orientation)))
+        return True
+
+    def can_place_ship(self, row, col, ship_size, orientation):
+        mask = self.ship_mask(row, col, ship_size, orientation)
+        return mask is not None and not mask & (self.ships | self.shot)
 
-def parse_coordinate(coord_str):
+    def do_place_ship(self, row, col, ship_size, orientation):
+        mask = self.ship_mask(row, col, ship_size, orientation)
+        if mask is None or mask & (self.ships | self.shot):
+            self.placement_error(row, col, ship_size, orientation)
+        self.ships |= mask
+        self.afloat |= mask
+        self.ship_changed(row, col, ship_size, orientation)
+        return self.positions(mask)
+
+    def add_ship(self, ship):
+        self.placed_ships.append(ship)
+        for r, c in ship.positions:
+            self.ship_at[r * self.size + c] = ship
+        self.ships_afloat += 1
+
+    def positions(self, mask):
+        """
+        Set of (r, c) cells in a mask.
+        """
+        cells = set()
+        while mask:
+            low = mask & -mask
+            cells.add(divmod(low.bit_length() - 1, self.size))
+            mask ^= low
+        return cells
+
+    def fire_at(self, row, col):
+        size = self.size
+        if not (0 <= row < size and 0 <= col < size):
+            raise IndexError(f"({row}, {col}) is off the {size}x{size} board")
+        index = row * size + col
+        bit = self.bits[index]
+        shot = self.shot
+        if shot & bit:
+            return ('already_shot', None)
+        self.shot = shot | bit
+        # cell_changed() and _mark_hit_and_check_sunk() inlined, a shot is mostly call overhead
+        self.changes.append((row, col))
+        self.hidden_rows[row] = self.display_rows[row] = None
+        afloat = self.afloat
+        if afloat & bit:
+            self.afloat = afloat ^ bit
+            ship = self.ship_at[index]
+            if ship is None:
+                return ('hit', None)
+            ship.remaining -= 1
+            if ship.remaining:
+                return ('hit', None)
+            self.ships_afloat -= 1
+            return ('hit', ship.name)
+        return ('miss', None)
+
+    def _mark_hit_and_check_sunk(self, row, col):
+        ship = self.ship_at[row * self.size + col]
+        if ship is None:
+            return None
+        ship.remaining -= 1
+        if ship.remaining == 0:
+            self.ships_afloat -= 1
+            return ship.name
+        return None
+
+    def row_cells(self, r, show_hidden):
+        """
+        Characters of one row, taken from that row's slice of each mask.
+        """
+        size = self.size
+        full_row = (1 << size) - 1
+        shot = (self.shot >> (r * size)) & full_row
+        ships = (self.ships >> (r * size)) & full_row
+        row = []
+        for c in range(size):
+            if shot >> c & 1:
+                row.append('X' if ships >> c & 1 else 'o')
+            elif show_hidden and ships >> c & 1:
+                row.append('S')
+            else:
+                row.append('.')
+        return row
+
+    def cell_state(self, row, col, show_hidden=False):
+        bit = self.bits[row * self.size + col]
+        if self.shot & bit:
+            return 'X' if self.ships & bit else 'o'
+        if show_hidden and self.ships & bit:
+            return 'S'
+        return '.'
+
+    def grid(self, show_hidden):
+        return [self.row_cells(r, show_hidden) for r in range(self.size)]
+
+    def render_row(self, r, show_hidden):
+        return f"{self.codec.padded_labels[r]} {' '.join(self.row_cells(r, show_hidden))}"
+
+    @property
+    def hidden_grid(self):
+        return self.grid(True)
+
+    @property
+    def display_grid(self):
+        return self.grid(False)
+
+BOARD_BACKENDS = {
+    "grid": Board,
+    "bitboard": BitBoard,
+}
+
+class FleetPlacer:
     """
-    Convert something like 'B5' into zero-based (row, col).
-    Example: 'A1' => (0, 0), 'C10' => (2, 9)
-    HINT: you might want to add additional input validation here...
+    Random fleet placement without retries.
+    The legal placements of a ship are worked out all at once as bitmasks of starting cells
+    (bit r*size + c): a horizontal ship of length n can start on a cell if that cell and the n-1
+    cells after it are free, which is the free mask ANDed with itself shifted by 1..n-1 (and
+    limited to starts that don't run off the row). Vertical ships shift by whole rows. The masks
+    are recomputed from the occupied cells after each ship is placed, and the ship is then drawn
+    uniformly from every legal placement, so each draw succeeds. (Clearing only the starts the last
+    ship blocks from a mask kept per ship length was tried: it needs as many big-int operations per
+    length as the rebuild does for the one length that's needed, and was about half as fast.)
+
+    If a ship has nowhere to go the previous ship is moved to one of its other legal placements
+    (backtracking), and ValueError is raised once every option has been tried: the fleet can't fit.
+    Dead ends are remembered by the occupied cells they were reached with, so the same cells covered
+    by identical ships in another order aren't searched again.
     """
-    valid_letters = "ABCDEFGHIJ"
-    valid_numbers = ['1','2','3','4','5','6','7','8','9','10']
+    masks = {} # board size -> (full board, horizontal starts, horizontal ship, vertical ship masks, shift plans)
 
-    coord_str = coord_str.strip().upper()
-    if (len(coord_str)) > 3:
-        raise ValueError
+    def __init__(self, size=BOARD_SIZE, rng=None):
+        self.size = size
+        self.rng = rng if rng is not None else random.Random()
+        if size not in FleetPlacer.masks:
+            full = (1 << (size * size)) - 1
+            # cells a horizontal ship of length n can start on without leaving its row
+            row_starts = [sum(((1 << (size - n + 1)) - 1) << (r * size) for r in range(size)) if n <= size else 0
+                          for n in range(size + 1)]
+            horizontal = [(1 << n) - 1 for n in range(size + 1)]
+            vertical = [sum(1 << (k * size) for k in range(n)) for n in range(size + 1)]
+            shifts = [FleetPlacer.shift_plan(n) for n in range(size + 1)]
+            FleetPlacer.masks[size] = (full, row_starts, horizontal, vertical, shifts)
+        self.full, self.row_starts, self.horizontal, self.vertical, self.shifts = FleetPlacer.masks[size]
+
+    @staticmethod
+    def shift_plan(ship_size):
+        """
+        Shifts that turn a free mask into a mask of runs of ship_size free cells: the run length
+        doubles with each shift, and a last shorter one tops it up to exactly ship_size.
+        """
+        shifts = []
+        span = 1
+        while span * 2 <= ship_size:
+            shifts.append(span)
+            span *= 2
+        if span < ship_size:
+            shifts.append(ship_size - span)
+        return shifts
+
+    def legal_starts(self, occupied, ship_size):
+        """
+        Masks of the cells a ship can start on horizontally and vertically.
+        """
+        free = self.full & ~occupied
+        across = down = free
+        # after each step a set bit means that many free cells start there, doubling each time
+        for shift in self.shifts[ship_size]:
+            across &= across >> shift
+            down &= down >> (shift * self.size)
+        if ship_size == 1: # both orientations cover the same cell, count it once
+            down = 0
+        return across & self.row_starts[ship_size], down
+
+    def place(self, ships=SHIPS, occupied=0):
+        """
+        Pick a placement for every (name, size) in ships, avoiding the cells set in occupied.
+        Returns a list of (name, row, col, size, orientation), the arguments of Board.place_ship().
+        """
+        if any(ship_size < 1 or ship_size > self.size for _, ship_size in ships):
+            raise ValueError("a ship is longer than the board")
+        if sum(ship_size for _, ship_size in ships) > (self.full & ~occupied).bit_count():
+            raise ValueError("the fleet covers more cells than the board has free")
+
+        placements = []
+        masks = [] # cells covered by each placed ship
+        untried = [] # legal starts of each placed ship that haven't been tried yet
+        dead = set() # (ship index, occupied cells) that no placement of the remaining ships fits
+        draw = self.rng.random
+        across, down = self.legal_starts(occupied, ships[0][1])
+        i = 0
+        while i < len(ships):
+            name, ship_size = ships[i]
+            num_across = across.bit_count()
+            total = num_across + down.bit_count()
+            if total == 0:
+                if i == 0: # every option has been tried
+                    raise ValueError("the fleet can't fit on the board")
+                dead.add((i, occupied))
+                # move the previous ship somewhere else
+                i -= 1
+                placements.pop()
+                occupied ^= masks.pop()
+                across, down = untried.pop()
+                continue
+
+            pick = int(draw() * total)
+            if pick < num_across:
+                start = nth_set_bit(across, pick)
+                across ^= 1 << start
+                orientation, mask = 0, self.horizontal[ship_size] << start
+            else:
+                start = nth_set_bit(down, pick - num_across)
+                down ^= 1 << start
+                orientation, mask = 1, self.vertical[ship_size] << start
+
+            row, col = divmod(start, self.size)
+            placements.append((name, row, col, ship_size, orientation))
+            masks.append(mask)
+            untried.append((across, down))
+            occupied |= mask
+            i += 1
+            if i < len(ships):
+                if dead and (i, occupied) in dead:
+                    across = down = 0
+                else:
+                    across, down = self.legal_starts(occupied, ships[i][1])
+        return placements
 
-    row_letter = coord_str[0]
-    if (row_letter not in valid_letters):
-        raise ValueError
+# popcount and set bit positions of every byte, for nth_set_bit()
+BYTE_COUNTS = [bin(byte).count("1") for byte in range(256)]
+BYTE_BITS = [[i for i in range(8) if byte >> i & 1] for byte in range(256)]
 
-    col_digits = coord_str[1:]
-    if (col_digits not in valid_numbers):
-        raise ValueError
+def nth_set_bit(mask, n):
+    """
+    Index of the n-th (from 0) lowest set bit of mask, counted a byte at a time.
+    """
+    index = 0
+    for byte in mask.to_bytes((mask.bit_length() + 7) // 8, "little"):
+        count = BYTE_COUNTS[byte]
+        if n < count:
+            return index + BYTE_BITS[byte][n]
+        n -= count
+        index += 8
+    raise ValueError("mask has fewer set bits than n")
+
+def ship_cells(row, col, ship_size, orientation):
+    """
+    The (r, c) cells a ship covers, from its first cell.
+    """
+    if orientation == 0:  # Horizontal
+        return [(row, c) for c in range(col, col + ship_size)]
+    return [(r, col) for r in range(row, row + ship_size)]
 
-    row = ord(row_letter) - ord('A')
-    col = int(col_digits) - 1  # zero-based
+def parse_coordinate(coord_str, size=BOARD_SIZE):
+    """
+    Convert something like 'B5' into zero-based (row, col) on a board of the given size.
+    Example: 'A1' => (0, 0), 'C10' => (2, 9), 'AA3' => (26, 2) on boards with more than 26 rows
+    """
+    return CoordinateCodec.for_size(size).parse(coord_str)
 
-    return (row, col)
+def parse_fleet(spec):
+    """
+    Convert a fleet written as 'Name:size,Name:size,...' (e.g. 'Carrier:5,Destroyer:2') into a
+    list of (name, size) like SHIPS. Raises ValueError if a ship is malformed or the fleet is empty.
+    """
+    ships = []
+    for entry in spec.split(','):
+        name, sep, ship_size = entry.partition(':')
+        name = name.strip()
+        if not sep or not name or not ship_size.strip().isdigit() or int(ship_size) < 1:
+            raise ValueError(f"expected Name:size, got {entry.strip()!r}")
+        ships.append((name, int(ship_size)))
+    if not ships:
+        raise ValueError("the fleet has no ships")
+    return ships
 
 def run_single_player_game_locally():
     """
@@ -279,7 +729,7 @@ def run_single_player_game_locally():
             return
 
         try:
-            row, col = parse_coordinate(guess)
+            row, col = board.codec.parse(guess)
             result, sunk_name = board.fire_at(row, col)
             moves += 1
 
@@ -318,11 +768,10 @@ def run_single_player_game_online(rfile, wfile):
 
     def send_board(board):
         wfile.write("GRID\n")
-        wfile.write("  " + " ".join(str(i + 1).rjust(2) for i in range(board.size)) + '\n')
+        wfile.write(" " * board.codec.label_width + board.codec.column_header + '\n')
         for r in range(board.size):
-            row_label = chr(ord('A') + r)
             row_str = " ".join(board.display_grid[r][c] for c in range(board.size))
-            wfile.write(f"{row_label:2} {row_str}\n")
+            wfile.write(f"{board.codec.padded_labels[r]} {row_str}\n")
         wfile.write('\n')
         wfile.flush()
 
@@ -344,7 +793,7 @@ def run_single_player_game_online(rfile, wfile):
             return
 
         try:
-            row, col = parse_coordinate(guess)
+            row, col = board.codec.parse(guess)
             result, sunk_name = board.fire_at(row, col)
             moves += 1
 
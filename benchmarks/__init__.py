@@ -0,0 +1,6 @@
+"""
+benchmarks
+
+Standalone benchmark scripts for the protocol, game and server code.
+Run each one from the repository root, e.g. `python -m benchmarks.crc`.
+"""
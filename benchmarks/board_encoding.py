@@ -0,0 +1,105 @@
+"""
+benchmarks/board_encoding.py
+
+The binary board snapshot (2 bits per cell, 25 bytes for a 10x10 board) against the text board:
+ - encode/decode: boards/sec the server turns into each payload (after one shot, so a row has
+   to be rendered again) and boards/sec a client loads into a BoardView
+ - bytes on the wire: BOARD bytes each client receives over one full scripted game in every
+   board format ("text", "delta" and "binary")
+
+Before timing it checks that a binary snapshot loads into the same board as the text one, for
+both views of boards from 10x10 to 100x100.
+
+Usage: python -m benchmarks.board_encoding [--sizes 10 30 100] [--game-sizes 10 20] [--time 1]
+"""
+
+import argparse
+import random
+import time
+
+import server
+from battleship import SHIPS, Board
+from benchmarks.inprocess import RecordingConn, play_scripted_game
+from protocol import *
+
+def make_board(size, rng):
+    # a fleet covering about a sixth of the board with a third of the cells shot
+    board = Board(size)
+    board.place_ships_randomly(SHIPS * max(1, size * size // 6 // 17), rng)
+    for _ in range(size * size // 3):
+        board.fire_at(rng.randrange(size), rng.randrange(size))
+    return board
+
+def check(game, sizes, rng):
+    for size in sizes:
+        board = make_board(size, rng)
+        for show_hidden in (True, False):
+            text = game.board_to_str(board, show_hidden)
+            payload = game.board_snapshot(board, show_hidden, "binary", "0h", board.version)
+            assert len(payload.partition("|")[2]) == (size * size + 3) // 4
+            _, _, _, version, body = decode_board_payload(payload)
+            view = BoardView()
+            view.load_binary(version, *body)
+            assert "|".join(view.lines() + [""]) == text, f"{size}x{size} binary board differs"
+
+def per_sec(func, min_time):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        for _ in range(20):
+            func()
+        count += 20
+    return count / (time.perf_counter() - start)
+
+def encode_decode(game, size, rng, min_time):
+    board = make_board(size, rng)
+    cells = [(r, c) for r in range(size) for c in range(size)]
+
+    def shot():
+        board.cell_changed(*rng.choice(cells)) # forget a row as a shot would, without running out of cells
+
+    text = game.board_to_str(board)
+    binary = game.board_snapshot(board, False, "binary", "0d", board.version)
+    _, _, _, version, body = decode_board_payload(binary)
+    view = BoardView()
+    return (
+        len(text), len(binary),
+        per_sec(lambda: (shot(), game.board_to_str(board)), min_time),
+        per_sec(lambda: (shot(), game.board_snapshot(board, False, "binary", "0d", board.version)), min_time),
+        per_sec(lambda: view.load(0, text), min_time),
+        per_sec(lambda: view.load_binary(version, *body), min_time),
+    )
+
+def board_bytes(client):
+    messages = FrameDecoder().feed(bytes(client.conn.sent))
+    return sum(HEADER_SIZE + len(msg.msg) for msg in messages if msg.type == MessageType.BOARD)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 30, 100])
+    parser.add_argument("--game-sizes", type=int, nargs="+", default=[10, 20])
+    parser.add_argument("--seed", type=int, default=3002)
+    parser.add_argument("--time", type=float, default=1, help="seconds per measurement")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    game = server.Game() # only used to render boards, its thread is never started
+    check(game, args.sizes, rng)
+    print("binary snapshots load into the same boards as the text ones")
+
+    print(f"{'board':>8} {'text B':>7} {'binary B':>9} {'text enc/s':>11} {'binary enc/s':>13} {'text dec/s':>11} {'binary dec/s':>13}")
+    for size in args.sizes:
+        text_len, binary_len, text_enc, binary_enc, text_dec, binary_dec = encode_decode(game, size, rng, args.time / 4)
+        print(f"{f'{size}x{size}':>8} {text_len:>7} {binary_len:>9} {text_enc:>11.0f} {binary_enc:>13.0f} {text_dec:>11.0f} {binary_dec:>13.0f}")
+
+    print()
+    print("BOARD bytes received over one scripted game")
+    print(f"{'board':>8} {'client':>10} " + " ".join(f"{board_format:>8}" for board_format in BOARD_FORMATS))
+    for size in args.game_sizes:
+        results = {board_format: play_scripted_game(1, RecordingConn, board_size=size, board_format=board_format)
+                   for board_format in BOARD_FORMATS}
+        for i, role in enumerate(("player", "player", "spectator")):
+            print(f"{f'{size}x{size}':>8} {role:>10} " + " ".join(f"{board_bytes(clients[i]):>8}" for clients in results.values()))
+
+if __name__ == "__main__":
+    main()
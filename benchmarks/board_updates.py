@@ -0,0 +1,63 @@
+"""
+benchmarks/board_updates.py
+
+BOARD bytes on the wire over one full scripted game with delta board updates (each client
+gets a snapshot of a board once and then only the cells that changed, the "delta" board
+format) against sending the whole board text every time, as "text" clients still get.
+
+Every BOARD message each client received is replayed into BoardViews, the client's local
+copies, which must apply without falling out of step and match the server's boards as of
+the version they reached.
+
+Boards over 511 bytes were cut off by Message.encode() before fragmentation, so the cost
+of whole boards is shown both truncated as it was and in full.
+
+Usage: python -m benchmarks.board_updates [--sizes 10 20] [--spectators 2]
+"""
+
+import argparse
+
+from benchmarks.inprocess import RecordingConn, play_scripted_game, received_messages
+from protocol import *
+
+def replay(client):
+    # BOARD messages the client received with their bytes on the wire, and its BoardViews after applying them
+    messages = [(msg, size) for msg, size in received_messages(client) if msg.type == MessageType.BOARD]
+    views = {}
+    for msg, _ in messages:
+        kind, key, base, version, body = decode_board_payload(msg.msg)
+        if kind == BOARD_SNAPSHOT:
+            views.setdefault(key, BoardView()).load(version, body)
+        else:
+            assert kind == BOARD_DELTA, "plain board text"
+            assert key in views and views[key].apply(base, version, body), f"delta {msg.msg!r} out of step"
+    return messages, views
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 20])
+    parser.add_argument("--spectators", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{'board':>8} {'client':>10} {'BOARDs':>7} {'delta bytes':>12} {'full bytes':>11} {'(untruncated)':>14} {'saving':>7}")
+    for size in args.sizes:
+        clients = play_scripted_game(args.spectators, RecordingConn, board_size=size, board_format="delta")
+        game = clients[0].game
+        board_text = len(game.board_to_str(game.players[0].board)) # every board of a size renders to the same length
+        for i, client in enumerate(clients[:3]):
+            role = "player" if i < 2 else "spectator"
+            messages, views = replay(client)
+            for key, view in views.items():
+                # the copy is the board as of its version, every cell changed since then is allowed to differ
+                board = game.players[int(key[0])].board
+                changed = set(board.changes[view.version:])
+                for r in range(size):
+                    for c in range(size):
+                        assert (r, c) in changed or view.cells[r][c] == board.cell_state(r, c, key[1] == "h"), f"{key} differs"
+            sent = sum(size for _, size in messages)
+            full = len(messages) * (HEADER_SIZE + min(511, board_text))
+            untruncated = len(messages) * (HEADER_SIZE + board_text)
+            print(f"{f'{size}x{size}':>8} {role:>10} {len(messages):>7} {sent:>12} {full:>11} {untruncated:>14} {full/sent:>6.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+benchmarks/boards.py
+
+Board backends from battleship.py (the character grid Board and the integer bitmask
+BitBoard) over the same fleets and shot orders:
+ - fleets placed per second (can_place_ship + placement for every ship)
+ - shots per second, where every shot is fire_at() followed by the all_ships_sunk()
+   check the server makes after each turn
+
+Before timing, both backends play every fleet and must return identical results.
+
+Usage: python -m benchmarks.boards [--shots 2000000] [--fleets 200] [--seed 3002]
+"""
+
+import argparse
+import random
+import time
+
+from battleship import BOARD_BACKENDS, BOARD_SIZE, SHIPS
+
+def random_fleets(count, rng):
+    # (name, row, col, size, orientation) for every ship, drawn the way place_ships_randomly() does
+    fleets = []
+    for _ in range(count):
+        board = BOARD_BACKENDS["grid"]()
+        fleet = []
+        for name, size in SHIPS:
+            while True:
+                placement = (name, rng.randint(0, BOARD_SIZE - 1), rng.randint(0, BOARD_SIZE - 1), size, rng.randint(0, 1))
+                if board.place_ship(*placement):
+                    fleet.append(placement)
+                    break
+        fleets.append(fleet)
+    return fleets
+
+def shot_orders(count, rng):
+    cells = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE)]
+    orders = []
+    for _ in range(count):
+        rng.shuffle(cells)
+        orders.append(list(cells) + cells[:10]) # finish with some repeated shots
+    return orders
+
+def play(board_type, fleet, shots):
+    board = board_type()
+    for placement in fleet:
+        board.place_ship(*placement)
+    return [(board.fire_at(r, c), board.all_ships_sunk()) for r, c in shots], board
+
+def placements_per_sec(board_type, fleets, min_time=0.2, repeats=3):
+    best = 0
+    for _ in range(repeats):
+        placed = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < min_time:
+            for fleet in fleets:
+                board = board_type()
+                for placement in fleet:
+                    board.place_ship(*placement)
+            placed += len(fleets)
+        best = max(best, placed / (time.perf_counter() - start))
+    return best
+
+def shots_per_sec(board_type, fleets, orders, total_shots, repeats=3):
+    # best of a few runs, so other processes on the machine don't decide the result
+    best = 0
+    for _ in range(repeats):
+        fired = 0
+        start = time.perf_counter()
+        while fired < total_shots / repeats:
+            for fleet, shots in zip(fleets, orders):
+                board = board_type()
+                for placement in fleet:
+                    board.place_ship(*placement)
+                for r, c in shots:
+                    board.fire_at(r, c)
+                    board.all_ships_sunk()
+                fired += len(shots)
+        best = max(best, fired / (time.perf_counter() - start))
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shots", type=int, default=2_000_000, help="shots fired per backend")
+    parser.add_argument("--fleets", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=3002)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fleets = random_fleets(args.fleets, rng)
+    orders = shot_orders(args.fleets, rng)
+
+    # every backend must agree with the original Board
+    for fleet, shots in zip(fleets, orders):
+        expected, reference = play(BOARD_BACKENDS["grid"], fleet, shots)
+        for name, board_type in BOARD_BACKENDS.items():
+            results, board = play(board_type, fleet, shots)
+            assert results == expected, f"{name} disagrees with grid"
+            assert board.hidden_grid == reference.hidden_grid and board.display_grid == reference.display_grid
+            assert board.placed_ships == reference.placed_ships
+
+    print(f"{args.fleets} fleets, {args.shots} shots per backend")
+    print(f"{'backend':>9} {'fleets placed/s':>16} {'shots/s':>12} {'speedup':>8}")
+    baseline = None
+    for name, board_type in BOARD_BACKENDS.items():
+        placed = placements_per_sec(board_type, fleets)
+        rate = shots_per_sec(board_type, fleets, orders, args.shots)
+        baseline = baseline or rate
+        print(f"{name:>9} {placed:>16.0f} {rate:>12.0f} {rate/baseline:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
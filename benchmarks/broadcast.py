@@ -0,0 +1,58 @@
+"""
+benchmarks/broadcast.py
+
+Per-recipient cost of broadcasting one message to many spectators: the old path
+(copy + encode for every client through send_message_to) against send_message_to_all,
+which encodes once and only patches the sequence number.
+
+Usage: python -m benchmarks.broadcast [--spectators N] [--payloads 16,230,511]
+"""
+
+import argparse
+import time
+
+import server
+from benchmarks.inprocess import RecordingConn, make_clients
+from protocol import *
+
+def per_recipient_us(broadcast, clients, msg, min_time=0.5):
+    rounds = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < min_time:
+        broadcast(clients, msg)
+        for client in clients: # keep the send windows from growing between rounds
+            client.send_window.clear()
+        rounds += 1
+        elapsed = time.perf_counter() - start
+    return elapsed / (rounds*len(clients)) * 1e6
+
+def send_each(clients, msg):
+    for client in clients:
+        server.send_message_to(client, msg)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spectators", type=int, default=100)
+    parser.add_argument("--payloads", default="16,230,511", help="comma separated payload sizes in bytes")
+    args = parser.parse_args()
+
+    # both paths must put identical bytes on the wire
+    old_clients, new_clients = make_clients(3, RecordingConn), make_clients(3, RecordingConn)
+    check = Message(server.SERVER_ID, MessageType.BOARD, MessageType.CHAT, "B"*230)
+    for _ in range(3):
+        send_each(old_clients, check)
+        server.send_message_to_all(new_clients, check)
+    assert all(o.conn.sent == n.conn.sent for o, n in zip(old_clients, new_clients))
+
+    clients = make_clients(args.spectators)
+    print(f"{args.spectators} recipients")
+    print(f"{'payload':>8} {'per-client encode (us)':>23} {'encode once (us)':>17} {'speedup':>8}")
+    for size in (int(p) for p in args.payloads.split(",")):
+        msg = Message(server.SERVER_ID, MessageType.BOARD, MessageType.CHAT, "B"*size)
+        old = per_recipient_us(send_each, clients, msg)
+        new = per_recipient_us(server.send_message_to_all, clients, msg)
+        print(f"{size:>8} {old:>23.2f} {new:>17.2f} {old/new:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
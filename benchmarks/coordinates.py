@@ -0,0 +1,90 @@
+"""
+benchmarks/coordinates.py
+
+Coordinate parsing as the board grows, with the CoordinateCodec (one dictionary lookup per
+coordinate, names built once per size) against the old parse_coordinate() that scanned
+"ABCDEFGHIJ" and the list of column numbers. Board rendering is in benchmarks/rendering.py.
+
+Before timing it checks that the codec agrees with the old parser on every input the old
+parser accepted or rejected on a 10x10 board, and that every name on a 100x100 board
+round-trips through parse() and format().
+
+Usage: python -m benchmarks.coordinates [--sizes 10 26 52 100] [--time 1]
+"""
+
+import argparse
+import itertools
+import random
+import time
+
+from battleship import BOARD_SIZE
+from coordinates import CoordinateCodec
+
+def old_parse_coordinate(coord_str):
+    # the original parse_coordinate(), 10x10 only
+    valid_letters = "ABCDEFGHIJ"
+    valid_numbers = ['1','2','3','4','5','6','7','8','9','10']
+
+    coord_str = coord_str.strip().upper()
+    if (len(coord_str)) > 3:
+        raise ValueError
+    row_letter = coord_str[0]
+    if (row_letter not in valid_letters):
+        raise ValueError
+    col_digits = coord_str[1:]
+    if (col_digits not in valid_numbers):
+        raise ValueError
+    return (ord(row_letter) - ord('A'), int(col_digits) - 1)
+
+def outcome(parse, text):
+    try:
+        return parse(text)
+    except ValueError:
+        return None
+
+def check():
+    codec = CoordinateCodec.for_size(BOARD_SIZE)
+    characters = "ABJKZabj0123456789 X"
+    inputs = ["".join(p) for n in range(1, 4) for p in itertools.product(characters, repeat=n)]
+    inputs = [text for text in inputs if text.strip()] # the old parser raised IndexError on blank input
+    mismatches = [text for text in inputs if outcome(old_parse_coordinate, text) != outcome(codec.parse, text)]
+    assert not mismatches, f"codec disagrees with the old parser on {mismatches[:5]}"
+
+    big = CoordinateCodec.for_size(100)
+    for r in range(big.size):
+        for c in range(big.size):
+            assert big.parse(big.format(r, c).lower()) == (r, c)
+    assert len(big.cells) == big.size * big.size, "duplicate coordinate names"
+    print(f"codec matches the old parser on {len(inputs)} inputs, 100x100 names round-trip ({big.names[-1][-1]} is the last cell)")
+
+def per_sec(func, items, min_time):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        for item in items:
+            func(item)
+        count += len(items)
+    return count / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 26, 52, 100])
+    parser.add_argument("--time", type=float, default=1, help="seconds per measurement")
+    args = parser.parse_args()
+
+    check()
+
+    rng = random.Random(3002)
+    print(f"{'board':>8} {'codec build ms':>15} {'old parse/s':>12} {'parse/s':>12}")
+    for size in args.sizes:
+        CoordinateCodec.codecs.pop(size, None)
+        start = time.perf_counter()
+        codec = CoordinateCodec.for_size(size)
+        build = (time.perf_counter() - start) * 1000
+        names = [codec.format(rng.randrange(size), rng.randrange(size)) for _ in range(1000)]
+        old_parse = per_sec(lambda text: outcome(old_parse_coordinate, text), names, args.time / 2) if size <= BOARD_SIZE else float("nan")
+        new_parse = per_sec(codec.parse, names, args.time / 2)
+        print(f"{f'{size}x{size}':>8} {build:>15.2f} {old_parse:>12.0f} {new_parse:>12.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+benchmarks/crc.py
+
+Reports how many packets per second the table-driven crc32() and the original bit-by-bit
+routine can checksum. tests/test_crc.py checks that the two agree.
+
+Usage: python -m benchmarks.crc [--packets N] [--seed S]
+"""
+
+import argparse
+import random
+import time
+
+from protocol import crc32, crc32_bitwise
+
+def random_packets(count, rng):
+    # header (seq + type byte + id/len) followed by 0..511 bytes of payload
+    packets = []
+    for _ in range(count):
+        size = 5 + rng.randint(0, 511)
+        packets.append(bytes(rng.getrandbits(8) for _ in range(size)))
+    return packets
+
+def packets_per_second(func, packets, min_time=0.5):
+    done = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < min_time:
+        for pack in packets:
+            func(pack)
+        done += len(packets)
+        elapsed = time.perf_counter() - start
+    return done / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--packets", type=int, default=2000, help="number of random packets to checksum")
+    parser.add_argument("--seed", type=int, default=3002)
+    args = parser.parse_args()
+
+    packets = random_packets(args.packets, random.Random(args.seed))
+    legacy = packets_per_second(crc32_bitwise, packets[:200])
+    table = packets_per_second(crc32, packets)
+    print(f"crc32_bitwise: {legacy:>14,.0f} packets/sec")
+    print(f"crc32 (table): {table:>14,.0f} packets/sec  ({table/legacy:,.0f}x)")
+
+if __name__ == "__main__":
+    main()
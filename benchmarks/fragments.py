@@ -0,0 +1,135 @@
+"""
+benchmarks/fragments.py
+
+Throughput of 64 KB messages split into fragments by Message.fragments() and joined again by a
+Reassembler (129 frames each: 128 FRAGMENT frames of 511 bytes and a final DATA frame):
+ - in-process: fragmenting and encoding, then decoding and reassembling
+ - over a loopback socket: server.send_message_to() streaming fragments out through the client's
+   outbox while a reader thread decodes and reassembles them, as client.py does
+
+Before timing it checks that payloads of every length around the fragment size come back intact,
+that a payload produced in small chunks is fragmented the same way, and that a message larger than
+the reassembly limit is dropped without holding more than the limit.
+
+Usage: python -m benchmarks.fragments [--size 65536] [--messages 200] [--time 1]
+"""
+
+import argparse
+import random
+import socket
+import threading
+import time
+
+import server
+from protocol import *
+
+def payload(rng, size):
+    # ASCII, so the text is as many bytes long as it has characters
+    return bytes(rng.randrange(128) for _ in range(size)).decode("ascii")
+
+def round_trip(text):
+    msg = Message(1, MessageType.CHAT, MessageType.TEXT, text)
+    data = b"".join(frame.encode() for frame in msg.fragments())
+    reassembler = Reassembler()
+    whole = [m for m in map(reassembler.add, FrameDecoder().feed(data)) if m is not None]
+    return whole
+
+def check(rng, size):
+    for length in (0, 1, MAX_PAYLOAD - 1, MAX_PAYLOAD, MAX_PAYLOAD + 1, 2*MAX_PAYLOAD, 2*MAX_PAYLOAD + 1, size):
+        text = payload(rng, length)
+        whole = round_trip(text)
+        assert len(whole) == 1 and whole[0].msg == text, f"{length} byte message came back wrong"
+
+    text = payload(rng, size)
+    chunks = [text[i:i+37] for i in range(0, size, 37)]
+    chunked = [frame.data for frame in fragment_message(1, MessageType.CHAT, MessageType.TEXT, chunks)]
+    assert chunked == [frame.data for frame in Message(1, MessageType.CHAT, MessageType.TEXT, text).fragments()]
+
+    limit = 4*size
+    reassembler = Reassembler(limit)
+    held = 0
+    for frame in Message(1, MessageType.CHAT, MessageType.TEXT, "x" * (limit + size)).fragments():
+        assert reassembler.add(frame) is None
+        held = max(held, reassembler.size)
+    assert held <= limit and reassembler.dropped == 1 and not reassembler.pending()
+    print(f"messages of 0 to {size} bytes round-trip, a {limit + size} byte message over a {limit} byte limit "
+          f"is dropped holding at most {held} bytes")
+
+def in_process(text, min_time):
+    msg = Message(1, MessageType.CHAT, MessageType.TEXT, text)
+    frames = [frame.encode() for frame in msg.fragments()]
+    data = b"".join(frames)
+
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        for frame in msg.fragments():
+            frame.encode()
+        count += 1
+    encode = count * len(text) / (time.perf_counter() - start)
+
+    count = 0
+    decoder = FrameDecoder()
+    reassembler = Reassembler()
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        for frame in decoder.feed(data):
+            reassembler.add(frame)
+        count += 1
+    decode = count * len(text) / (time.perf_counter() - start)
+    return len(frames), len(data), encode, decode
+
+def loopback(text, messages):
+    # seconds to deliver every message, and to the first whole message
+    ours, theirs = socket.socketpair()
+    client = server.Client(ours, ("loopback", 0))
+    client.id = 1
+    received = []
+
+    def reader():
+        decoder = FrameDecoder()
+        reassembler = Reassembler()
+        while len(received) < messages:
+            if not decoder.fill_from(theirs, 1<<16):
+                return
+            for frame in decoder.decode_frames():
+                whole = reassembler.add(frame)
+                if whole is not None:
+                    received.append((time.perf_counter(), whole.msg_len))
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    msg = Message(server.SERVER_ID, MessageType.CHAT, MessageType.CHAT, text)
+    start = time.perf_counter()
+    for _ in range(messages):
+        with server.SendBatch():
+            server.send_message_to(client, msg)
+        client.send_window.clear() # nothing acknowledges these frames
+    thread.join()
+    ours.close()
+    theirs.close()
+    assert all(size == len(text) for _, size in received)
+    return received[-1][0] - start, received[0][0] - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1<<16, help="bytes per message")
+    parser.add_argument("--messages", type=int, default=200, help="messages sent over the loopback socket")
+    parser.add_argument("--seed", type=int, default=3002)
+    parser.add_argument("--time", type=float, default=1, help="seconds per in-process measurement")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    check(rng, args.size)
+    text = payload(rng, args.size)
+
+    frames, wire, encode, decode = in_process(text, args.time)
+    print(f"{args.size} byte message: {frames} frames, {wire} bytes on the wire ({wire/args.size - 1:.1%} overhead)")
+    print(f"in-process: fragment + encode {encode/1e6:.1f} MB/s, decode + reassemble {decode/1e6:.1f} MB/s")
+
+    total, first = loopback(text, args.messages)
+    print(f"loopback: {args.messages} messages in {total*1000:.0f} ms, {args.messages*args.size/total/1e6:.1f} MB/s, "
+          f"{args.messages/total:.0f} messages/s, first message whole after {first*1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+benchmarks/framing.py
+
+Compares the old `incoming = incoming[9+msg_len:]` reslicing loop with FrameDecoder when
+bursts of N frames arrive in a single read, reporting decoded frames per second. Reads of one
+to a few dozen frames, the interactive case, come out about even; FrameDecoder wins on large bursts.
+
+Usage: python -m benchmarks.framing [--payload BYTES] [--bursts 1,4,16,64,256,1024,4096]
+"""
+
+import argparse
+import time
+
+from protocol import *
+
+def reslice_decode(incoming, raw):
+    # the loop server.handle_client() and client.receive_messages() used before FrameDecoder
+    incoming += bytearray(raw)
+    messages = []
+    while len(incoming) >= 9:
+        try:
+            msg = Message.decode(incoming)
+            incoming = incoming[9+msg.msg_len:]
+            messages.append(msg)
+        except NotEnoughBytesError:
+            break
+    return incoming, messages
+
+def frames_per_second(run, burst, frames_per_burst, min_time=0.5):
+    done = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < min_time:
+        run(burst)
+        done += frames_per_burst
+        elapsed = time.perf_counter() - start
+    return done / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payload", type=int, default=230, help="payload bytes per frame (a 10x10 BOARD is ~230)")
+    parser.add_argument("--bursts", default="1,4,16,64,256,1024,4096", help="comma separated frames per read")
+    args = parser.parse_args()
+
+    frame = Message(0, MessageType.BOARD, MessageType.FIRE, "x"*args.payload).encode()
+    print(f"{'burst':>6} {'reslice frames/s':>18} {'FrameDecoder frames/s':>22} {'speedup':>8}")
+    for burst_size in (int(b) for b in args.bursts.split(",")):
+        burst = frame*burst_size
+
+        def run_reslice(data):
+            incoming, messages = reslice_decode(bytearray(), data)
+            assert len(messages) == burst_size and not incoming
+
+        decoder = FrameDecoder()
+        def run_decoder(data):
+            messages = decoder.feed(data)
+            assert len(messages) == burst_size and not decoder.pending()
+
+        old = frames_per_second(run_reslice, burst, burst_size)
+        new = frames_per_second(run_decoder, burst, burst_size)
+        print(f"{burst_size:>6} {old:>18,.0f} {new:>22,.0f} {new/old:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+benchmarks/hostile_sender.py
+
+Stress test of the server's receive window against a client that sends garbage sequence numbers.
+A client in a room floods the server, in reads of --read frames each handled as handle_client() does:
+ - ahead: CHAT frames with random seqs up to 32767 ahead of the next one expected, never that one
+ - filler: a CHAT frame for every seq in the window except the next one expected
+ - stale: resends of frames the server has already processed
+ - burst: a well-behaved sender whose first frame is lost in a burst longer than the window, the rest
+   has to be recovered from the server's NACKs alone
+
+For each flood it reports the frames and payload bytes the window held at most (against the frames
+keeping everything ahead would have held), the ACK/NACK frames the server wrote back and the time per
+frame. After every flood the client sends chat in order and
+the other client in the room has to receive it, in order, exactly once.
+
+Usage: python -m benchmarks.hostile_sender [--frames 100000] [--read 32]
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import time
+
+import server
+from benchmarks.inprocess import RecordingConn, make_clients, received_messages
+from protocol import *
+
+def replies(client):
+    # ACK and NACK frames the server has written to the client since the last call
+    frames = [frame for frame in FrameDecoder().feed(bytes(client.conn.sent)) if frame.packet_type in (PacketType.ACK, PacketType.NACK)]
+    client.conn.sent = bytearray()
+    return frames
+
+def chat(client, seq, text):
+    return Message(client.id, MessageType.CHAT, MessageType.CHAT, text, seq=seq)
+
+def deliver(client, frames, read, peak=None):
+    # hand the server the frames a read at a time, peak["frames"] and peak["bytes"] get the most its window held
+    peak = {"frames": 0, "bytes": 0} if peak is None else peak
+    for start in range(0, len(frames), read):
+        with server.SendBatch():
+            server.receive_frames(client, frames[start:start+read])
+            if len(client.recv_window) > peak["frames"] or start % (64 * read) == 0:
+                peak["frames"] = max(peak["frames"], len(client.recv_window))
+                peak["bytes"] = max(peak["bytes"], sum(msg.msg_len for msg in client.recv_window.messages(client.seq_r)))
+            server.process_client_messages(client)
+    return peak
+
+def check_chat(sender, listener, count):
+    # The sender's next count seqs reach the other client in order, once each. Frames of the flood still
+    # held in the window were the sender's own, they go out in place of the new ones with the same seq.
+    listener.conn.sent = bytearray()
+    frames = [chat(sender, seq_add(sender.seq_r, i), f"after the flood {i}") for i in range(count)]
+    expected = [(sender.recv_window.get(frame.seq) or frame).msg for frame in frames]
+    deliver(sender, frames, 8)
+    got = [msg.msg for msg, _ in received_messages(listener) if msg.type == MessageType.CHAT]
+    assert got == [f"[{sender.username}]: {text}" for text in expected], "chat after the flood was lost or reordered"
+    assert len(sender.recv_window) == 0, "frames left in the window"
+    replies(sender)
+
+def flood(kind, client, frames, rng):
+    size = len(client.recv_window.slots)
+    seq_r = client.seq_r
+    if kind == "ahead":
+        seqs = [seq_add(seq_r, rng.randrange(1, 1<<15)) for _ in range(frames)]
+        return [chat(client, seq, f"flood {seq} " + "x" * 400) for seq in seqs], len(set(seqs))
+    if kind == "filler":
+        return [chat(client, seq_add(seq_r, offset), f"flood {offset} " + "x" * 400) for offset in range(1, size)], size - 1
+    if kind == "stale":
+        return [chat(client, seq_add(seq_r, -rng.randrange(1, 1<<15)), "x") for _ in range(frames)], 0
+    raise ValueError(kind)
+
+def burst(client, frames, read):
+    # frames seq_r .. seq_r+frames-1 with the first lost, then only what the server NACKs is resent
+    first = client.seq_r
+    sent = {seq_add(first, i): chat(client, seq_add(first, i), f"burst {i}") for i in range(frames)}
+    peak = deliver(client, list(sent.values())[1:], read)
+    resend = [sent[first]]
+    rounds = 0
+    answered = 0 # ACKs and NACKs
+    while resend:
+        rounds += 1
+        assert rounds < frames, "the burst was never recovered"
+        deliver(client, resend, read, peak)
+        resend = []
+        for reply in replies(client):
+            answered += 1
+            if reply.packet_type == PacketType.NACK:
+                seq, count = nack_range(reply)
+                resend += [sent[seq_add(seq, i)] for i in range(count) if seq_add(seq, i) in sent]
+    assert client.seq_r == seq_add(first, frames), "the burst wasn't processed in full"
+    return peak, rounds, answered
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=100000, help="frames in each flood")
+    parser.add_argument("--read", type=int, default=32, help="frames per read")
+    parser.add_argument("--seed", type=int, default=3002)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    game = server.Game() # never started, nothing but chat is sent
+    hostile, listener = make_clients(2, RecordingConn, game)
+    for client in (hostile, listener):
+        game.registry.add(client)
+    hostile.seq_r = SEQ_MASK - 100 # wraps during the run
+
+    print(f"{'flood':>7} {'frames':>7} {'held max':>9} {'unbounded':>10} {'KB held max':>12} {'ACKs+NACKs':>11} {'us/frame':>9}")
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        results = []
+        for kind in ("ahead", "filler", "stale", "burst"):
+            start = time.perf_counter()
+            if kind == "burst":
+                frames = 4 * len(hostile.recv_window.slots)
+                peak, rounds, answered = burst(hostile, frames, args.read)
+                unbounded = frames - 1
+            else:
+                messages, unbounded = flood(kind, hostile, args.frames, rng)
+                frames = len(messages)
+                peak = deliver(hostile, messages, args.read)
+            elapsed = time.perf_counter() - start
+            sent = len(replies(hostile)) if kind != "burst" else answered
+            check_chat(hostile, listener, 2 * len(hostile.recv_window.slots))
+            assert peak["frames"] <= len(hostile.recv_window.slots), "the window held more frames than it has slots"
+            results.append((kind, frames, peak, unbounded, sent, elapsed / frames))
+    assert "Traceback" not in log.getvalue()
+
+    for kind, frames, peak, unbounded, sent, seconds in results:
+        print(f"{kind:>7} {frames:>7} {peak['frames']:>9} {unbounded:>10} {peak['bytes']/1024:>12.0f} {sent:>11} {seconds*1e6:>9.1f}")
+    print(f"burst recovered in {rounds} rounds of resends, "
+          f"{hostile.recv_window.dropped} frames dropped for being outside the window in all")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+benchmarks/inprocess.py
+
+Helpers for driving the game logic in server.py in-process, with socket stand-ins
+instead of real connections, so benchmarks can measure the server side on its own.
+"""
+
+import contextlib
+import io
+import random
+
+import server
+from battleship import BOARD_SIZE
+from coordinates import CoordinateCodec
+from protocol import *
+
+class NullConn:
+    # socket stand-in that records nothing
+    def send(self, data):
+        return len(data)
+    def sendall(self, data):
+        pass
+    def sendmsg(self, buffers):
+        return sum(len(b) for b in buffers)
+    def close(self):
+        pass
+    def shutdown(self, how):
+        pass
+
+class RecordingConn(NullConn):
+    # keeps every byte written
+    def __init__(self):
+        self.sent = bytearray()
+    def send(self, data):
+        self.sent += data
+        return len(data)
+    def sendmsg(self, buffers):
+        for buffer in buffers:
+            self.sent += buffer
+        return sum(len(b) for b in buffers)
+
+class CountingConn(NullConn):
+    # counts write syscalls and bytes
+    def __init__(self):
+        self.calls = 0
+        self.bytes = 0
+    def send(self, data):
+        self.calls += 1
+        self.bytes += len(data)
+        return len(data)
+    def sendmsg(self, buffers):
+        self.calls += 1
+        size = sum(len(b) for b in buffers)
+        self.bytes += size
+        return size
+
+def make_clients(count, conn_type=NullConn, game=None):
+    clients = []
+    for i in range(count):
+        client = server.Client(conn_type(), ("127.0.0.1", i))
+        client.id = i
+        client.username = f"client{i}"
+        client.game = game
+        clients.append(client)
+    return clients
+
+# One ship per row from A1, all horizontal
+PLACEMENTS = [CoordinateCodec.for_size(BOARD_SIZE).format(r, 0) for r in range(5)]
+SHOTS = [name for row in CoordinateCodec.for_size(BOARD_SIZE).names for name in row]
+
+def received_messages(client):
+    # messages the server wrote to a RecordingConn, long ones joined back from their fragments,
+    # as (message, bytes its frames took on the wire)
+    reassembler = Reassembler()
+    messages = []
+    size = 0
+    for frame in FrameDecoder().feed(bytes(client.conn.sent)):
+        if frame.packet_type in (PacketType.ACK, PacketType.NACK):
+            continue
+        size += HEADER_SIZE + frame.msg_len
+        msg = reassembler.add(frame)
+        if msg is not None:
+            messages.append((msg, size))
+            size = 0
+    return messages
+
+def deliver(client, type, text):
+    # hand the server a message from client, as handle_client() does after a read
+    msg = Message(client.id, type, MessageType.TEXT, text, seq=client.seq_r)
+    client.recv_window.add(msg, client.seq_r)
+    with server.SendBatch():
+        server.process_client_messages(client)
+
+def play_scripted_game(spectators=0, conn_type=NullConn, seed=3002, on_turn=None, board_size=BOARD_SIZE, board_format="text"):
+    """
+    Play one full game between two scripted players watched by some spectators.
+    Players place their ships one per row and then sweep the board from A1.
+    Every client gets its BOARDs in board_format (one of protocol.BOARD_FORMATS).
+    on_turn(game) is called after every FIRE. Returns the list of clients (players first).
+    """
+    random.seed(seed)
+    game = server.Game(board_size=board_size) # the room's thread is never started, this function plays the game loop's part
+    clients = make_clients(2 + spectators, conn_type, game)
+    for client in clients:
+        client.board_format = board_format
+        game.registry.add(client)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        with server.SendBatch():
+            game.state = server.GameState.PLACE
+            game.set_players()
+            game.announce_to_spectators(Message(server.SERVER_ID, MessageType.TEXT, MessageType.CHAT, "YOU ARE A SPECTATOR"))
+            for player in game.players:
+                game.send_place_prompt(player)
+        for player in game.players:
+            for coord in PLACEMENTS:
+                deliver(player.client, MessageType.PLACE, coord)
+
+        game.state = server.GameState.BATTLE
+        game.start_battle()
+        board_shots = SHOTS if board_size == BOARD_SIZE else [name for row in CoordinateCodec.for_size(board_size).names for name in row]
+        shots = {player.id: iter(board_shots) for player in game.players}
+        winner = None
+        while winner is None:
+            player = game.players[game.player_turn]
+            deliver(player.client, MessageType.FIRE, next(shots[player.id]))
+            if on_turn:
+                on_turn(game)
+            winner, _ = game.battle_stage()
+        game.state = server.GameState.END
+
+    return clients
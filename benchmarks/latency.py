@@ -0,0 +1,283 @@
+"""
+benchmarks/latency.py
+
+End-to-end latency suite for the whole stack: server.py runs in a subprocess on loopback and is driven
+by AsyncBattleshipClients from client.py, all in one event loop. It measures
+ - connect: from opening a connection to having our id, and first prompt: from the second player of a
+   room starting to connect to the first Place prompt, over --games rooms set up one after another
+ - fire: FIRE to RESULT round trips (p50/p99/p99.9) while those --games games are played at once
+ - fanout: per turn, FIRE to the last of S spectators hearing about the shot, for each --spectators
+   count. Turns are played in lockstep, the next FIRE waits until every spectator has heard of the last
+ - memory per client: growth of the server's RSS with --clients idle clients connected, per client
+
+--json FILE writes the metrics as one JSON object (with the commit they were measured at) so runs can be
+compared across commits. --baseline FILE compares against such a file and exits with an error when a
+metric is worse than its baseline by more than --margin (and by at least --min-change in its own unit,
+so sub-millisecond noise doesn't count), or when a metric is missing from either side. Every metric is
+better lower. Loopback latencies vary a lot from run to run, so a baseline should come from the same
+machine and both sides from several runs: --repeat N reports the median of each metric over N runs, and
+a metric only counts as regressed when every one of the N runs was worse. A percentile is only checked
+once both sides have at least MIN_SAMPLES samples over their runs, and MIN_TAIL_SAMPLES of them above it
+(500 for a p99): the p99 of 40 connects is just the slowest of them, it is reported but can't fail the check.
+
+Usage: python -m benchmarks.latency [--games 20] [--spectators 1 10 50 100] [--clients 200]
+                                    [--mode threaded] [--repeat 3] [--json FILE] [--baseline FILE] [--margin 0.25]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.inprocess import PLACEMENTS, SHOTS
+from benchmarks.netbot import ROOT, percentile, start_server
+from benchmarks.rooms import rss_mb
+from client import AsyncBattleshipClient
+from protocol import *
+
+HOST = "127.0.0.1"
+CONNECT_BATCH = 100 # clients connecting at once, the server's listen backlog is 127
+RUN_TIMEOUT = 120 # seconds before a stuck run is abandoned
+MIN_SAMPLES = 100 # samples a percentile needs, over all runs, before it is checked against the baseline
+MIN_TAIL_SAMPLES = 5 # and how many of them have to be above it
+
+async def play(client, rtts, before_fire=None):
+    # Answer place and fire prompts until the game ends, FIRE to RESULT times go in rtts.
+    # Returns when the first Place prompt arrived.
+    placements = list(PLACEMENTS)
+    shots = iter(SHOTS)
+    first_prompt = None
+    fired_at = None
+    async for event in client:
+        text = event.text
+        if event.type == MessageType.RESULT and fired_at is not None and not text.startswith("OPPONENT"):
+            rtts.append(event.received - fired_at)
+            fired_at = None
+        elif text.startswith("Place ") and placements:
+            if first_prompt is None:
+                first_prompt = event.received
+            await client.place(placements.pop(0))
+        elif text.startswith("Enter coordinate"):
+            if before_fire is not None:
+                await before_fire()
+            fired_at = time.perf_counter()
+            await client.fire(next(shots))
+        elif text == "GAME OVER":
+            break
+    return first_prompt
+
+async def connect(port, count, name):
+    clients = [AsyncBattleshipClient() for _ in range(count)]
+    for start in range(0, count, CONNECT_BATCH):
+        await asyncio.gather(*(client.connect(HOST, port, f"{name}{start+i}")
+                               for i, client in enumerate(clients[start:start+CONNECT_BATCH])))
+    return clients
+
+async def close(clients):
+    await asyncio.gather(*(client.close() for client in clients))
+
+async def measure_games(port, games):
+    connects = []
+    rooms = [] # (players, when the second started connecting)
+    for i in range(games):
+        players = []
+        for name in ("alice", "bob"):
+            player = AsyncBattleshipClient()
+            started = time.perf_counter()
+            await player.connect(HOST, port, f"{name}{i}")
+            connects.append(time.perf_counter() - started)
+            players.append(player)
+        rooms.append((players, started))
+
+    rtts = []
+    first_prompts = await asyncio.gather(*(play(player, rtts) for players, _ in rooms for player in players))
+    prompts = [min(first_prompts[2*i], first_prompts[2*i+1]) - joined for i, (_, joined) in enumerate(rooms)]
+    await close([player for players, _ in rooms for player in players])
+    return connects, prompts, rtts
+
+class FanOut:
+    # Turns played in front of the spectators: when each FIRE went out and when each spectator heard of it
+    def __init__(self, spectators):
+        self.spectators = spectators
+        self.turns = [] # [fired at, times heard, asyncio.Event set once every spectator has heard]
+
+    async def next_turn(self):
+        if self.turns:
+            await self.turns[-1][2].wait()
+        self.turns.append([time.perf_counter(), [], asyncio.Event()])
+
+    def heard(self, turn, when):
+        fired, heard, done = self.turns[turn]
+        heard.append(when)
+        if len(heard) == self.spectators:
+            done.set()
+
+    def times(self):
+        return [max(heard) - fired for fired, heard, _ in self.turns if len(heard) == self.spectators]
+
+async def watch(client, fanout):
+    turn = 0
+    async for event in client:
+        if event.type == MessageType.TEXT and " FIRED AT " in event.text:
+            fanout.heard(turn, event.received)
+            turn += 1
+        elif event.text.startswith("GAME OVER"):
+            return
+
+async def measure_fanout(port, spectators):
+    players = await connect(port, 2, "player")
+    watchers = await connect(port, spectators, "spectator") # all watching before the players place anything
+    fanout = FanOut(spectators)
+    rtts = []
+    await asyncio.gather(*(play(player, rtts, fanout.next_turn) for player in players),
+                         *(watch(watcher, fanout) for watcher in watchers))
+    await close(players + watchers)
+    return fanout.times()
+
+async def measure_memory(port, clients, pid):
+    before = rss_mb(pid)
+    connected = await connect(port, clients, "idle")
+    await asyncio.sleep(0.5) # let the games they started settle
+    after = rss_mb(pid)
+    await close(connected)
+    return (after - before) * 1024 / clients
+
+@contextlib.contextmanager
+def server(port, *args):
+    proc = start_server(port, *args)
+    try:
+        yield proc
+    finally:
+        proc.kill()
+        proc.wait()
+
+def run(measurement):
+    return asyncio.run(asyncio.wait_for(measurement, RUN_TIMEOUT))
+
+def ms(seconds):
+    return seconds * 1000
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def samples_needed(pct):
+    # samples a percentile needs before it says more than the slowest few of them
+    return max(MIN_SAMPLES, math.ceil(MIN_TAIL_SAMPLES / (1 - pct / 100)))
+
+def measure_all(args):
+    metrics = {}
+    samples = {} # metric -> samples it was worked out from
+    needed = {} # metric -> samples it needs before it is checked against a baseline
+    two_player_rooms = ("--mode", args.mode, "--room-size", "2")
+    with server(args.port, *two_player_rooms):
+        connects, prompts, rtts = run(measure_games(args.port, args.games))
+    groups = [("connect", connects, (50, 99)), ("first_prompt", prompts, (50, 99)), ("fire", rtts, (50, 99, 99.9))]
+    for i, spectators in enumerate(args.spectators):
+        port = args.port + 2 + i
+        with server(port, "--mode", args.mode, "--room-size", str(spectators + 2)):
+            groups.append((f"fanout_{spectators}", run(measure_fanout(port, spectators)), (50, 99)))
+    for name, values, pcts in groups:
+        for pct in pcts:
+            metric = f"{name}_p{pct:g}_ms".replace(".", "")
+            metrics[metric] = ms(percentile(values, pct))
+            samples[metric] = len(values)
+            needed[metric] = samples_needed(pct)
+    with server(args.port + 1, *two_player_rooms) as proc:
+        metrics["memory_per_client_kb"] = run(measure_memory(args.port + 1, args.clients, proc.pid))
+    samples["memory_per_client_kb"] = args.clients # an average, any number of clients will do
+    needed["memory_per_client_kb"] = 1
+    return {"commit": commit(), "mode": args.mode, "games": args.games, "clients": args.clients,
+            "samples": samples, "needed": needed, "metrics": metrics}
+
+def compare(results, baseline, margin, min_change):
+    # (metric, value, baseline value, change as a fraction, status) for every metric either side has.
+    # status is "REGRESSED", "MISSING" (from one side, an error too), "few samples" (too few on either
+    # side to check it) or "" (fine). results carries "best", each metric's best value over its runs.
+    rows = []
+    metrics, base_metrics = results["metrics"], baseline["metrics"]
+    for name in {**metrics, **base_metrics}:
+        value, base = metrics.get(name), base_metrics.get(name)
+        if value is None or base is None:
+            rows.append((name, value, base, None, "MISSING"))
+            continue
+        change = (value - base) / base if base else float("inf") if value > base else 0.0
+        needed = results["needed"].get(name, 1)
+        # older baselines only count samples per group, without those the baseline's side isn't checked
+        base_samples = baseline.get("samples", {}).get(name, needed) * baseline.get("repeat", 1)
+        if min(results["samples"][name] * results["repeat"], base_samples) < needed:
+            status = "few samples"
+        elif change > margin and value - base >= min_change and results["best"][name] - base > margin * base:
+            status = "REGRESSED"
+        else:
+            status = ""
+        rows.append((name, value, base, change, status))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--games", type=int, default=20, help="games played at once for the FIRE round trips")
+    parser.add_argument("--spectators", type=int, nargs="+", default=[1, 10, 50, 100], help="spectator counts for the fan-out")
+    parser.add_argument("--clients", type=int, default=200, help="idle clients for the memory figure")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded", help="server mode")
+    parser.add_argument("--port", type=int, default=5400, help="first of the ports the servers use")
+    parser.add_argument("--repeat", type=int, default=3, help="runs to take the median of each metric over")
+    parser.add_argument("--json", metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="results of an earlier run (from --json) to check against")
+    parser.add_argument("--margin", type=float, default=0.25, help="worst change against the baseline allowed, as a fraction")
+    parser.add_argument("--min-change", type=float, default=0.5, help="changes smaller than this (ms or KB) never count as regressions")
+    args = parser.parse_args()
+    if max(args.spectators) + 2 > 127:
+        parser.error("a room holds at most 125 spectators")
+
+    runs = [measure_all(args) for _ in range(args.repeat)]
+    results = runs[0]
+    results["repeat"] = args.repeat
+    results["samples"] = {name: min(run["samples"][name] for run in runs) for name in results["metrics"]}
+    results["best"] = {name: min(run["metrics"][name] for run in runs) for name in results["metrics"]}
+    results["metrics"] = {name: statistics.median(run["metrics"][name] for run in runs) for name in results["metrics"]}
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=2)
+            out.write("\n")
+
+    if not args.baseline:
+        print(f"{'metric':>22} {'value':>9} {'samples':>8}")
+        for name, value in results["metrics"].items():
+            print(f"{name:>22} {value:>9.2f} {results['samples'][name] * args.repeat:>8}")
+        return
+
+    with open(args.baseline) as baseline:
+        baseline = json.load(baseline)
+    if baseline.get("mode") != results["mode"]:
+        print(f"note: the baseline was measured against the {baseline.get('mode')} server, this run the {results['mode']} one")
+    for setting in ("games", "clients"):
+        if baseline.get(setting, results[setting]) != results[setting]:
+            print(f"note: the baseline was measured with --{setting} {baseline[setting]}, this run with {results[setting]}")
+    rows = compare(results, baseline, args.margin, args.min_change)
+    print(f"{'metric':>22} {'value':>9} {'samples':>8} {'baseline':>9} {'change':>8}")
+    for name, value, base, change, status in rows:
+        cells = [f"{name:>22}", f"{value:>9.2f}" if value is not None else f"{'-':>9}",
+                 f"{results['samples'][name] * args.repeat:>8}" if name in results["samples"] else f"{'-':>8}",
+                 f"{base:>9.2f}" if base is not None else f"{'-':>9}", f"{change:>+8.1%}" if change is not None else f"{'-':>8}"]
+        print(" ".join(cells) + (f"  {status}" if status else ""))
+
+    missing = [name for name, *_, status in rows if status == "MISSING"]
+    regressed = [name for name, *_, status in rows if status == "REGRESSED"]
+    problems = []
+    if missing:
+        problems.append(f"{len(missing)} metrics missing from this run or the baseline: {', '.join(missing)}")
+    if regressed:
+        problems.append(f"{len(regressed)} metrics worse than the baseline by more than {args.margin:.0%} in every run: {', '.join(regressed)}")
+    if problems:
+        sys.exit("\n".join(problems))
+
+if __name__ == "__main__":
+    main()
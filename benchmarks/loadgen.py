@@ -0,0 +1,278 @@
+"""
+benchmarks/loadgen.py
+
+Headless load generator for capacity planning. Opens --connections bots in one process against a
+running server (or one it starts with --start-server) and keeps them playing for --duration seconds.
+Every bot speaks the wire protocol itself (benchmarks/netbot.py) and takes whatever role the server
+gives it: a player places its fleet automatically, at random legal spots worked out from its own board
+as the server sends it, and fires at random cells it hasn't tried; a spectator watches. Once a game is
+over the bots stay for the next one.
+
+The server puts the first two clients of every room in the game and the rest watch, so with
+--spectators S the server has to run with --room-size S+2 (--start-server does this) for every room
+to get S spectators.
+
+It reports games completed per second, round trip percentiles of PLACE (to the next prompt) and FIRE
+(to its RESULT), messages received and counts of every kind of error: connections refused or closed,
+bots that heard nothing for --idle-timeout seconds, moves the server rejected, boards that fell out of
+step and checksum failures. --json prints the same report as one JSON object. The bots share one core,
+the CPU share the generator used says whether it or the server was the limit.
+
+Usage: python -m benchmarks.loadgen [--connections 100] [--spectators 0] [--duration 10]
+                                    [--host 127.0.0.1] [--port 5000] [--start-server [ARGS]] [--json]
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import random
+import re
+import shlex
+import time
+
+from battleship import FleetPlacer
+from coordinates import CoordinateCodec
+from benchmarks.netbot import NetBot, percentile, start_server
+from protocol import *
+
+PLACE_PROMPT = re.compile(r"Place (.+) \(Size: (\d+)\) (horizontally|vertically)\.")
+PERCENTILES = (50, 90, 99, 99.9)
+
+class LoadBot(NetBot):
+    """
+    A bot that plays or watches games until stopped, adding what it sees to a shared Report.
+    """
+    def __init__(self, name, reader, writer, report, rng):
+        super().__init__(name, reader, writer, keep_log=False)
+        self.report = report
+        self.rng = rng
+        self.boards = {} # board key -> BoardView, kept up to date from binary snapshots and deltas
+        self.stopped = False # set when the run is over, in case cancelling the bot's wait_for() is lost
+        self.new_game()
+
+    @classmethod
+    async def connect(cls, host, port, name, report, rng):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(name, reader, writer, report, rng)
+
+    def new_game(self):
+        self.boards.clear()
+        self.text_board = None # BoardView of the last plain text board, sent before the server has our CONNECT
+        self.size = None # of the boards, from the first snapshot
+        self.shots = None # cells not fired at yet, in a random order
+        self.sent = None # (kind, time) of the PLACE or FIRE waiting for its answer
+
+    async def handshake(self):
+        msg = await self.recv()
+        if msg is None or msg.type != MessageType.CONNECT:
+            raise ConnectionError(f"{self.name} did not receive an id")
+        self.id = int(msg.msg)
+        self.send(MessageType.CONNECT, encode_connect(self.name, boards="binary"))
+
+    def answered(self, kind):
+        if self.sent is not None and self.sent[0] == kind:
+            self.report.rtts[kind].append(time.perf_counter() - self.sent[1])
+            self.sent = None
+
+    def update_board(self, payload):
+        kind, key, base, version, body = decode_board_payload(payload)
+        if kind == BOARD_BINARY:
+            self.size = body[0]
+            self.boards.setdefault(key, BoardView()).load_binary(version, *body)
+        elif kind == BOARD_DELTA:
+            view = self.boards.get(key)
+            if view is None or not view.apply(base, version, body):
+                self.report.errors["board out of step"] += 1
+                self.send(MessageType.BOARD, key)
+        else: # a text snapshot, or plain text when the game started before the server read our CONNECT
+            view = BoardView()
+            view.load(version, body)
+            self.size = len(view.cells)
+            if kind == BOARD_SNAPSHOT:
+                self.boards[key] = view
+            else:
+                self.text_board = view
+
+    def own_ships(self):
+        # cells of our own board that are taken, as a FleetPlacer mask. A plain text board has no key, but
+        # while placing the board sent with each prompt is our own.
+        view = next((view for key, view in self.boards.items() if key.endswith("h")), self.text_board)
+        if view is None:
+            return 0
+        return sum(1 << (r * self.size + c) for r, row in enumerate(view.cells) for c, state in enumerate(row) if state != ".")
+
+    def place(self, name, ship_size, vertical):
+        try:
+            _, row, col, _, orientation = FleetPlacer(self.size, self.rng).place([(name, ship_size)], self.own_ships())[0]
+        except ValueError: # no room left, which the server shouldn't let happen
+            self.report.errors["no room to place"] += 1
+            return
+        self.sent = ("place", time.perf_counter())
+        if orientation != vertical:
+            self.send(MessageType.PLACE, "x") # the server prompts again with the other orientation
+        else:
+            self.send(MessageType.PLACE, CoordinateCodec.for_size(self.size).format(row, col))
+
+    def fire(self):
+        if self.shots is None:
+            self.shots = [name for row in CoordinateCodec.for_size(self.size).names for name in row]
+            self.rng.shuffle(self.shots)
+        self.sent = ("fire", time.perf_counter())
+        self.send(MessageType.FIRE, self.shots.pop())
+
+    async def run(self, idle_timeout):
+        report = self.report
+        while not self.stopped:
+            try:
+                msg = self.pending.pop(0) if self.pending else await asyncio.wait_for(self.recv(), idle_timeout)
+            except asyncio.TimeoutError:
+                report.errors["idle timeout"] += 1
+                return
+            except ConnectionError:
+                msg = None
+            if msg is None:
+                report.errors["connection closed"] += 1
+                return
+            report.messages += 1
+            text = msg.msg
+            if msg.type == MessageType.BOARD:
+                self.update_board(text)
+            elif msg.type == MessageType.RESULT:
+                self.answered("fire")
+            elif text.startswith("Place "):
+                self.answered("place")
+                prompt = PLACE_PROMPT.match(text)
+                if prompt is None or self.size is None:
+                    report.errors["unexpected prompt"] += 1
+                    continue
+                self.place(prompt.group(1), int(prompt.group(2)), prompt.group(3) == "vertically")
+            elif text.startswith("All ships placed"):
+                self.answered("place")
+            elif text.startswith("Enter coordinate"):
+                self.fire()
+            elif text.startswith("[!]") or text.startswith("Invalid"):
+                report.errors["move rejected"] += 1
+            elif text == "YOU WIN!!!":
+                report.games += 1
+            elif text == "GAME OVER":
+                report.played += 1
+                self.new_game()
+            elif text.startswith("GAME OVER!"):
+                report.watched += 1
+                self.new_game()
+            elif msg.type == MessageType.DISCONNECT:
+                report.errors["disconnected by server"] += 1
+                return
+            if self.decoder.checksum_failed:
+                report.errors["checksum failed"] += 1
+                self.decoder.checksum_failed = False
+
+def ms(seconds):
+    # None (null in the JSON) when there were no samples
+    return None if seconds is None or seconds != seconds else seconds * 1000
+
+class Report:
+    def __init__(self):
+        self.games = 0 # won, so each game once
+        self.played = 0 # games seen to the end by a player
+        self.watched = 0 # games seen to the end by a spectator
+        self.messages = 0
+        self.rtts = {"place": [], "fire": []} # seconds from a PLACE or FIRE to its answer
+        self.errors = collections.Counter()
+
+    def summary(self, connections, duration, cpu):
+        return {
+            "connections": connections,
+            "duration": duration,
+            "generator_cpu": cpu / duration, # share of a core this process used, near 1 the generator is the limit
+            "games": self.games,
+            "games_per_sec": self.games / duration,
+            "player_games": self.played,
+            "spectator_games": self.watched,
+            "messages_received": self.messages,
+            "rtt_ms": {kind: {"count": len(samples), **{f"p{pct:g}": ms(percentile(samples, pct)) for pct in PERCENTILES},
+                              "max": ms(max(samples, default=None))}
+                       for kind, samples in self.rtts.items()},
+            "errors": dict(self.errors),
+        }
+
+async def connect_bot(host, port, name, report, rng):
+    try:
+        bot = await LoadBot.connect(host, port, name, report, rng)
+        await bot.handshake()
+        return bot
+    except (OSError, ConnectionError):
+        report.errors["connect failed"] += 1
+        return None
+
+async def generate_load(args):
+    report = Report()
+    rng = random.Random(args.seed)
+    bots = []
+    for i in range(args.connections):
+        bots.append(connect_bot(args.host, args.port, f"load{i}", report, random.Random(rng.random())))
+        if args.connect_rate:
+            await asyncio.sleep(1 / args.connect_rate)
+    bots = [bot for bot in await asyncio.gather(*bots) if bot is not None]
+
+    start = time.perf_counter()
+    cpu = time.process_time()
+    tasks = [asyncio.create_task(bot.run(args.idle_timeout)) for bot in bots]
+    await asyncio.wait(tasks, timeout=args.duration)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    for bot, task in zip(bots, tasks):
+        bot.stopped = True
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, Exception):
+            report.errors[f"bot failed: {result!r}"] += 1
+    for bot in bots:
+        bot.close()
+    return report.summary(args.connections, elapsed, cpu)
+
+def print_report(summary):
+    print(f"{summary['connections']} connections for {summary['duration']:.1f} s: {summary['games']} games, "
+          f"{summary['games_per_sec']:.1f} games/s ({summary['player_games']} seen through by players, "
+          f"{summary['spectator_games']} by spectators), {summary['messages_received']} messages received")
+    print(f"load generator used {summary['generator_cpu']:.0%} of a core" +
+          (", results are limited by the generator" if summary["generator_cpu"] > 0.9 else ""))
+    print(f"{'rtt (ms)':>9} {'count':>8} " + " ".join(f"{f'p{pct:g}':>7}" for pct in PERCENTILES) + f" {'max':>7}")
+    for kind, rtt in summary["rtt_ms"].items():
+        cells = [rtt[f"p{pct:g}"] for pct in PERCENTILES] + [rtt["max"]]
+        print(f"{kind:>9} {rtt['count']:>8} " + " ".join(f"{cell:>7.2f}" if cell is not None else f"{'-':>7}" for cell in cells))
+    errors = summary["errors"]
+    print("errors: " + (", ".join(f"{count} {kind}" for kind, count in sorted(errors.items())) if errors else "none"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=100, help="bots to connect")
+    parser.add_argument("--spectators", type=int, default=0, help="spectators per room, see above")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to play for once everyone is connected")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--connect-rate", type=float, default=0, help="connections opened per second (default: all at once)")
+    parser.add_argument("--idle-timeout", type=float, default=30, help="seconds a bot waits for a message before giving up")
+    parser.add_argument("--start-server", nargs="?", const="", default=None, metavar="ARGS",
+                        help="start server.py on --port for the run, with --room-size and --restart-delay 0 plus ARGS")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--seed", type=int, default=3002)
+    args = parser.parse_args()
+
+    proc = None
+    if args.start_server is not None:
+        proc = start_server(args.port, "--room-size", str(args.spectators + 2), "--restart-delay", "0", *shlex.split(args.start_server))
+    try:
+        summary = asyncio.run(generate_load(args))
+    finally:
+        if proc:
+            proc.kill()
+            proc.wait()
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print_report(summary)
+
+if __name__ == "__main__":
+    main()
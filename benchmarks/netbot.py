@@ -0,0 +1,154 @@
+"""
+benchmarks/netbot.py
+
+A minimal asyncio client that speaks the wire protocol directly, for benchmarks that
+need many connections to a real server in one process, plus helpers to start a server.
+"""
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.inprocess import PLACEMENTS, SHOTS
+from protocol import *
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def start_server(port, *args):
+    # run server.py in a subprocess and wait until it accepts connections
+    proc = subprocess.Popen([sys.executable, "server.py", "--port", str(port), *args],
+                            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            time.sleep(0.2) # let the server drop the probe connection before real clients join its room
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"server did not start on port {port}")
+
+def thread_count(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return None
+
+def percentile(samples, pct):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+class NetBot:
+    def __init__(self, name, reader, writer, keep_log=True):
+        self.name = name
+        self.reader = reader
+        self.writer = writer
+        self.decoder = FrameDecoder()
+        self.reassembler = Reassembler()
+        self.pending = []
+        self.seq_r = 0
+        self.out_of_order = {} # seq -> Message received ahead of seq_r
+        self.id = 0
+        self.seq_s = 0
+        self.connected_at = time.perf_counter()
+        self.log = [] if keep_log else None # (time, "sent"/"recv", Message) for every whole message
+
+    @classmethod
+    async def connect(cls, host, port, name, keep_log=True):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(name, reader, writer, keep_log)
+
+    def send(self, type, text=""):
+        msg = Message(self.id, type, MessageType.TEXT, text, seq=self.seq_s)
+        self.writer.write(msg.encode())
+        if self.log is not None:
+            self.log.append((time.perf_counter(), "sent", msg))
+        self.seq_s = (self.seq_s+1)&((1<<16)-1)
+
+    async def recv(self):
+        # next whole message from the server, None once the connection closes
+        while not self.pending:
+            data = await self.reader.read(1<<16)
+            if not data:
+                return None
+            now = time.perf_counter()
+            for msg in self.decoder.feed(data):
+                if msg.packet_type in (PacketType.DATA, PacketType.FRAGMENT) and seq_diff(msg.seq, self.seq_r) >= 0:
+                    self.out_of_order[msg.seq] = msg
+            # hand messages over in seq order, like client.py
+            start = self.seq_r
+            while self.seq_r in self.out_of_order:
+                msg = self.reassembler.add(self.out_of_order.pop(self.seq_r))
+                self.seq_r = (self.seq_r+1)&((1<<16)-1)
+                if msg is None: # a fragment, the message is handed over once it is whole
+                    continue
+                self.pending.append(msg)
+                if self.log is not None:
+                    self.log.append((now, "recv", msg))
+            if self.seq_r != start: # acknowledge them so the server doesn't resend them
+                ack = Message(self.id, MessageType.TEXT, MessageType.TEXT, "", seq=self.seq_r, packet_type=PacketType.ACK)
+                self.writer.write(ack.encode())
+        return self.pending.pop(0)
+
+    async def handshake(self):
+        # wait for our id (always the first message) and answer with the username, returns seconds since connecting
+        msg = await self.recv()
+        if msg is None or msg.type != MessageType.CONNECT:
+            raise ConnectionError(f"{self.name} did not receive an id")
+        self.id = int(msg.msg)
+        self.send(MessageType.CONNECT, self.name)
+        return time.perf_counter() - self.connected_at
+
+    async def play(self, placements=PLACEMENTS, shots=SHOTS):
+        """
+        Answer place and fire prompts until the game ends.
+        Returns the FIRE to RESULT latencies in seconds.
+        """
+        placements = list(placements)
+        shots = iter(shots)
+        latencies = []
+        fired_at = None
+        while True:
+            msg = await self.recv()
+            if msg is None or msg.type == MessageType.DISCONNECT:
+                return latencies
+            if msg.type == MessageType.RESULT and fired_at is not None and not msg.msg.startswith("OPPONENT"):
+                latencies.append(time.perf_counter() - fired_at)
+                fired_at = None
+            elif msg.msg.startswith("Place ") and placements:
+                self.send(MessageType.PLACE, placements.pop(0))
+            elif msg.msg.startswith("Enter coordinate"):
+                fired_at = time.perf_counter()
+                self.send(MessageType.FIRE, next(shots))
+            elif msg.msg == "GAME OVER":
+                return latencies
+
+    async def watch(self):
+        # read until the game ends
+        while True:
+            msg = await self.recv()
+            if msg is None or msg.msg.startswith("GAME OVER"):
+                return
+
+    def first(self, direction, predicate, after=0):
+        # time of the first logged message matching predicate at or after a given time
+        for when, way, msg in self.log:
+            if way == direction and when >= after and predicate(msg):
+                return when
+        return None
+
+    def last(self, direction, predicate):
+        for when, way, msg in reversed(self.log):
+            if way == direction and predicate(msg):
+                return when
+        return None
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,107 @@
+"""
+benchmarks/placement.py
+
+Random fleet placement with FleetPlacer against the old rejection loop of
+place_ships_randomly() (draw a random row, column and orientation until it fits),
+for the standard fleet and for fleets that crowd the board.
+
+Before timing it checks that FleetPlacer:
+ - only produces legal fleets and repeats them for the same seed
+ - draws the first ship uniformly from its legal placements
+ - reports fleets that can't fit instead of searching forever
+
+Usage: python -m benchmarks.placement [--seed 3002] [--time 1]
+"""
+
+import argparse
+import random
+import time
+
+from battleship import BOARD_SIZE, SHIPS, Board, FleetPlacer
+
+MAX_RETRIES = 100_000 # the old loop has no way out of a dead end, give up on a fleet after this many draws
+
+def rejection_fleet(ships, rng, size=BOARD_SIZE):
+    # the old place_ships_randomly(), returns (placements, retries) or (None, retries) if it got stuck
+    board = Board(size)
+    placements = []
+    retries = 0
+    for name, ship_size in ships:
+        while True:
+            orientation = rng.randint(0, 1)
+            row = rng.randint(0, size - 1)
+            col = rng.randint(0, size - 1)
+            if board.place_ship(name, row, col, ship_size, orientation):
+                placements.append((name, row, col, ship_size, orientation))
+                break
+            retries += 1
+            if retries > MAX_RETRIES:
+                return None, retries
+    return placements, retries
+
+def fleets_per_sec(make_fleet, min_time):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        for _ in range(100):
+            make_fleet()
+        count += 100
+    return count / (time.perf_counter() - start)
+
+def check(seed):
+    placer = FleetPlacer(rng=random.Random(seed))
+    fleets = [placer.place() for _ in range(10_000)]
+    for fleet in fleets:
+        board = Board()
+        assert all(board.place_ship(*placement) for placement in fleet), "illegal fleet"
+    again = FleetPlacer(rng=random.Random(seed))
+    assert fleets[:100] == [again.place() for _ in range(100)], "same seed gave different fleets"
+
+    # the carrier has 2 * 6 * 10 = 120 legal placements on an empty board
+    draws = 120_000
+    counts = {}
+    for _ in range(draws):
+        placement = placer.place(SHIPS[:1])[0]
+        counts[placement] = counts.get(placement, 0) + 1
+    assert len(counts) == 120
+    expected = draws / len(counts)
+    chi2 = sum((count - expected) ** 2 / expected for count in counts.values())
+    print(f"first ship over its 120 placements: min {min(counts.values())} max {max(counts.values())} "
+          f"(expected {expected:.0f}), chi-square {chi2:.0f} with 119 degrees of freedom")
+
+    # too many cells is caught up front; 7 destroyers on a 4x4 board without two opposite corners
+    # have exactly enough room but can't be tiled, which only the backtracking search finds out
+    impossible = [
+        ("21 carriers on 10x10", BOARD_SIZE, [("Carrier", 5)] * 21, 0),
+        ("7 destroyers on 4x4 minus corners", 4, [("Destroyer", 2)] * 7, 1 | 1 << 15),
+    ]
+    for name, size, ships, occupied in impossible:
+        start = time.perf_counter()
+        try:
+            FleetPlacer(size).place(ships, occupied)
+            raise AssertionError(f"{name}: placed")
+        except ValueError as e:
+            print(f"{name}: {e} ({(time.perf_counter() - start) * 1000:.2f} ms)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=3002)
+    parser.add_argument("--time", type=float, default=1, help="seconds per measurement")
+    args = parser.parse_args()
+
+    check(args.seed)
+
+    print(f"{'fleet':>12} {'cells':>6} {'retry loop/s':>13} {'retries/fleet':>14} {'stuck':>6} {'FleetPlacer/s':>14} {'speedup':>8}")
+    for copies in (1, 2, 3):
+        ships = SHIPS * copies
+        rng = random.Random(args.seed)
+        placer = FleetPlacer(rng=rng)
+        results = [rejection_fleet(ships, rng) for _ in range(200)]
+        stuck = sum(1 for placements, _ in results if placements is None)
+        retries = sum(r for _, r in results) / len(results)
+        old = fleets_per_sec(lambda: rejection_fleet(ships, rng), args.time / 2) if stuck == 0 else float("nan")
+        new = fleets_per_sec(lambda: placer.place(ships), args.time)
+        print(f"{f'{copies}x SHIPS':>12} {sum(n for _, n in ships):>6} {old:>13.0f} {retries:>14.1f} {stuck:>6} {new:>14.0f} {new/old:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+benchmarks/registry.py
+
+Lookups the game does on every message, with the ClientRegistry indexes against the
+list scans they replaced, in a full room:
+ - get_player(): scanning both players against a dict lookup by client id
+ - picking the spectators to announce to: building a player id list and filtering every
+   client against it, against the spectators tuple the registry keeps up to date
+
+Usage: python -m benchmarks.registry [--clients N]
+"""
+
+import argparse
+import time
+
+import server
+from benchmarks.inprocess import make_clients
+
+def old_get_player(game, client_id):
+    for player in game.players:
+        if player.client != None and player.client.id == client_id:
+            return player
+    return None
+
+def old_spectators(game):
+    playerids = []
+    for player in game.players:
+        if player.client:
+            playerids.append(player.client.id)
+    return [client for client in game.clients if client.id not in playerids]
+
+def per_call_us(func, min_time=0.3):
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        for _ in range(1000):
+            func()
+        calls += 1000
+    return (time.perf_counter() - start) / calls * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=server.MAX_CLIENTS)
+    args = parser.parse_args()
+
+    game = server.Game()
+    clients = make_clients(args.clients, game=game)
+    for client in clients:
+        game.registry.add(client)
+    game.set_player(0, clients[0])
+    game.set_player(1, clients[1])
+    spectator_id = clients[-1].id
+
+    # both ways must agree
+    for client in clients:
+        assert old_get_player(game, client.id) is game.get_player(client.id)
+    assert old_spectators(game) == list(game.registry.spectators)
+
+    print(f"{args.clients} clients in the room")
+    print(f"{'lookup':>22} {'scan (us)':>10} {'registry (us)':>14} {'speedup':>8}")
+    rows = [
+        ("get_player(spectator)", lambda: old_get_player(game, spectator_id), lambda: game.get_player(spectator_id)),
+        ("spectators to announce", lambda: old_spectators(game), lambda: game.registry.spectators),
+    ]
+    for name, old, new in rows:
+        old_us, new_us = per_call_us(old), per_call_us(new)
+        print(f"{name:>22} {old_us:>10.3f} {new_us:>14.3f} {old_us/new_us:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+benchmarks/rendering.py
+
+Cost of rendering boards per turn with the rows cached on each Board (Game.board_to_str()
+joins the cached rows, and a shot only re-renders the row it hit) against the old
+board_to_str() that rebuilt the whole board with string concatenation on every call.
+
+A turn is what the server renders around one FIRE: the shot, the opponent's board sent to
+the firing player and its spectators, and the other board sent with the next fire prompt.
+Boards get a fleet covering about a sixth of their cells and are shot in a random order,
+timing up to --turns turns of each game.
+
+Before timing it checks that the cached text matches the old renderer after every shot
+(every size-th shot on boards over 30x30), for the hidden and display views of both Board backends.
+
+Usage: python -m benchmarks.rendering [--sizes 10 30 100] [--turns 500] [--seed 3002] [--time 1]
+"""
+
+import argparse
+import random
+import time
+
+import server
+from battleship import BOARD_BACKENDS, SHIPS
+
+def old_board_to_str(board, show_hidden=False):
+    # the previous Game.board_to_str(), without its debugging print
+    grid_to_send = board.hidden_grid if show_hidden else board.display_grid
+    codec = board.codec
+
+    board_msg = ""
+    board_msg = board_msg + " " * codec.label_width + codec.column_header + '|'
+    for r in range(board.size):
+        row_str = " ".join(grid_to_send[r][c] for c in range(board.size))
+        board_msg = board_msg + f"{codec.padded_labels[r]} {row_str}" + "|"
+    return board_msg
+
+def make_game(board_type, size, rng):
+    # two boards with random fleets and the order each one is shot in
+    copies = max(1, size * size // 6 // sum(n for _, n in SHIPS))
+    boards = []
+    shots = []
+    for _ in range(2):
+        board = board_type(size)
+        board.place_ships_randomly(SHIPS * copies, rng)
+        cells = [(r, c) for r in range(size) for c in range(size)]
+        rng.shuffle(cells)
+        boards.append(board)
+        shots.append(cells)
+    return boards, shots
+
+def play(render, board_type, size, seed, turns):
+    # seconds per turn over the first turns of a game of alternating shots
+    rng = random.Random(seed)
+    boards, shots = make_game(board_type, size, rng)
+    turns = min(turns, size * size)
+    start = time.perf_counter()
+    for turn in range(turns):
+        for target in (0, 1):
+            boards[target].fire_at(*shots[target][turn])
+            render(boards[target])      # result, to the firing player and spectators
+            render(boards[1 - target])  # next fire prompt
+    return (time.perf_counter() - start) / (2 * turns)
+
+def check(game, size, seed):
+    for name, board_type in sorted(BOARD_BACKENDS.items()):
+        rng = random.Random(seed)
+        boards, shots = make_game(board_type, size, rng)
+        every = 1 if size <= 30 else size
+        for board, cells in zip(boards, shots):
+            for show_hidden in (True, False):
+                assert game.board_to_str(board, show_hidden) == old_board_to_str(board, show_hidden)
+            for i, cell in enumerate(cells):
+                board.fire_at(*cell)
+                if i % every:
+                    continue
+                for show_hidden in (True, False):
+                    assert game.board_to_str(board, show_hidden) == old_board_to_str(board, show_hidden), \
+                        f"{name} {size}x{size}: cached board differs after a shot at {cell}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 30, 100])
+    parser.add_argument("--turns", type=int, default=500, help="turns timed per game")
+    parser.add_argument("--seed", type=int, default=3002)
+    parser.add_argument("--time", type=float, default=1, help="minimum seconds per measurement")
+    args = parser.parse_args()
+
+    game = server.Game() # only used for board_to_str(), its thread is never started
+    for size in args.sizes:
+        check(game, size, args.seed)
+    print(f"cached rows match the old renderer after the shots on {', '.join(f'{n}x{n}' for n in args.sizes)}")
+
+    print(f"{'board':>8} {'backend':>9} {'old us/turn':>12} {'cached us/turn':>15} {'speedup':>8}")
+    for size in args.sizes:
+        for name, board_type in sorted(BOARD_BACKENDS.items()):
+            results = []
+            for render in (old_board_to_str, game.board_to_str):
+                best = float("inf")
+                start = time.perf_counter()
+                while time.perf_counter() - start < args.time / 2:
+                    best = min(best, play(render, board_type, size, args.seed, args.turns))
+                results.append(best * 1e6)
+            old, new = results
+            print(f"{f'{size}x{size}':>8} {name:>9} {old:>12.1f} {new:>15.1f} {old/new:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+benchmarks/retransmit.py
+
+Retransmitted bytes per corrupted frame. The server streams chat messages (some long enough to be
+fragmented) to a peer over a simulated link that corrupts frames at random. The peer handles them the
+way client.py does: it NACKs the gaps it finds and sends one cumulative ACK per read, and its replies
+go back through server.receive_frames(). Each read carries one frame, so a corrupted frame loses only
+itself. Frames are corrupted where the checksum notices (the checksum or the frame's last byte).
+Sequence numbers start just below 65535 so every run wraps around.
+
+For comparison it adds up the unacknowledged window each time a NACK arrives, which is the least the
+old NACK (resend the whole send window) would have sent. Before cumulative ACKs the window was only
+trimmed after a gap, so the old figure was higher still.
+
+Usage: python -m benchmarks.retransmit [--messages 5000] [--loss 0.001 0.01 0.05]
+"""
+
+import argparse
+import random
+
+import server
+from protocol import *
+
+class LinkConn:
+    # socket stand-in that keeps the frames the server writes for the link to deliver
+    def __init__(self):
+        self.sent = bytearray()
+    def sendmsg(self, buffers):
+        for buffer in buffers:
+            self.sent += buffer
+        return sum(len(b) for b in buffers)
+    def close(self):
+        pass
+
+class Peer:
+    # the receiving end, with client.py's window handling
+    def __init__(self, seq):
+        self.decoder = FrameDecoder()
+        self.window = ReceiveWindow()
+        self.reassembler = Reassembler()
+        self.seq_r = seq
+        self.received = [] # payloads of whole messages, in order
+        self.replies = [] # ACK and NACK frames for the server
+
+    def reply(self, packet_type, seq, msg=""):
+        self.replies.append(Message(0, MessageType.TEXT, MessageType.TEXT, msg, seq=seq, packet_type=packet_type))
+
+    def read(self, data):
+        stale = False
+        for msg in self.decoder.feed(data):
+            if seq_diff(msg.seq, self.seq_r) < 0: # already processed, the ACK for it was lost
+                stale = True
+                continue
+            for first, count in self.window.add(msg, self.seq_r):
+                self.reply(PacketType.NACK, first, count)
+        if stale:
+            self.reply(PacketType.ACK, self.seq_r)
+        if self.decoder.checksum_failed:
+            for first, count in self.window.corrupted(self.seq_r):
+                self.reply(PacketType.NACK, first, count)
+
+        start = self.seq_r
+        while True:
+            msg = self.window.pop(self.seq_r)
+            if msg is None:
+                break
+            self.seq_r = seq_add(self.seq_r, 1)
+            whole = self.reassembler.add(msg)
+            if whole is not None:
+                self.received.append(whole.msg)
+        if self.seq_r != start:
+            self.reply(PacketType.ACK, self.seq_r)
+            for first, count in self.window.reopened(start, self.seq_r):
+                self.reply(PacketType.NACK, first, count)
+
+def split_frames(data):
+    frames = []
+    start = 0
+    while start < len(data):
+        end = start + HEADER_SIZE + ((data[start+7]&1)<<8) + data[start+8]
+        frames.append(bytearray(data[start:end]))
+        start = end
+    return frames
+
+def run(texts, loss, burst, seed):
+    rng = random.Random(seed)
+    start_seq = SEQ_MASK + 1 - len(texts) // 4 # wraps a quarter of the way through
+    client = server.Client(LinkConn(), ("link", 0))
+    client.id = 1
+    client.seq_s = start_seq
+    peer = Peer(start_seq)
+
+    stats = dict(frames=0, bytes=0, corrupted=0, resent_frames=0, resent_bytes=0, nacks=0, window_bytes=0)
+    sent = set() # seqs that have been on the link
+    pending = list(reversed(texts))
+    rounds = 0
+    while pending or peer.seq_r != client.seq_s:
+        rounds += 1
+        assert rounds < 100 * len(texts), "the transfer stalled"
+        with server.SendBatch():
+            for _ in range(min(burst, len(pending))):
+                server.send_message_to(client, Message(server.SERVER_ID, MessageType.CHAT, MessageType.CHAT, pending.pop()))
+
+        data = client.conn.sent
+        client.conn.sent = bytearray()
+        for frame in split_frames(data):
+            seq = (frame[4]<<8) + frame[5]
+            if seq in sent:
+                stats["resent_frames"] += 1
+                stats["resent_bytes"] += len(frame)
+            else:
+                sent.add(seq)
+                stats["frames"] += 1
+                stats["bytes"] += len(frame)
+            if rng.random() < loss:
+                # crc32() only covers a frame's last byte, so flip a bit there or in the checksum itself
+                index = rng.choice((0, 1, 2, 3, len(frame) - 1))
+                frame[index] ^= 1 << rng.randrange(8)
+                stats["corrupted"] += 1
+            peer.read(frame)
+
+        replies = peer.replies
+        peer.replies = []
+        for reply in replies:
+            if reply.packet_type == PacketType.NACK:
+                stats["nacks"] += 1
+                stats["window_bytes"] += sum(HEADER_SIZE + msg.msg_len for msg in client.send_window.frames)
+            with server.SendBatch():
+                server.receive_frames(client, [reply])
+
+    assert peer.received == texts, "messages were lost, reordered or changed"
+    assert len(client.send_window) == 0, "frames left unacknowledged"
+    assert len(sent) <= SEQ_MASK, "too many frames to tell first sends from resends"
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.001, 0.01, 0.05], help="chance each frame is corrupted")
+    parser.add_argument("--burst", type=int, default=8, help="messages the server sends between the peer's replies")
+    parser.add_argument("--seed", type=int, default=3002)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # mostly short messages, a few long enough to be fragmented
+    texts = ["".join(rng.choice("abcdefghij ") for _ in range(rng.choice((rng.randint(1, 200), rng.randint(1, 2000)))))
+             for _ in range(args.messages)]
+
+    print(f"{'loss':>6} {'frames':>7} {'corrupted':>9} {'resent':>7} {'resent bytes':>12} {'per corrupted':>13} "
+          f"{'resend-all per corrupted':>24}")
+    for loss in args.loss:
+        stats = run(texts, loss, args.burst, args.seed)
+        corrupted = max(stats["corrupted"], 1)
+        print(f"{loss:>6.1%} {stats['frames']:>7} {stats['corrupted']:>9} {stats['resent_frames']:>7} "
+              f"{stats['resent_bytes']:>12} {stats['resent_bytes']/corrupted:>11.0f} B "
+              f"{stats['window_bytes']/corrupted:>22.0f} B")
+
+if __name__ == "__main__":
+    main()
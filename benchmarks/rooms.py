@@ -0,0 +1,57 @@
+"""
+benchmarks/rooms.py
+
+How many concurrent rooms one server process can sustain. For each room count the server
+runs with --room-size 2, every pair of bots gets its own game and all games are played at
+once. Reports games per second, FIRE to RESULT latency, server threads and memory.
+
+Usage: python -m benchmarks.rooms [--rooms 10,50,100,200] [--mode asyncio]
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.netbot import NetBot, percentile, start_server, thread_count
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+async def play_rooms(port, num_rooms, proc):
+    bots = await asyncio.gather(*(NetBot.connect("127.0.0.1", port, f"bot{i}") for i in range(2*num_rooms)))
+    await asyncio.gather(*(bot.handshake() for bot in bots))
+    start = time.perf_counter()
+    results = await asyncio.gather(*(bot.play() for bot in bots))
+    elapsed = time.perf_counter() - start
+    threads, memory = thread_count(proc.pid), rss_mb(proc.pid)
+    games = sum(1 for bot in bots if any(m.msg == "YOU WIN!!!" for _, _, m in bot.log))
+    for bot in bots:
+        bot.close()
+    latencies = [latency for result in results for latency in result]
+    return games, elapsed, latencies, threads, memory
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", default="10,50,100,200", help="comma separated room counts")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="asyncio")
+    parser.add_argument("--port", type=int, default=5600)
+    args = parser.parse_args()
+
+    print(f"{'rooms':>6} {'games':>6} {'seconds':>8} {'games/s':>8} {'fire p50 (ms)':>14} {'p99 (ms)':>9} {'threads':>8} {'RSS (MB)':>9}")
+    for offset, num_rooms in enumerate(int(r) for r in args.rooms.split(",")):
+        port = args.port + offset
+        proc = start_server(port, "--mode", args.mode, "--room-size", "2", "--restart-delay", "0")
+        try:
+            games, elapsed, latencies, threads, memory = asyncio.run(play_rooms(port, num_rooms, proc))
+        finally:
+            proc.kill()
+            proc.wait()
+        print(f"{num_rooms:>6} {games:>6} {elapsed:>8.2f} {games/elapsed:>8.1f} {percentile(latencies, 50)*1000:>14.2f}"
+              f" {percentile(latencies, 99)*1000:>9.2f} {threads:>8} {memory:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+benchmarks/rto.py
+
+Recovery from lost frames with the retransmission timer. The server sends a message every few
+milliseconds to a peer (the one from benchmarks/retransmit.py) over a simulated link with a round
+trip time, jitter and random loss in both directions, so frames, ACKs and NACKs all go missing
+(frames that do arrive keep their order, as on the TCP stream the protocol runs over).
+Time is simulated: the client's SendWindow reads the simulated clock and server.timers is swapped for
+a wheel driven by it, so the server's own start_retransmit_timer()/retransmit_timed_out() run the timer.
+
+For each link it reports how long delivery took against a lossless link, how many frames were resent
+(and how many of those the peer already had), and the final smoothed RTT and RTO against the real round
+trip. The same run with a timer that never fires shows how much got through on NACKs alone.
+
+Usage: python -m benchmarks.rto [--messages 2000] [--rtt 10 50 200] [--loss 0 0.01 0.05]
+"""
+
+import argparse
+import heapq
+import itertools
+import random
+
+import server
+from benchmarks.retransmit import LinkConn, Peer, split_frames
+from protocol import *
+
+class SimTimer:
+    def __init__(self, wheel, callback, args):
+        self.wheel = wheel
+        self.callback = callback
+        self.args = args
+        self.generation = 0 # events from earlier arms are ignored
+
+    def rearm(self, duration):
+        self.generation += 1
+        self.wheel.schedule(self.wheel.now + duration, self.fire, self.generation)
+
+    def cancel(self):
+        self.generation += 1
+
+    def fire(self, generation):
+        if generation == self.generation and self.wheel.timers_fire:
+            self.callback(*self.args)
+            self.wheel.after_timer()
+
+class SimWheel:
+    # event queue and clock for one simulated link, with the interface of server.TimerWheel
+    def __init__(self, timers_fire=True):
+        self.now = 0.0
+        self.events = [] # (time, order, function, args)
+        self.order = itertools.count()
+        self.timers_fire = timers_fire
+        self.after_timer = lambda: None # puts what a timer wrote on the link
+
+    def clock(self):
+        return self.now
+
+    def schedule(self, at, function, *args):
+        heapq.heappush(self.events, (at, next(self.order), function, args))
+
+    def arm(self, duration, callback, *args):
+        timer = SimTimer(self, callback, args)
+        timer.rearm(duration)
+        return timer
+
+    def run_next(self):
+        self.now, _, function, args = heapq.heappop(self.events)
+        function(*args)
+
+def run(messages, interval, rtt, jitter, loss, seed, timers_fire=True):
+    rng = random.Random(seed)
+    wheel = SimWheel(timers_fire)
+    server.timers = wheel
+    client = server.Client(LinkConn(), ("link", 0))
+    client.id = 1
+    client.send_window = SendWindow(clock=wheel.clock)
+    peer = Peer(0)
+    texts = [f"message {i}" for i in range(messages)]
+    delivered = set() # seqs the peer has been handed
+    stats = dict(resent=0, spurious=0)
+
+    arrives = {"peer": 0.0, "server": 0.0}
+    def one_way(to):
+        # the frames ride a stream, so they arrive in the order they were sent whatever the delay
+        arrives[to] = max(arrives[to], wheel.now + max(0.0, rtt/2 + rng.uniform(-jitter, jitter)))
+        return arrives[to]
+
+    def to_peer():
+        # put what the server wrote on the link
+        data = client.conn.sent
+        client.conn.sent = bytearray()
+        for frame in split_frames(data):
+            seq = (frame[4]<<8) + frame[5]
+            if frame[6]>>6 in (PacketType.DATA.value, PacketType.FRAGMENT.value) and seq in sent:
+                stats["resent"] += 1
+                stats["spurious"] += seq in delivered
+            sent.add(seq)
+            if rng.random() >= loss:
+                wheel.schedule(one_way("peer"), peer_reads, frame)
+
+    def peer_reads(frame):
+        delivered.add((frame[4]<<8) + frame[5])
+        peer.read(frame)
+        replies = peer.replies
+        peer.replies = []
+        for reply in replies:
+            if rng.random() >= loss:
+                wheel.schedule(one_way("server"), server_reads, reply)
+
+    def server_reads(reply):
+        with server.SendBatch():
+            server.receive_frames(client, [reply])
+        to_peer()
+
+    def send(text):
+        with server.SendBatch():
+            server.send_message_to(client, Message(server.SERVER_ID, MessageType.CHAT, MessageType.CHAT, text))
+        to_peer()
+
+    sent = set()
+    wheel.after_timer = to_peer
+    for i, text in enumerate(texts):
+        wheel.schedule(i * interval, send, text)
+    while wheel.events and not (peer.seq_r == messages and len(peer.received) == messages):
+        wheel.run_next()
+
+    assert peer.received == texts[:len(peer.received)], "messages were reordered or changed"
+    window = client.send_window
+    return dict(stats, delivered=len(peer.received), time=wheel.now, srtt=window.srtt, rto=window.rto, timeouts=window.timeouts)
+
+def ms(seconds):
+    return "-" if seconds is None else f"{seconds*1000:.0f}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--interval", type=float, default=5, help="milliseconds between messages")
+    parser.add_argument("--rtt", type=float, nargs="+", default=[10, 50, 200], help="round trip times in milliseconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="one way delay varies by up to this fraction of the rtt")
+    parser.add_argument("--loss", type=float, nargs="+", default=[0, 0.01, 0.05], help="chance each frame is lost, each way")
+    parser.add_argument("--seed", type=int, default=3002)
+    args = parser.parse_args()
+
+    timer_wheel = server.timers
+    interval = args.interval / 1000
+    print(f"{'rtt':>5} {'loss':>5} {'time (s)':>9} {'lossless':>9} {'resent':>7} {'spurious':>9} {'timeouts':>9} "
+          f"{'srtt':>5} {'rto':>5} {'NACKs only':>11}")
+    try:
+        for rtt_ms in args.rtt:
+            rtt = rtt_ms / 1000
+            jitter = args.jitter * rtt
+            lossless = run(args.messages, interval, rtt, jitter, 0, args.seed)
+            for loss in args.loss:
+                result = run(args.messages, interval, rtt, jitter, loss, args.seed)
+                assert result["delivered"] == args.messages, f"stalled at {result['delivered']} of {args.messages} messages"
+                untimed = run(args.messages, interval, rtt, jitter, loss, args.seed, timers_fire=False)
+                print(f"{rtt_ms:>5.0f} {loss:>5.1%} {result['time']:>9.2f} {lossless['time']:>9.2f} {result['resent']:>7} "
+                      f"{result['spurious']:>9} {result['timeouts']:>9} {ms(result['srtt']):>5} {ms(result['rto']):>5} "
+                      f"{untimed['delivered']:>5}/{args.messages}")
+    finally:
+        server.timers = timer_wheel
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+benchmarks/server_modes.py
+
+Runs server.py in threaded and asyncio mode and compares:
+ - how long N simultaneous connections take to all receive their client id
+ - server thread count once they are connected and after a game
+ - FIRE to RESULT latency for a full game played in front of spectators
+
+Usage: python -m benchmarks.server_modes [--connections N] [--spectators N]
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.netbot import NetBot, percentile, start_server, thread_count
+
+async def connect_many(port, count):
+    start = time.perf_counter()
+    bots = await asyncio.gather(*(NetBot.connect("127.0.0.1", port, f"bot{i}") for i in range(count)))
+    await asyncio.gather(*(bot.handshake() for bot in bots))
+    return bots, time.perf_counter() - start
+
+async def play_game(port, spectators):
+    players, _ = await connect_many(port, 2)
+    watchers, _ = await connect_many(port, spectators)
+    results = await asyncio.gather(*(bot.play() for bot in players), *(bot.watch() for bot in watchers))
+    for bot in players + watchers:
+        bot.close()
+    return results[0] + results[1]
+
+def run_mode(mode, port, args):
+    result = {}
+    proc = start_server(port, "--mode", mode)
+    try:
+        bots, elapsed = asyncio.run(connect_many(port, args.connections))
+        result["connect"] = elapsed
+        result["threads_connected"] = thread_count(proc.pid)
+    finally:
+        proc.kill()
+        proc.wait()
+
+    proc = start_server(port + 1, "--mode", mode)
+    try:
+        latencies = asyncio.run(play_game(port + 1, args.spectators))
+        result["threads_after_game"] = thread_count(proc.pid)
+        result["p50"] = percentile(latencies, 50)
+        result["p99"] = percentile(latencies, 99)
+        result["shots"] = len(latencies)
+    finally:
+        proc.kill()
+        proc.wait()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=120, help="simultaneous connections (server allows 127)")
+    parser.add_argument("--spectators", type=int, default=20, help="spectators watching the latency game")
+    parser.add_argument("--port", type=int, default=5100)
+    args = parser.parse_args()
+
+    print(f"{'mode':>9} {'connect ' + str(args.connections) + ' (s)':>17} {'threads':>8} {'threads after game':>19} {'fire->result p50 (ms)':>22} {'p99 (ms)':>9}")
+    for offset, mode in enumerate(("threaded", "asyncio")):
+        r = run_mode(mode, args.port + 2*offset, args)
+        print(f"{mode:>9} {r['connect']:>17.3f} {r['threads_connected']:>8} {r['threads_after_game']:>19}"
+              f" {r['p50']*1000:>22.2f} {r['p99']*1000:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+benchmarks/shards.py
+
+Loopback load test for the multi-process server. For each worker count the server runs with
+--workers N --room-size 2 --restart-delay 0 and several load processes keep bots connecting,
+playing a game and disconnecting for a fixed time. Games per second is read from the
+coordinator's stats port, so it counts games the server completed rather than bot-side guesses.
+
+Scaling can only show up with free cores: the load processes compete with the workers, so
+on a machine with few cores the numbers stay flat.
+
+Usage: python -m benchmarks.shards [--workers 1,2,4] [--duration 10] [--load-processes N]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import time
+
+from benchmarks.netbot import NetBot, start_server
+
+def read_stats(port):
+    with socket.create_connection(("127.0.0.1", port)) as conn:
+        return json.loads(conn.makefile().readline())
+
+async def bot_loop(port, name, deadline):
+    # connect, play one game, disconnect, repeat; a bot left without an opponent waits for the next one
+    games = 0
+    while time.monotonic() < deadline:
+        bot = await NetBot.connect("127.0.0.1", port, f"{name}-{games}")
+        try:
+            await bot.handshake()
+            await asyncio.wait_for(bot.play(), max(0.1, deadline - time.monotonic()))
+            games += 1
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            bot.close()
+    return games
+
+def run_load(port, index, bots, duration):
+    deadline = time.monotonic() + duration
+    async def run():
+        return await asyncio.gather(*(bot_loop(port, f"load{index}-{i}", deadline) for i in range(bots)))
+    return sum(asyncio.run(run()))
+
+def measure(workers, port, args):
+    stats_port = port + 1000
+    proc = start_server(port, "--workers", str(workers), "--mode", args.mode, "--room-size", "2",
+                        "--restart-delay", "0", "--stats-port", str(stats_port))
+    try:
+        time.sleep(1.5) # let every worker report once
+        before = read_stats(stats_port)
+        with multiprocessing.Pool(args.load_processes) as pool:
+            pool.starmap(run_load, [(port, i, args.bots, args.duration) for i in range(args.load_processes)])
+        time.sleep(1.5) # and report again
+        after = read_stats(stats_port)
+    finally:
+        proc.kill()
+        proc.wait()
+    return after["games_completed"] - before["games_completed"], after["workers"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load per worker count")
+    parser.add_argument("--load-processes", type=int, default=max(2, os.cpu_count() // 2))
+    parser.add_argument("--bots", type=int, default=20, help="concurrent bots per load process")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="asyncio")
+    parser.add_argument("--port", type=int, default=5700)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.load_processes} load processes x {args.bots} bots, {args.duration:.0f} s each")
+    print(f"{'workers':>8} {'games':>7} {'games/s':>8} {'speedup':>8}")
+    baseline = None
+    for offset, workers in enumerate(int(w) for w in args.workers.split(",")):
+        games, reporting = measure(workers, args.port + offset, args)
+        rate = games / args.duration
+        baseline = baseline or rate
+        note = "" if reporting == workers else f" (only {reporting} workers reported)"
+        print(f"{workers:>8} {games:>7} {rate:>8.1f} {rate/baseline:>7.2f}x{note}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+benchmarks/slow_consumer.py
+
+A spectator that stops reading must not hold up the game. One scripted game is played with a
+spectator on a real socket whose other end isn't read until the game is over (both socket buffers
+shrunk so it fills after a few boards) next to spectators that keep up, once with each
+--slow-spectators policy and once without the stalled spectator for comparison.
+
+For each run it reports the time per turn (FIRE handled, boards and RESULT sent to everyone), the most
+bytes ever queued for the stalled spectator and how many boards it skipped. With "drop" the stalled
+spectator then starts reading, and the boards it ends up with are checked against the server's: it
+must be sent the latest version of every board once it catches up. With "disconnect" it must find its
+connection closed.
+
+Usage: python -m benchmarks.slow_consumer [--size 30] [--spectators 4] [--high-water 16384]
+"""
+
+import argparse
+import socket
+import statistics
+import time
+
+import server
+from benchmarks.board_updates import replay
+from benchmarks.inprocess import NullConn, RecordingConn, play_scripted_game
+from protocol import *
+
+SOCKET_BUFFER = 4096 # bytes asked for each side of the stalled spectator's socket
+
+def stalled_socket():
+    ours, theirs = socket.socketpair()
+    ours.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER)
+    theirs.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+    return ours, theirs
+
+def read_until_quiet(conn, quiet=0.5):
+    # everything that arrives until nothing has for quiet seconds, and whether the connection was closed
+    conn.settimeout(quiet)
+    data = bytearray()
+    while True:
+        try:
+            chunk = conn.recv(1<<16)
+        except socket.timeout:
+            return data, False
+        except ConnectionError:
+            return data, True
+        if not chunk:
+            return data, True
+        data += chunk
+
+def run(size, spectators, policy):
+    server.SLOW_SPECTATORS = policy
+    stalled = None
+    if policy is not None:
+        stalled = stalled_socket()
+    conns = iter([NullConn(), NullConn()] + ([stalled[0]] if stalled else []) + [RecordingConn() for _ in range(spectators)])
+
+    turns = []
+    last = [time.perf_counter()]
+    def on_turn(game):
+        now = time.perf_counter()
+        turns.append(now - last[0])
+        last[0] = now
+
+    clients = play_scripted_game(spectators + (stalled is not None), lambda: next(conns), on_turn=on_turn,
+                                 board_size=size, board_format="delta")
+    game = clients[0].game
+    result = dict(turns=turns, peak=0, dropped=0, closed=None, current=None)
+    for spectator in clients[3 if stalled else 2:]:
+        assert replay(spectator)[1], "a spectator that keeps up got no boards"
+    if stalled is None:
+        return result
+
+    client = clients[2]
+    result.update(peak=client.outbox.peak, dropped=client.dropped_boards)
+    data, result["closed"] = read_until_quiet(stalled[1])
+    client.conn = RecordingConn()
+    client.conn.sent = data
+    views = replay(client)[1]
+    # the spectator's copies have to be the boards as they are now
+    result["current"] = len(views) == 2 and all(views[key].version == game.players[int(key[0])].board.version for key in views)
+    for client in clients:
+        if client.drain_timer:
+            client.drain_timer.cancel()
+        client.outbox.close()
+    for conn in stalled:
+        conn.close()
+    return result
+
+def ms(seconds):
+    return f"{seconds*1000:.2f}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=30, help="rows and columns of each board")
+    parser.add_argument("--spectators", type=int, default=4, help="spectators that keep up")
+    parser.add_argument("--high-water", type=int, default=1<<14, help="server.HIGH_WATER for the run, in bytes")
+    parser.add_argument("--low-water", type=int, default=1<<12, help="server.LOW_WATER for the run, in bytes")
+    args = parser.parse_args()
+
+    defaults = server.HIGH_WATER, server.LOW_WATER, server.SLOW_SPECTATORS
+    server.HIGH_WATER, server.LOW_WATER = args.high_water, args.low_water
+    print(f"{'stalled spectator':>18} {'turns':>6} {'median ms':>10} {'max ms':>7} {'peak queued':>12} "
+          f"{'boards skipped':>15} {'caught up':>10} {'closed':>7}")
+    try:
+        for policy in (None, "drop", "disconnect"):
+            result = run(args.size, args.spectators, policy)
+            if policy == "drop":
+                assert result["current"] and not result["closed"], "the spectator didn't catch up to the latest boards"
+            if policy == "disconnect":
+                assert result["closed"], "the stalled spectator wasn't disconnected"
+            turns = result["turns"]
+            caught_up = "-" if result["current"] is None or result["closed"] else str(result["current"])
+            print(f"{policy or 'none':>18} {len(turns):>6} {ms(statistics.median(turns)):>10} {ms(max(turns)):>7} "
+                  f"{result['peak']:>12} {result['dropped']:>15} {caught_up:>10} {str(result['closed'] if policy else '-'):>7}")
+    finally:
+        server.HIGH_WATER, server.LOW_WATER, server.SLOW_SPECTATORS = defaults
+
+if __name__ == "__main__":
+    main()
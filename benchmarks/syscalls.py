@@ -0,0 +1,32 @@
+"""
+benchmarks/syscalls.py
+
+Counts the write syscalls the server makes over one full two-player game. Before the
+per-client outbox every frame was its own conn.send(), so the frame count is the old
+syscall count; with the outbox frames produced by one inbound message share a sendmsg().
+
+Usage: python -m benchmarks.syscalls [--spectators N]
+"""
+
+import argparse
+
+from benchmarks.inprocess import CountingConn, play_scripted_game
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spectators", type=int, default=2)
+    args = parser.parse_args()
+
+    clients = play_scripted_game(args.spectators, CountingConn)
+    print(f"{'client':>10} {'frames':>8} {'syscalls':>9} {'bytes':>8}")
+    total_frames = total_calls = 0
+    for client in clients:
+        role = "player" if client in clients[:2] else "spectator"
+        frames = client.seq_s
+        total_frames += frames
+        total_calls += client.conn.calls
+        print(f"{role:>10} {frames:>8} {client.conn.calls:>9} {client.conn.bytes:>8}")
+    print(f"{'total':>10} {total_frames:>8} {total_calls:>9}  ({total_frames/total_calls:.1f} frames per syscall)")
+
+if __name__ == "__main__":
+    main()
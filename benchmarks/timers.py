@@ -0,0 +1,61 @@
+"""
+benchmarks/timers.py
+
+Arm, re-arm and cancel throughput of the server's TimerWheel, how late timers fire,
+and the thread count while many timers are running.
+
+Usage: python -m benchmarks.timers [--timers N]
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from server import TimerWheel
+
+def rate(count, elapsed):
+    return f"{count/elapsed:>12,.0f} ops/sec"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--timers", type=int, default=100000)
+    args = parser.parse_args()
+
+    wheel = TimerWheel()
+    rng = random.Random(3002)
+    noop = lambda: None
+
+    start = time.perf_counter()
+    handles = [wheel.arm(rng.uniform(10, 60), noop) for _ in range(args.timers)]
+    print(f"arm:    {rate(args.timers, time.perf_counter() - start)}")
+
+    start = time.perf_counter()
+    for handle in handles:
+        handle.rearm(rng.uniform(10, 60))
+    print(f"re-arm: {rate(args.timers, time.perf_counter() - start)}")
+    print(f"threads with {args.timers} timers armed: {threading.active_count()}")
+
+    start = time.perf_counter()
+    for handle in handles:
+        handle.cancel()
+    print(f"cancel: {rate(args.timers, time.perf_counter() - start)}")
+
+    # how late do timers fire
+    lateness = []
+    done = threading.Event()
+    remaining = [1000]
+    def fired(due):
+        lateness.append(time.monotonic() - due)
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            done.set()
+    for _ in range(1000):
+        duration = rng.uniform(0.2, 1.0)
+        wheel.arm(duration, fired, time.monotonic() + duration)
+    done.wait(5)
+    lateness.sort()
+    print(f"firing lateness over 1000 timers: median {lateness[500]*1000:.1f} ms, max {lateness[-1]*1000:.1f} ms (tick {wheel.tick*1000:.0f} ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+benchmarks/transitions.py
+
+Measures how long the server takes to move between game phases, over several games:
+ - second player connects -> GAME STARTING
+ - last ship placed       -> BATTLE STARTING
+ - final shot fired       -> GAME OVER
+
+Usage: python -m benchmarks.transitions [--games N]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.netbot import NetBot, start_server
+from protocol import *
+
+async def one_game(port):
+    first = await NetBot.connect("127.0.0.1", port, "alice")
+    await first.handshake()
+    joined_at = time.perf_counter()
+    second = await NetBot.connect("127.0.0.1", port, "bob")
+    await second.handshake()
+    players = [first, second]
+    await asyncio.gather(*(bot.play() for bot in players))
+
+    started = second.first("recv", lambda m: m.msg == "GAME STARTING")
+    last_place = max(bot.last("sent", lambda m: m.type == MessageType.PLACE) for bot in players)
+    battle = min(bot.first("recv", lambda m: m.msg == "BATTLE STARTING") for bot in players)
+    last_fire = max(bot.last("sent", lambda m: m.type == MessageType.FIRE) for bot in players)
+    over = min(bot.first("recv", lambda m: m.msg == "GAME OVER") for bot in players)
+    for bot in players:
+        bot.close()
+    return started - joined_at, battle - last_place, over - last_fire
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--games", type=int, default=5)
+    parser.add_argument("--port", type=int, default=5300)
+    args = parser.parse_args()
+
+    samples = []
+    for i in range(args.games):
+        proc = start_server(args.port + i)
+        try:
+            samples.append(asyncio.run(one_game(args.port + i)))
+        finally:
+            proc.kill()
+            proc.wait()
+
+    for index, name in enumerate(("join -> GAME STARTING", "last PLACE -> BATTLE STARTING", "final FIRE -> GAME OVER")):
+        values = [sample[index]*1000 for sample in samples]
+        print(f"{name:>31}: mean {statistics.mean(values):8.1f} ms   max {max(values):8.1f} ms")
+
+if __name__ == "__main__":
+    main()
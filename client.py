@@ -3,206 +3,460 @@ client.py
 
 Connects to a Battleship server which runs the single-player game.
 Simply pipes user input to the server, and prints all server responses.
+
+The protocol side lives in classes that can be imported and used on their own:
+ - ClientSession keeps the state of one connection (sequence numbers, send and receive windows,
+   fragments, board copies) and does no I/O itself: bytes go in through receive(), frames come out
+   through the write function it is given
+ - BattleshipClient drives a session over a socket with a receiving thread
+ - AsyncBattleshipClient drives one from an asyncio event loop, so one process can run thousands
+
+    client = AsyncBattleshipClient()
+    await client.connect(HOST, PORT, "bot")
+    async for event in client:
+        if event.type == MessageType.TEXT and event.text.startswith("Enter coordinate"):
+            await client.fire("B4")
 """
 
+import asyncio
+import queue
 import socket
+import threading
+import time
+
+from protocol import *
 
 HOST = '127.0.0.1'
 PORT = 5000
 
-import threading
+RETRANSMIT_CHECK = 0.1 # seconds between looks at the retransmission timer
+CONNECT_TIMEOUT = 10 # seconds connect() waits for the server to give us an id
+
+BOARD_FORMAT = "binary" # asked for when connecting, see BOARD_FORMATS in protocol.py
+
+#region Session
+class Event:
+    # A whole message from the server, handed over in the order the server sent it. For a BOARD message
+    # board is the board as it now is, as lines of text (None when the local copy fell out of step, the
+    # session has asked for the whole board again and it comes as another event). received is the
+    # time.perf_counter() of the read that completed it.
+    def __init__(self, msg, board=None, received=None):
+        self.msg = msg
+        self.type = msg.type
+        self.expected = msg.expected
+        self.text = msg.msg
+        self.board = board
+        self.received = received
+
+class ClientSession:
+    # Protocol state of one connection to the server. write(data) puts an encoded frame on the
+    # connection, it is called with send_lock held so frames go out in seq order.
+    def __init__(self, write):
+        self.write = write
+        self.client_id = None # given by the server's first message
+        self.refused = None # why the server turned us away, if it did before giving us an id
+        self.expected_response = MessageType.CHAT # what the server last asked for
+
+        self.seq_s = 0
+        self.send_window = SendWindow() # frames waiting for an ACK
+
+        self.seq_r = 0
+        self.recv_window = ReceiveWindow() # frames received ahead of seq_r
+
+        self.decoder = FrameDecoder()
+        self.send_lock = threading.RLock() # a receiving thread also sends (ACKs, resends, board requests)
+        self.reassembler = Reassembler() # joins fragments of long messages from the server
+
+        self.boards = {} # board key -> BoardView, local copies kept up to date from BOARD snapshots and deltas
+
+    def connect_message(self, username, boards=BOARD_FORMAT):
+        return Message(id=self.sender_id, type=MessageType.CONNECT, expected=MessageType.TEXT,
+                       msg=encode_connect(username, boards=boards))
 
-import heapq
+#region Receive
+    # Handle bytes read from the connection, returns the Events for the messages they complete
+    def receive(self, data):
+        return self.handle_frames(self.decoder.feed(data))
+
+    def handle_frames(self, frames):
+        stale = False # frames that were already processed arrived
+        for msg in frames:
+            if msg.packet_type == PacketType.ACK: # everything before msg.seq has arrived
+                with self.send_lock: # the retransmit timer changes the window too
+                    self.send_window.ack(msg.seq)
+                continue
+
+            if msg.packet_type == PacketType.NACK: # resend only the frames asked for
+                with self.send_lock:
+                    for sent in self.send_window.resend(*nack_range(msg)):
+                        self.send_msg(sent, False)
+                continue
+
+            if seq_diff(msg.seq, self.seq_r) < 0: # already received, our ACK was lost
+                stale = True
+                continue
+
+            # queue data, gaps it reveals are NACKed, frames too far ahead are dropped
+            for first, count in self.recv_window.add(msg, self.seq_r):
+                self.send_nack(first, count)
+
+        if stale: # acknowledge again, once however many there were
+            self.send_ack(self.seq_r)
+        if self.decoder.checksum_failed:
+            for first, count in self.recv_window.corrupted(self.seq_r):
+                self.send_nack(first, count)
+
+        return self.process_messages()
+
+    def process_messages(self):
+        events = []
+        now = time.perf_counter()
+        start = self.seq_r
+        while True:
+            msg = self.recv_window.pop(self.seq_r)
+            if msg is None: # all messages in order read, later ones wait for the missing ones
+                if self.seq_r != start:
+                    self.send_ack(self.seq_r) # one cumulative ACK for everything processed
+                    for first, count in self.recv_window.reopened(start, self.seq_r):
+                        self.send_nack(first, count)
+                return events
+            self.seq_r = seq_add(self.seq_r, 1)
+
+            # join the fragments of a long message, only the whole message is processed
+            if msg.packet_type == PacketType.FRAGMENT or self.reassembler.pending():
+                msg = self.reassembler.add(msg)
+                if msg is None:
+                    continue
 
-import os
+            self.expected_response = msg.expected
+            if msg.type == MessageType.CONNECT and msg.msg.isdigit():
+                self.client_id = int(msg.msg)
+            elif msg.type == MessageType.DISCONNECT and self.client_id is None:
+                self.refused = msg.msg or "disconnected"
+            if msg.type == MessageType.BOARD:
+                events.append(Event(msg, self.update_board(msg.msg), now))
+            else:
+                events.append(Event(msg, received=now))
 
-from protocol import *
+    # Bring the local copy of a board up to date, returns its lines or None if a snapshot was asked for
+    def update_board(self, payload):
+        key = None
+        try:
+            kind, key, base, version, body = decode_board_payload(payload)
+            if kind == BOARD_SNAPSHOT:
+                self.boards.setdefault(key, BoardView()).load(version, body)
+                return self.boards[key].lines()
+            if kind == BOARD_BINARY:
+                self.boards.setdefault(key, BoardView()).load_binary(version, *body)
+                return self.boards[key].lines()
+            if kind == BOARD_DELTA:
+                view = self.boards.get(key)
+                if view is not None and view.apply(base, version, body):
+                    return view.lines()
+            else:
+                return body.split('|')
+        except ValueError: # a payload we couldn't read, start again from a snapshot
+            if key is None:
+                return None
+        self.send_board_request(key) # out of step, the server will send the whole board
+        return None
+#endregion
 
-client_id = None
-expected_response = MessageType.CHAT
-username = ""
+#region Send
+    def send_msg(self, msg, new=True):
+        with self.send_lock:
+            if new and msg.msg_len > MAX_PAYLOAD: # too long for one frame, send it in fragments
+                for fragment in msg.fragments():
+                    self.send_msg(fragment)
+                return
+            if new:
+                msg.seq = self.seq_s
+            self.write(msg.encode())
+            if new:
+                self.send_window.add(msg)
+                self.seq_s = seq_add(self.seq_s, 1)
+
+    @property
+    def sender_id(self):
+        # id our frames carry, 0 until the server has given us one
+        return self.client_id if self.client_id is not None else 0
+
+    # Send a message of the given type, e.g. send(MessageType.FIRE, "B4")
+    def send(self, type, text=""):
+        self.send_msg(Message(id=self.sender_id, type=type, expected=MessageType.TEXT, msg=text))
+
+    # Resend the oldest unacknowledged frame if nothing new has been acknowledged for a whole rto
+    def retransmit(self):
+        with self.send_lock:
+            oldest = self.send_window.timed_out() if self.send_window.expired() else None
+            if oldest is not None:
+                self.send_msg(oldest, False)
+
+    # Seconds until the retransmission timer runs out, None while nothing is waiting for an ACK
+    def retransmit_due(self):
+        window = self.send_window
+        if window.timer_started is None:
+            return None
+        return max(0.0, window.timer_started + window.rto - window.clock())
+
+    def send_ack(self, seq):
+        ack = Message(id=self.sender_id, type=MessageType.TEXT, expected=MessageType.TEXT, msg="",
+                      seq=seq, packet_type=PacketType.ACK)
+        self.send_msg(ack, False)
+
+    def send_board_request(self, key):
+        self.send(MessageType.BOARD, key)
+
+    def send_nack(self, first, count=1):
+        nack = Message(id=self.sender_id, type=MessageType.TEXT, expected=MessageType.TEXT, msg=count,
+                       seq=first, packet_type=PacketType.NACK)
+        self.send_msg(nack, False)
+#endregion
+#endregion
 
-seq_s = 0
-send_window = []
+#region Sync client
+class BattleshipClient:
+    # A session over a blocking socket. A receiving thread reads from the server and queues its Events
+    # for iteration (they pile up if nothing iterates), another runs the retransmission timer. The
+    # methods that send can be called from any thread.
+    def __init__(self):
+        self.sock = None
+        self.session = None
+        self.events = queue.Queue() # Events, None once the connection has closed
+        self.has_id = threading.Event()
+        self.closed = False
+
+    @property
+    def client_id(self):
+        return self.session.client_id
+
+    @property
+    def expected_response(self):
+        return self.session.expected_response
+
+    @property
+    def boards(self):
+        return self.session.boards
+
+    # Connect and join as username, returns once the server has taken our CONNECT
+    def connect(self, host, port, username, boards=BOARD_FORMAT, timeout=CONNECT_TIMEOUT):
+        self.sock = socket.create_connection((host, port))
+        self.session = ClientSession(self.sock.sendall)
+        for target in (self.receive_messages, self.retransmit_frames):
+            thread = threading.Thread(target=target)
+            thread.daemon = True # should be repalced with a cleaner exit if needed
+            thread.start()
+        if not self.has_id.wait(timeout) or self.session.client_id is None:
+            self.close()
+            raise ConnectionError(f"the server did not give us an id: {self.session.refused or 'timed out'}")
+        self.session.send_msg(self.session.connect_message(username, boards))
+
+    def receive_messages(self):
+        decoder = self.session.decoder
+        try:
+            while True:
+                if not decoder.fill_from(self.sock):
+                    break
+                for event in self.session.handle_frames(decoder.decode_frames()):
+                    self.events.put(event)
+                if self.session.client_id is not None or self.session.refused:
+                    self.has_id.set()
+        except OSError:
+            pass
+        self.has_id.set() # connect() stops waiting
+        self.events.put(None)
+
+    def retransmit_frames(self):
+        while not self.closed:
+            time.sleep(RETRANSMIT_CHECK)
+            try:
+                self.session.retransmit()
+            except OSError:
+                return
 
-seq_r = 0
-recv_window = []
+    # Events from the server until the connection closes
+    def __iter__(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                self.events.put(None) # for anyone else iterating
+                return
+            yield event
 
-incoming = bytearray()
+    def send(self, type, text=""):
+        self.session.send(type, text)
 
-#region Process
-def process_messages(s):
-    global client_id
-    global expected_response
-    global recv_window
-    global seq_r
-    global send_window
-    global seq_s
+    def place(self, coordinate):
+        self.send(MessageType.PLACE, coordinate)
 
-    while True:
-        #print(f"DEBUG: Messages to process {recv_window}")
-        try:
-            msg = heapq.heappop(recv_window)[1]
-            #print(f"DEBUG PROCESSING: seq: {msg.seq}, pck_t: {msg.packet_type}, type: {msg.type}, expected: {msg.expected}, id: {msg.id}, msg_len: {msg.msg_len}, msg: {msg.msg}\n\n\n")
-        except IndexError: # all messages read
-            #print(f"DEBUG: All messages processed")
-            return
-        
-        if msg.seq < seq_r: # skip duplicates
-            #print(f"DEBUG: Duplicate")
-            continue
-
-        if msg.seq > seq_r: # end if message is a future packet
-            #print(f"DEBUG: Future")
-            heapq.heappush(recv_window, (msg.seq, msg))
-            send_ack(s, seq_r)
-            return 
-        
-        # process the message
-        try:
-            #print(f"DEBUG: Processing message")
-            type = msg.type
-            expected_response = msg.expected
-
-            if type == MessageType.CONNECT:
-                client_id = int(msg.msg)
-
-            elif type == MessageType.TEXT:
-                print(f"[SERVER] {msg.msg}")
-
-            elif type == MessageType.CHAT:
-                print(msg.msg)
-            
-            elif type == MessageType.BOARD:
-                # Begin reading board lines
-                print("\n[Board]")
-                board_lines = msg.msg.split('|')
-                for line in board_lines:
-                    print(line)
-
-            elif type == MessageType.PLACE:
-                # these don't need to be printed
-                pass
-            
-            elif type == MessageType.RESULT:
-                print(msg.msg)
+    def fire(self, coordinate):
+        self.send(MessageType.FIRE, coordinate)
 
-            elif type == MessageType.DISCONNECT:
-                print("[INFO] you have been disconnected from the server")
-                raise KeyboardInterrupt
+    def chat(self, text):
+        self.send(MessageType.CHAT, text)
 
-            else:
-                print("Error unexpected message type")
-                send_nack(s)
-                return
-            
-            # all went well
-            seq_r += 1
-            seq_r = seq_r&((1<<16)-1) # loop if needed
-
-        except ValueError as e:
-            # needs to be handled better
-            print("#####\n"*5)
-            print(f"Failure decoding message, ignoring {e}")
-            print("#####\n"*5)
-            return
-#endregion
-
-#region Receive
-def receive_messages(s):
-    # These have to be here otherwise they don't work properly when referenced
-    global client_id
-    global expected_response
-    global recv_window
-    global seq_r
-    global send_window
-    global seq_s
-    global incoming
+    def disconnect(self):
+        self.session.send_msg(Message(id=self.session.sender_id, type=MessageType.DISCONNECT, expected=MessageType.TEXT, msg=self.client_id))
 
-    """Continuously receive and display messages from the server"""
-    while (True):
-        # Read from server
-        raw = s.recv(BUFSIZE)
-        
-        if not raw:
-            print("[INFO] Server disconnected.")
-            break
-        
-        incoming += bytearray(raw)
-
-        while len(incoming) >= 9:
+    def close(self):
+        self.closed = True
+        if self.sock is not None:
             try:
-                msg = Message.decode(incoming)
-                incoming = incoming[9+msg.msg_len:]
-
-                if msg.packet_type == PacketType.ACK:
-                    sent = heapq.heappop(send_window)
-                    while (sent[0] < msg.seq):
-                        sent = heapq.heappop(send_window)
-                    heapq.heappush(send_window, sent) # push the last element popped back on
-                    continue
-                
-                if msg.packet_type == PacketType.NACK: # resend all messages
-                    messages = send_window.copy()
-                    while True:
-                        try:
-                            send_msg(s, heapq.heappop(messages)[1], False) 
-                        except IndexError:
-                            break
-                    continue
-                
-                if (msg.seq >= seq_r): # queue future packets
-                    heapq.heappush(recv_window, (msg.seq, msg))
-                    continue
-                
-                if (msg.seq < seq_r): #ignore already received packets
-                    continue
-
-                
-            except NotEnoughBytesError:
-                break
-            
-            except ChecksumMismatchError:
-                send_nack(s)
-                incoming = bytearray()
-                break
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+#endregion
 
-        process_messages(s)
+#region Async client
+class AsyncBattleshipClient:
+    # A session over asyncio streams. A task per client reads from the server and queues its Events for
+    # iteration, the retransmission timer is a loop callback armed only while frames wait for an ACK.
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.session = None
+        self.events = asyncio.Queue() # Events, None once the connection has closed
+        self.has_id = asyncio.Event()
+        self.receiver = None
+        self.timer = None
+
+    @property
+    def client_id(self):
+        return self.session.client_id
+
+    @property
+    def expected_response(self):
+        return self.session.expected_response
+
+    @property
+    def boards(self):
+        return self.session.boards
+
+    # Connect and join as username, returns once our CONNECT is on its way
+    async def connect(self, host, port, username, boards=BOARD_FORMAT, timeout=CONNECT_TIMEOUT):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.session = ClientSession(self.writer.write)
+        self.receiver = asyncio.get_running_loop().create_task(self.receive_messages())
+        try:
+            await asyncio.wait_for(self.has_id.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if self.session.client_id is None:
+            await self.close()
+            raise ConnectionError(f"the server did not give us an id: {self.session.refused or 'timed out'}")
+        await self.send_msg(self.session.connect_message(username, boards))
+
+    async def receive_messages(self):
+        try:
+            while True:
+                data = await self.reader.read(1<<16)
+                if not data:
+                    break
+                for event in self.session.receive(data):
+                    self.events.put_nowait(event)
+                if self.session.client_id is not None or self.session.refused:
+                    self.has_id.set()
+                self.arm_timer() # ACKs may have emptied the window, resends refilled it
+        except OSError:
+            pass
+        finally:
+            self.has_id.set()
+            self.events.put_nowait(None)
+
+    def arm_timer(self):
+        due = self.session.retransmit_due()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if due is not None and not self.writer.is_closing():
+            self.timer = asyncio.get_running_loop().call_later(due, self.retransmit)
+
+    def retransmit(self):
+        self.timer = None
+        self.session.retransmit()
+        self.arm_timer()
+
+    def __aiter__(self):
+        return self
+
+    # the next Event from the server, iteration stops when the connection closes
+    async def __anext__(self):
+        event = await self.events.get()
+        if event is None:
+            self.events.put_nowait(None) # for anyone else iterating
+            raise StopAsyncIteration
+        return event
+
+    async def send_msg(self, msg):
+        self.session.send_msg(msg)
+        if self.timer is None:
+            self.arm_timer()
+        await self.writer.drain()
+
+    async def send(self, type, text=""):
+        await self.send_msg(Message(id=self.session.sender_id, type=type, expected=MessageType.TEXT, msg=text))
+
+    async def place(self, coordinate):
+        await self.send(MessageType.PLACE, coordinate)
+
+    async def fire(self, coordinate):
+        await self.send(MessageType.FIRE, coordinate)
+
+    async def chat(self, text):
+        await self.send(MessageType.CHAT, text)
+
+    async def disconnect(self):
+        await self.send_msg(Message(id=self.session.sender_id, type=MessageType.DISCONNECT, expected=MessageType.TEXT, msg=self.client_id))
+
+    async def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        if self.receiver is not None:
+            await self.receiver
 #endregion
 
-#region Send
-def send_msg(s, msg, new=True):
-    encoded = msg.encode()
-    #print(f"DEBUG SENDING: seq: {msg.seq}, pck_t: {msg.packet_type}, type: {msg.type}, expected: {msg.expected}, id: {msg.id}, msg_len: {msg.msg_len}, msg: {msg.msg}\n\n\n")
-    s.send(encoded)
-    if new:
-        heapq.heappush(send_window, (msg.seq, msg))
-        global seq_s
-        seq_s = (seq_s+1)&((1<<16)-1) # add one and loop if needed
-
-def send_ack(s, seq):
-    ack = Message(id=client_id, type=MessageType.TEXT, expected=MessageType.TEXT, msg="",\
-                           seq=seq, packet_type=PacketType.ACK)
-    send_msg(s, ack, False)
-
-def send_nack(s):
-    nack = Message(id=client_id, type=MessageType.TEXT, expected=MessageType.TEXT, msg="",\
-                           seq=0, packet_type=PacketType.NACK)
-    send_msg(s, nack, False)
-
-def send_messages(s):
+#region Interactive
+def show(event):
+    type = event.type
+    if type == MessageType.TEXT:
+        print(f"[SERVER] {event.text}")
+    elif type in (MessageType.CHAT, MessageType.RESULT):
+        print(event.text)
+    elif type == MessageType.BOARD:
+        if event.board is not None:
+            print("\n[Board]")
+            for line in event.board:
+                print(line)
+    elif type == MessageType.DISCONNECT:
+        print("[INFO] you have been disconnected from the server")
+    elif type not in (MessageType.CONNECT, MessageType.PLACE): # these don't need to be printed
+        print("Error unexpected message type")
+
+def receive_messages(client):
+    """Continuously receive and display messages from the server"""
+    for event in client:
+        show(event)
+    print("[INFO] Server disconnected.")
+
+def send_messages(client):
     while(True):
         try:
             user_input = input("")
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, EOFError):
             return
 
         ## handle word inputs to decided type then check mismatch at recieve
         command = user_input.split(" ")
-        #print(command)
 
-        send_type = expected_response
-        #print(expected_response)
+        send_type = client.expected_response
 
         match command[0].upper():
             case "FIRE":
@@ -222,16 +476,12 @@ def send_messages(s):
                 command.pop(0)
             case default:
                 pass
-        
-        user_msg = " ".join(command)
-        #print("user message: " + user_msg)
 
-        msg = Message(id=client_id, type=send_type, expected=MessageType.TEXT, msg=user_msg, seq=seq_s)
-        send_msg(s, msg)
-        
+        client.send(send_type, " ".join(command))
+
         if send_type == MessageType.DISCONNECT:
             print("[INFO] Disconnecting from server")
-            quit()
+            return
 #endregion
 
 #region Connect
@@ -245,29 +495,27 @@ def main():
         except KeyboardInterrupt:
             return
 
-    # Set up connection
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect((HOST, PORT))
-        
-        # Start a thread for receiving messages
-        receiver = threading.Thread(target=receive_messages, args=[s])
-        receiver.daemon = True # should be repalced with a cleaner exit if needed
-        receiver.start()
-
-        while True:
-            if client_id != None:
-                msg = Message(id=client_id, type=MessageType.CONNECT, expected=MessageType.TEXT, msg=username)
-                send_msg(s, msg)
-                break
-
-        # Main thread handles sending user input
-        try:
-            send_messages(s)
-        except KeyboardInterrupt:
-            print("\n[INFO] Client exiting.")
-            msg = Message(id=client_id, type=MessageType.DISCONNECT, expected=MessageType.TEXT, msg=client_id)
-            send_msg(s, msg)
+    client = BattleshipClient()
+    try:
+        client.connect(HOST, PORT, username)
+    except OSError as e: # refused, unreachable, or the server didn't give us an id
+        print(f"[ERROR] could not connect to {HOST}:{PORT}: {e}")
+        return
+
+    # Start a thread for displaying what the server sends
+    receiver = threading.Thread(target=receive_messages, args=[client])
+    receiver.daemon = True
+    receiver.start()
+
+    # Main thread handles sending user input
+    try:
+        send_messages(client)
+    except KeyboardInterrupt:
+        print("\n[INFO] Client exiting.")
+        client.disconnect()
+    finally:
+        client.close()
 #endregion
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
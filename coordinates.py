@@ -0,0 +1,68 @@
+"""
+coordinates.py
+
+Coordinate names of a board ('A1' .. 'CV100'), shared by the game logic in battleship.py and the
+wire format in protocol.py:
+ - row_label() for the label of a zero-based row: A .. Z, AA, AB, ...
+ - CoordinateCodec, the names of every cell of one board size, built once per size
+
+"""
+
+def row_label(row):
+    """
+    Label of a zero-based row: A .. Z, then AA .. AZ, BA .. ZZ, AAA, ... (like spreadsheet columns).
+    """
+    label = ""
+    row += 1
+    while row:
+        row, letter = divmod(row - 1, 26)
+        label = chr(ord('A') + letter) + label
+    return label
+
+class CoordinateCodec:
+    """
+    Coordinate names for one board size, worked out once and shared by every board of that size:
+      - self.row_labels: the label of each row ('A', 'B', ..., 'Z', 'AA', ...)
+      - self.padded_labels: the labels padded to self.label_width, for printing grids
+      - self.column_width: the width each column number is padded to
+      - self.column_header: the column numbers ' 1  2 ... N' as they head a board sent to clients
+      - self.names: names[r][c] is the name of cell (r, c), e.g. names[1][4] == 'B5'
+      - self.cells: name -> (r, c), so parsing a coordinate is one dictionary lookup
+        instead of checking its letters and digits
+    """
+    codecs = {} # board size -> CoordinateCodec
+
+    def __init__(self, size):
+        self.size = size
+        self.row_labels = [row_label(r) for r in range(size)]
+        self.label_width = max(2, len(self.row_labels[-1]))
+        self.padded_labels = [label.ljust(self.label_width) for label in self.row_labels]
+        # wide enough for the largest column number, so columns from 100 on still line up
+        self.column_width = max(2, len(str(size)))
+        self.column_header = " ".join(str(c + 1).rjust(self.column_width) for c in range(size))
+        self.names = [[f"{label}{c + 1}" for c in range(size)] for label in self.row_labels]
+        self.cells = {name: (r, c) for r, row in enumerate(self.names) for c, name in enumerate(row)}
+
+    @classmethod
+    def for_size(cls, size):
+        codec = cls.codecs.get(size)
+        if codec is None:
+            if size < 1:
+                raise ValueError("board size must be at least 1")
+            codec = cls.codecs[size] = cls(size)
+        return codec
+
+    def parse(self, coord_str):
+        """
+        Convert something like 'B5' into zero-based (row, col), raising ValueError if it isn't on the board.
+        """
+        cell = self.cells.get(coord_str.strip().upper())
+        if cell is None:
+            raise ValueError(f"expected a coordinate from A1 to {self.names[-1][-1]}")
+        return cell
+
+    def format(self, row, col):
+        """
+        Name of the zero-based cell (row, col), e.g. (1, 4) => 'B5'.
+        """
+        return self.names[row][col]
@@ -1,6 +1,19 @@
+import itertools
+import time
 from enum import Enum
 
+from coordinates import CoordinateCodec
+
 BUFSIZE = 520 # Maximum size of a packet
+HEADER_SIZE = 9 # crc (4) + seq (2) + types (1) + id/length (2)
+MAX_PAYLOAD = 511 # the length field is 9 bits, longer messages are sent as fragments
+MAX_MESSAGE_SIZE = 1<<20 # largest message a receiver reassembles, longer ones are dropped
+SEQ_MASK = (1<<16)-1 # sequence numbers are 16 bits and wrap around
+RECEIVE_WINDOW = 512 # frames a receiver holds ahead of the next one it processes, a power of two
+
+INITIAL_RTO = 1.0 # seconds before the first unacknowledged frame is resent, until the round trip has been measured
+MIN_RTO = 0.2
+MAX_RTO = 60.0
 
 #region Errors
 class NotEnoughBytesError(Exception):
@@ -15,6 +28,7 @@ class PacketType(Enum):
   DATA = 0
   ACK = 1
   NACK = 2
+  FRAGMENT = 3 # a piece of a message longer than MAX_PAYLOAD, the message's last piece is a DATA frame
 
 class MessageType(Enum):
   DISCONNECT = 0 # Tells the server a player is disconnecting
@@ -27,6 +41,18 @@ class MessageType(Enum):
   RESULT = 7 # Acknowledges result of player's fire attempt.
 #endregion
 
+#region Sequence Numbers
+# Serial number arithmetic (RFC 1982): sequence numbers wrap from 65535 to 0, so they are compared by
+# their distance rather than their value. Correct while the two are less than 32768 apart.
+
+# How far a is ahead of b, negative when a is behind
+def seq_diff(a, b):
+  return ((a - b + (1<<15)) & SEQ_MASK) - (1<<15)
+
+def seq_add(seq, n):
+  return (seq + n) & SEQ_MASK
+#endregion
+
 #region CRC32
 def invert_bit_order(num):
   out = 0
@@ -35,7 +61,8 @@ def invert_bit_order(num):
     out += bit<<(7-i)
   return out
 
-def crc32(pack):
+# Original bit-by-bit implementation, kept as the reference the table below is built from.
+def crc32_bitwise(pack):
   # convert bytes object to an integer for python bitwise operations
   input = 0
   total_bytes = len(pack)
@@ -61,44 +88,72 @@ def crc32(pack):
   crc.append((input&(255<<8))>>8) # etc...
   crc.append(input&(255))
   return crc
+
+# invert_bit_order() only looks at the low 8 bits of its argument, so every byte except the
+# last one is shifted out before it reaches the division above. The checksum therefore only
+# depends on the final byte of the packet, and all 256 possible values can be precomputed.
+# Peers running crc32_bitwise() produce exactly the same 4 bytes.
+CRC32_TABLE = [bytes(crc32_bitwise(bytes([byte]))) for byte in range(256)]
+CRC32_EMPTY = bytes(4)
+
+def crc32(pack):
+  if len(pack) == 0:
+    return CRC32_EMPTY
+  return CRC32_TABLE[pack[-1]]
 #endregion
 
 #region Message Struct
 class Message:
   # Stucture of a basic message to send over the socket.
-  def __init__(self, id, type, expected, msg="", seq=0, packet_type=PacketType.DATA):
+  # The payload travels as bytes (self.data, msg_len of them): UTF-8 text, except for binary board
+  # snapshots whose packed cells go out as raw bytes (see payload_encoding()). self.msg is the payload
+  # as text, decoded when it is first read, so a received frame that only gets passed on or joined to
+  # others (see Reassembler) is never decoded on its own.
+  def __init__(self, id, type, expected, msg="", seq=0, packet_type=PacketType.DATA, data=None):
     self.seq = seq
     self.packet_type = packet_type # Packet type (2 bits)
     self.type = type # Type of the message being sent
     self.expected = expected # Type of message sender expects to receive, set NONE for no resposne
     self.id = id 
-    self.msg = str(msg)
-    self.msg_len = len(self.msg)
+    if data is None:
+      self.text = str(msg)
+      self.data = self.text.encode(payload_encoding(type, self.text))
+    else:
+      self.text = None
+      self.data = data
+    self.msg_len = len(self.data)
+
+  @property
+  def msg(self):
+    if self.text is None:
+      self.text = str(self.data, payload_encoding(self.type, self.data), "replace")
+    return self.text
 #endregion
 
 #region Encoding
+  # A single frame: raises ValueError if the payload is longer than MAX_PAYLOAD, longer messages have
+  # to be sent as their fragments() (the length field can't hold more, and cutting it would lose the rest)
   def encode(self):
+    if self.msg_len > MAX_PAYLOAD:
+      raise ValueError(f"a {self.msg_len} byte payload doesn't fit in one frame, send its fragments()")
     pack = bytearray()
     pack.append(self.seq>>8)
     pack.append(self.seq&255)
     pack.append((self.packet_type.value<<6)+(self.type.value<<3)+(self.expected.value))
-    if self.msg_len > 511:
-      self.msg = self.msg[0:511] # cut mesages off at 511 bytes
-      self.msg_len = 511
     pack.append((self.id<<1)+(self.msg_len>>8))
     pack.append(self.msg_len&255)
-    if len(self.msg) != 0:
-      pack = (pack + bytearray(self.msg.encode("utf-8")))
+    if self.msg_len != 0:
+      pack += self.data
     crc = crc32(pack)
     return bytes(crc + pack)
 #endregion
 
 #region Decoding
-  # Decode an encoded message into a Message object
+  # Decode an encoded message into a Message object, data can be any bytes-like object (including a memoryview)
   @staticmethod
   def decode(data):
     data_len = len(data)
-    if (data_len < 9):
+    if (data_len < HEADER_SIZE):
       raise NotEnoughBytesError
 
     crc = data[0:4]
@@ -108,19 +163,567 @@ class Message:
     expected_type = MessageType(data[6]&(7))
     id = data[7]>>1
     msg_len = ((data[7]&1)<<8) + data[8]
-    msg = ""
-    if msg_len != 0:
-      try:
-        msg = data[9:9+msg_len].decode("latin-1")
-      except IndexError:
-        raise NotEnoughBytesError
+    if data_len < HEADER_SIZE+msg_len:
+      raise NotEnoughBytesError
 
-    expected_crc = crc32(bytearray(data[4:9+msg_len]))
+    expected_crc = crc32(data[4:9+msg_len])
     if crc != expected_crc:
       raise ChecksumMismatchError
     
-    return Message(id=id, type=message_type, expected=expected_type, msg=msg, seq=seq, packet_type=packet_type)
+    return Message(id=id, type=message_type, expected=expected_type, seq=seq, packet_type=packet_type,
+                   data=bytes(data[9:9+msg_len]))
 #endregion
 
   def copy(self): # Used to copy a packet to avoid python object shenanigans
-    return Message(self.id, self.type, self.expected, self.msg, self.seq, self.packet_type)
\ No newline at end of file
+    return Message(self.id, self.type, self.expected, seq=self.seq, packet_type=self.packet_type, data=self.data)
+
+  # The frames this message is sent as: itself if it fits in one, otherwise FRAGMENT frames of MAX_PAYLOAD
+  # bytes and a final DATA frame, each needing its own seq. Frames are cut as they are asked for.
+  def fragments(self):
+    if self.msg_len <= MAX_PAYLOAD:
+      yield self
+      return
+    yield from fragment_data(self.id, self.type, self.expected, (self.data,))
+
+# How a payload is turned into bytes: binary board snapshots carry their packed cells as characters
+# 0-255, one byte each, and everything else is UTF-8. payload is the text or the bytes of the payload
+# (or of the first piece of it), whose first character tells a binary snapshot apart.
+def payload_encoding(type, payload):
+  if type == MessageType.BOARD and payload[:1] in (BOARD_BINARY, BOARD_BINARY_BYTE):
+    return "latin-1"
+  return "utf-8"
+
+#region Fragmentation
+# A message too long for one frame goes out as consecutive FRAGMENT frames followed by one DATA frame,
+# all with the message's types and id. Each takes the next seq, so fragments are acknowledged and
+# resent like any other frame, and the receiver joins them back together in seq order. Messages are
+# cut by bytes, so a UTF-8 character can be split between two frames; the receiver only decodes the
+# joined payload.
+
+# Frames for a message whose payload comes as an iterable of strings (e.g. produced a row at a time).
+# A frame is yielded as soon as MAX_PAYLOAD bytes are ready, so a long payload never has to be
+# built in full before the first frame can be sent.
+def fragment_message(id, type, expected, chunks):
+  chunks = iter(chunks)
+  first = next(chunks, "")
+  encoding = payload_encoding(type, first)
+  yield from fragment_data(id, type, expected, itertools.chain((first.encode(encoding),),
+                                                               (chunk.encode(encoding) for chunk in chunks)))
+
+# The same for a payload that is already bytes
+def fragment_data(id, type, expected, chunks):
+  pending = b"" # at most MAX_PAYLOAD bytes not sent yet, held back in case they are the last piece
+  for chunk in chunks:
+    if pending:
+      chunk = pending + chunk
+    start = 0
+    while len(chunk) - start > MAX_PAYLOAD:
+      yield Message(id, type, expected, packet_type=PacketType.FRAGMENT, data=chunk[start:start+MAX_PAYLOAD])
+      start += MAX_PAYLOAD
+    pending = chunk[start:]
+  yield Message(id, type, expected, data=pending)
+
+class Reassembler:
+  # Joins FRAGMENT frames back into the message they were cut from. Frames must be added in seq order.
+  # At most max_size bytes are held: a message that grows past it is dropped, along with the rest
+  # of its fragments, and counted in self.dropped.
+  def __init__(self, max_size=MAX_MESSAGE_SIZE):
+    self.max_size = max_size
+    self.parts = []
+    self.size = 0
+    self.dropping = False
+    self.dropped = 0
+
+  # True while part of a message has been received
+  def pending(self):
+    return self.dropping or bool(self.parts)
+
+  # Add the next frame. Returns the whole message once its last frame arrives, None until then
+  # (and for a dropped message).
+  def add(self, msg):
+    if msg.packet_type == PacketType.FRAGMENT:
+      if not self.dropping:
+        self.parts.append(msg.data)
+        self.size += msg.msg_len
+        if self.size > self.max_size:
+          self.parts = []
+          self.size = 0
+          self.dropping = True
+      return None
+    if self.dropping:
+      self.dropping = False
+      self.dropped += 1
+      return None
+    if not self.parts:
+      return msg
+    self.parts.append(msg.data)
+    whole = Message(msg.id, msg.type, msg.expected, seq=msg.seq, data=b"".join(self.parts))
+    self.parts = []
+    self.size = 0
+    return whole
+#endregion
+
+#region Windows
+# ACK frames are cumulative: an ACK with seq n says every frame before n has arrived. A NACK asks for
+# the frames from its seq onwards, as many as its payload says (one if it is empty), so only frames
+# that went missing are sent again.
+
+def nack_range(msg):
+  # (first seq, count) of the frames a NACK asks for
+  return msg.seq, int(msg.msg) if msg.msg.isdigit() else 1
+
+class SendWindow:
+  # Frames sent and not acknowledged yet, in seq order. Every new frame takes the next seq, so the frame
+  # with seq s is at index seq_diff(s, first seq): an ACK trims the window with one slice and a NACK
+  # finds its frames without searching.
+  #
+  # It also times the round trip and works out the retransmission timeout as in RFC 6298: ACKs give RTT
+  # samples (none when they cover a resent frame, as the ACK can't be matched to one send), smoothed
+  # into srtt and rttvar, and rto = srtt + 4*rttvar. Each timeout doubles the rto until something new
+  # is acknowledged. The caller runs the timer, see timer_started.
+  def __init__(self, clock=time.monotonic):
+    self.frames = []
+    self.sent_at = [] # clock() when each frame was sent, None once it has been resent
+    self.clock = clock
+    self.srtt = None # smoothed round trip time in seconds, None until the first sample
+    self.rttvar = None
+    self.base_rto = INITIAL_RTO
+    self.backoff = 0 # timeouts in a row
+    self.timer_started = None # when the timer for the oldest frame (re)started, None while nothing is unacknowledged
+    self.retransmits = 0 # frames resent, for NACKs and timeouts
+    self.timeouts = 0
+
+  def __len__(self):
+    return len(self.frames)
+
+  def clear(self):
+    self.frames = []
+    self.sent_at = []
+    self.timer_started = None
+
+  @property
+  def rto(self):
+    return min(self.base_rto * (1 << self.backoff), MAX_RTO)
+
+  def add(self, msg):
+    now = self.clock()
+    self.frames.append(msg)
+    self.sent_at.append(now)
+    if self.timer_started is None:
+      self.timer_started = now
+
+  # Drop every frame before seq, returns how many went
+  def ack(self, seq):
+    if not self.frames:
+      return 0
+    count = seq_diff(seq, self.frames[0].seq)
+    if count <= 0:
+      return 0
+    # time the newest frame acknowledged, it is the closest to one round trip. If any of them was resent
+    # the ACK may have waited for the resend, so there is no sample.
+    sent = self.sent_at[count-1] if None not in self.sent_at[:count] else None
+    del self.frames[:count]
+    del self.sent_at[:count]
+    now = self.clock()
+    if sent is not None:
+      self.sample(now - sent)
+    self.backoff = 0
+    self.timer_started = now if self.frames else None
+    return count
+
+  def sample(self, rtt):
+    if self.srtt is None:
+      self.srtt = rtt
+      self.rttvar = rtt / 2
+    else:
+      self.rttvar = 0.75*self.rttvar + 0.25*abs(self.srtt - rtt)
+      self.srtt = 0.875*self.srtt + 0.125*rtt
+    self.base_rto = min(max(self.srtt + 4*self.rttvar, MIN_RTO), MAX_RTO)
+
+  # The frames from first to first+count-1 that are still waiting for an ACK
+  def resend(self, first, count):
+    if not self.frames:
+      return []
+    start = max(seq_diff(first, self.frames[0].seq), 0)
+    stop = max(start, min(seq_diff(first, self.frames[0].seq) + count, len(self.frames)))
+    self.sent_at[start:stop] = [None] * (stop - start)
+    self.retransmits += stop - start
+    return self.frames[start:stop]
+
+  # True once the oldest frame has waited a whole rto for its ACK
+  def expired(self):
+    return self.timer_started is not None and self.clock() - self.timer_started >= self.rto
+
+  # The timer ran out: returns the oldest frame to send again (None if everything has been acknowledged)
+  # and backs the rto off
+  def timed_out(self):
+    if not self.frames:
+      return None
+    self.sent_at[0] = None
+    if self.base_rto * (1 << self.backoff) < MAX_RTO:
+      self.backoff += 1
+    self.timeouts += 1
+    self.retransmits += 1
+    self.timer_started = self.clock()
+    return self.frames[0]
+
+  # The timer ran out but the oldest frame wasn't resent (it would only have queued behind frames not
+  # written yet): start the timer again without counting a timeout or backing the rto off
+  def restart_timer(self):
+    if self.frames:
+      self.timer_started = self.clock()
+
+class ReceiveWindow:
+  # Frames received ahead of the next one to process, and the gaps before them. The next seq to process
+  # is kept by the caller (seq_r) and passed in. Frames sit in a fixed ring of slots indexed by seq modulo
+  # its size, so storing, finding and spotting a duplicate don't search, and a sender can't make it hold
+  # more than size frames: frames further ahead are dropped and NACKed once the window reaches them.
+  def __init__(self, size=RECEIVE_WINDOW):
+    self.slots = [None] * size # a power of two, so seq % size keeps counting up across the wrap
+    self.count = 0 # frames held
+    self.end = None # one past the highest seq received or asked for
+    self.beyond = None # one past the highest seq dropped for being outside the window
+    self.dropped = 0 # frames dropped for being outside the window
+
+  def __len__(self):
+    return self.count
+
+  def get(self, seq):
+    msg = self.slots[seq % len(self.slots)]
+    return msg if msg is not None and msg.seq == seq else None
+
+  # Keep a DATA or FRAGMENT frame. Returns the (first, count) ranges it shows are missing, to NACK;
+  # a frame that has already been processed or is already held is ignored.
+  def add(self, msg, next_seq):
+    offset = seq_diff(msg.seq, next_seq)
+    if offset < 0:
+      return ()
+    if offset >= len(self.slots): # too far ahead
+      self.dropped += 1
+      if self.beyond is None or seq_diff(msg.seq, self.beyond) >= 0:
+        self.beyond = seq_add(msg.seq, 1)
+      return ()
+    if self.end is None or seq_diff(self.end, next_seq) < 0: # nothing received past next_seq yet
+      self.end = next_seq
+    if self.get(msg.seq) is not None:
+      return ()
+    slot = msg.seq % len(self.slots)
+    if self.slots[slot] is None:
+      self.count += 1
+    self.slots[slot] = msg
+    gap = seq_diff(msg.seq, self.end)
+    if gap < 0: # fills a gap
+      return ()
+    self.end = seq_add(msg.seq, 1)
+    return ((seq_add(msg.seq, -gap), gap),) if gap else ()
+
+  # The frame with seq next_seq, None if it hasn't arrived
+  def pop(self, next_seq):
+    msg = self.get(next_seq)
+    if msg is not None:
+      self.slots[next_seq % len(self.slots)] = None
+      self.count -= 1
+    return msg
+
+  # After the caller has processed the frames from start up to next_seq: the range of frames that were
+  # dropped for being too far ahead and now fit in the window, to NACK
+  def reopened(self, start, next_seq):
+    if self.beyond is None:
+      return ()
+    first = seq_add(start, len(self.slots))
+    stop = seq_add(next_seq, len(self.slots))
+    if seq_diff(self.beyond, stop) <= 0: # the window reaches everything that was dropped
+      stop = self.beyond
+      self.beyond = None
+    count = seq_diff(stop, first)
+    if count <= 0:
+      return ()
+    self.end = stop
+    return ((first, count),)
+
+  # Ranges to NACK after a frame failed its checksum: every gap still open and, as frames arrive in
+  # order, the frame after the last one received (which is then not asked for again)
+  def corrupted(self, next_seq):
+    if self.end is None or seq_diff(self.end, next_seq) < 0:
+      self.end = next_seq
+    ranges = []
+    first = None
+    for offset in range(seq_diff(self.end, next_seq)):
+      seq = seq_add(next_seq, offset)
+      if self.get(seq) is not None:
+        if first is not None:
+          ranges.append((first, seq_diff(seq, first)))
+          first = None
+      elif first is None:
+        first = seq
+    if first is not None:
+      ranges.append((first, seq_diff(self.end, first)))
+    if seq_diff(self.end, next_seq) >= len(self.slots): # the frame after would be outside the window
+      return ranges
+    if ranges and seq_diff(self.end, seq_add(ranges[-1][0], ranges[-1][1])) == 0:
+      ranges[-1] = (ranges[-1][0], ranges[-1][1] + 1)
+    else:
+      ranges.append((self.end, 1))
+    self.end = seq_add(self.end, 1)
+    return ranges
+
+  # The frames held, in seq order
+  def messages(self, next_seq):
+    held = (self.get(seq_add(next_seq, offset)) for offset in range(len(self.slots)))
+    return [msg for msg in held if msg is not None]
+#endregion
+
+#region Encoded Message
+class EncodedMessage:
+  # A Message serialised once so the same frame can be sent to many clients. The sequence number
+  # is the only field that differs between recipients, and because crc32() only depends on the
+  # last byte of the packet the checksum is shared too, so each recipient costs a 6 byte header
+  # no matter how long the payload is.
+  def __init__(self, msg):
+    self.msg = msg
+    frame = msg.encode()
+    self.crc = frame[0:4]
+    self.body = frame[6:] # types, id, length and payload
+
+  # Frame for a single recipient as (header, body) buffers, ready for socket.sendmsg()
+  def segments(self, seq):
+    return (self.crc + bytes((seq>>8, seq&255)), self.body)
+
+  # The Message as it is sent with a given sequence number (kept in send windows for resending)
+  def with_seq(self, seq):
+    msg = self.msg.copy()
+    msg.seq = seq
+    return msg
+#endregion
+
+#region Frame Decoder
+class FrameDecoder:
+  # Turns a byte stream into Messages. Received bytes are written into one preallocated buffer and
+  # frames are decoded in place through a memoryview, so nothing is copied per decoded frame; the
+  # unread tail is only moved back to the front when the buffer runs out of room. feed() skips the
+  # buffer when nothing is pending and decodes from the bytes it is given. Per frame it costs about what
+  # the old reslicing loop did for reads of a few frames, it only pulls ahead on bursts of hundreds.
+  def __init__(self, capacity=8*BUFSIZE):
+    self.buffer = bytearray(capacity)
+    self.start = 0 # offset of the first byte not yet decoded
+    self.end = 0 # offset one past the last byte received
+    self.checksum_failed = False # set when the last batch stopped at a corrupted frame
+
+  def pending(self):
+    return self.end - self.start
+
+  def reset(self):
+    self.start = 0
+    self.end = 0
+
+  # Make sure there is room for size more bytes after self.end
+  def reserve(self, size):
+    if self.end + size <= len(self.buffer):
+      return
+    pending = self.end - self.start
+    if pending + size > len(self.buffer): # grow, the unread bytes move across with the copy
+      grown = bytearray(max(2*len(self.buffer), pending+size))
+      grown[0:pending] = self.buffer[self.start:self.end]
+      self.buffer = grown
+    else: # compact
+      self.buffer[0:pending] = self.buffer[self.start:self.end]
+    self.start = 0
+    self.end = pending
+
+  # Read straight from a socket into the buffer, returns the number of bytes read (0 on EOF)
+  def fill_from(self, sock, size=BUFSIZE):
+    self.reserve(size)
+    with memoryview(self.buffer) as view:
+      received = sock.recv_into(view[self.end:self.end+size])
+    self.end += received
+    return received
+
+  # Decode every complete frame currently buffered
+  def decode_frames(self):
+    with memoryview(self.buffer) as view:
+      messages, self.start = self.decode_from(view, self.start, self.end)
+    if self.start == self.end: # everything consumed, start writing from the front again for free
+      self.reset()
+    return messages
+
+  # Decode the complete frames in view[start:end], returns them and the offset of the first byte left over
+  def decode_from(self, view, start, end):
+    self.checksum_failed = False
+    messages = []
+    while end - start >= HEADER_SIZE:
+      frame_end = start + HEADER_SIZE + ((view[start+7]&1)<<8) + view[start+8]
+      if frame_end > end: # wait for the rest of the frame
+        break
+      try:
+        messages.append(Message.decode(view[start:frame_end]))
+      except (ChecksumMismatchError, ValueError): # ValueError comes from an invalid type field
+        # framing can't be trusted past a bad frame so drop everything buffered
+        self.checksum_failed = True
+        return messages, end
+      start = frame_end
+    return messages, start
+
+  # Append data received elsewhere (e.g. from an asyncio stream) and decode the complete frames
+  def feed(self, data):
+    if self.start == self.end:
+      # nothing buffered, as with most interactive reads: decode straight from data and only copy an
+      # incomplete frame at its end into the buffer
+      size = len(data)
+      if size >= HEADER_SIZE and size == HEADER_SIZE + ((data[7]&1)<<8) + data[8]: # exactly one frame
+        try:
+          self.checksum_failed = False
+          return [Message.decode(data)]
+        except (ChecksumMismatchError, ValueError):
+          self.checksum_failed = True
+          return []
+      messages, start = self.decode_from(data, 0, size) # slices of bytes decode faster than memoryview slices
+      if start < size:
+        self.reserve(size - start)
+        self.buffer[self.end:self.end+size-start] = data[start:size]
+        self.end += size - start
+      return messages
+    self.reserve(len(data))
+    self.buffer[self.end:self.end+len(data)] = data
+    self.end += len(data)
+    return self.decode_frames()
+#endregion
+
+#region Connect Options
+# A client's CONNECT carries its username, optionally followed by "name=value" options on their own
+# lines, e.g. "alice\nboards=binary". Clients that only send a username get the defaults.
+def encode_connect(username, **options):
+  return "\n".join([username] + [f"{name}={value}" for name, value in options.items()])
+
+def decode_connect(payload):
+  username, *lines = payload.split("\n")
+  options = {}
+  for line in lines:
+    name, sep, value = line.partition("=")
+    if sep:
+      options[name] = value
+  return username, options
+#endregion
+
+#region Board Updates
+# BOARD payloads come in four forms:
+#  - plain board text, rows separated by '|' (the original format)
+#  - a snapshot "=<key> <version>|<board text>", a whole board at a version
+#  - a binary snapshot "#<key> <version> <size>|<packed cells>", the same with 2 bits per cell
+#  - a delta "~<key> <base> <version> B5X C7o ...", the cells that changed between two versions
+# key names the board and the view of it, e.g. "0d" (player 0's board as the opponent sees it)
+# or "1h" (player 1's board with their ships showing). Each cell is its coordinate followed by
+# the one character state it now shows ('.', 'S', 'X' or 'o').
+#
+# Which forms a client gets is its board format, asked for with the "boards" CONNECT option:
+#  - "text" (the default, for clients that don't ask): plain board text every time
+#  - "delta": text snapshots and deltas
+#  - "binary": binary snapshots and deltas
+BOARD_SNAPSHOT = "="
+BOARD_BINARY = "#"
+BOARD_BINARY_BYTE = BOARD_BINARY.encode()
+BOARD_DELTA = "~"
+BOARD_FORMATS = ("text", "delta", "binary")
+
+# Binary cells are packed 4 to a byte in row-major order, cell i in bits 2*(i%4) and up, with
+# unknown/water 0, miss 1, hit 2 and ship 3. A 10x10 board is 25 bytes. Packing turns the cells
+# into base 4 digits and lets int() do the rest; unpacking maps each byte back to its 4 cells.
+CELL_STATES = ".oXS" # cell character of each 2 bit code
+CELL_DIGITS = str.maketrans(CELL_STATES, "0123")
+UNPACKED_CELLS = ["".join(CELL_STATES[(byte >> (2*i)) & 3] for i in range(4)) for byte in range(256)] # byte -> 4 cells
+
+def pack_cells(states):
+  if not states:
+    return b""
+  # the last cell is the most significant digit
+  return int(states.translate(CELL_DIGITS)[::-1], 4).to_bytes((len(states) + 3) // 4, "little")
+
+def unpack_cells(data, count):
+  return "".join([UNPACKED_CELLS[byte] for byte in data])[:count]
+
+def encode_board_snapshot(key, version, text):
+  return f"{BOARD_SNAPSHOT}{key} {version}|{text}"
+
+def encode_board_binary(key, version, size, states):
+  # states is every cell's character, row by row
+  return f"{BOARD_BINARY}{key} {version} {size}|" + pack_cells(states).decode("latin-1")
+
+def encode_board_delta(key, base, version, cells):
+  return " ".join((f"{BOARD_DELTA}{key}", str(base), str(version), *cells))
+
+# Split a BOARD payload into (kind, key, base, version, body). kind is BOARD_SNAPSHOT, BOARD_BINARY,
+# BOARD_DELTA or None for plain board text; body is the board text of a snapshot, (size, packed bytes)
+# of a binary snapshot or the list of changed cells of a delta. Raises ValueError if it is malformed.
+def decode_board_payload(payload):
+  kind = payload[:1]
+  if kind == BOARD_SNAPSHOT:
+    head, _, text = payload.partition("|")
+    key, version = head[1:].split(" ")
+    return kind, key, None, int(version), text
+  if kind == BOARD_BINARY:
+    head, _, data = payload.partition("|")
+    key, version, size = head[1:].split(" ")
+    return kind, key, None, int(version), (int(size), data.encode("latin-1"))
+  if kind == BOARD_DELTA:
+    key, base, version, *cells = payload[1:].split(" ")
+    return kind, key, int(base), int(version), cells
+  return None, None, None, None, payload
+
+class BoardView:
+  # A client's copy of one board: loaded from a snapshot and kept up to date by deltas, so the
+  # whole grid only has to be sent again when the copy falls out of step with the server.
+  def __init__(self):
+    self.version = None # None until the first snapshot
+    self.header = ""
+    self.labels = [] # row labels, padded as the server padded them
+    self.row_of = {} # row label -> row index
+    self.cells = [] # cells[r][c] is the state character shown for that cell
+
+  def load(self, version, text):
+    lines = [line for line in text.split("|") if line]
+    self.header = lines[0] if lines else ""
+    self.labels = []
+    self.cells = []
+    for line in lines[1:]:
+      label, _, row = line.partition(" ")
+      self.labels.append(line[:len(line) - len(row.lstrip()) - 1])
+      self.cells.append(row.split())
+    self.row_of = {label.strip(): r for r, label in enumerate(self.labels)}
+    self.version = version
+
+  # Load a binary snapshot, labelled and spaced as the server would have sent it as text
+  def load_binary(self, version, size, data):
+    if len(data) * 4 < size * size:
+      raise ValueError("binary board is too short")
+    codec = CoordinateCodec.for_size(size)
+    states = unpack_cells(data, size * size)
+    self.header = " " * codec.label_width + codec.column_header
+    self.labels = list(codec.padded_labels)
+    self.cells = [list(states[r*size:(r+1)*size]) for r in range(size)]
+    self.row_of = {label: r for r, label in enumerate(codec.row_labels)}
+    self.version = version
+
+  # Apply a delta, returns False (leaving the copy as it was) if it doesn't start from this copy's version
+  # or names a cell the copy doesn't have; the client should then ask for a snapshot.
+  def apply(self, base, version, cells):
+    if self.version is None or base != self.version:
+      return False
+    updates = []
+    for cell in cells:
+      coord, state = cell[:-1], cell[-1:]
+      split = len(coord.rstrip("0123456789"))
+      r = self.row_of.get(coord[:split])
+      if r is None or not coord[split:].isdigit():
+        return False
+      c = int(coord[split:]) - 1
+      if not 0 <= c < len(self.cells[r]):
+        return False
+      updates.append((r, c, state))
+    for r, c, state in updates:
+      self.cells[r][c] = state
+    self.version = version
+    return True
+
+  # The board as the lines of text the server would have sent
+  def lines(self):
+    return [self.header] + [f"{label} {' '.join(row)}" for label, row in zip(self.labels, self.cells)]
+#endregion
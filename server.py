@@ -10,8 +10,18 @@ The core issue is in how the client handles incoming messages.
 However, if you want to support multiple clients (i.e. progress through further Tiers), you'll need concurrency here too.
 """
 
+import os
 import time
+import contextlib
+import itertools
+import math
+import json
 import socket
+import select
+import selectors
+import multiprocessing
+import asyncio
+import argparse
 import threading
 import heapq
 from enum import Enum
@@ -24,12 +34,11 @@ HOST = '127.0.0.1'
 PORT = 5000
 
 SERVER_ID = 0
+DEBUG = False # print every message sent
 
 #region Clients
-MAX_CLIENTS = 127
-clients = []
-num_clients = 0
-free_ids = list(range(0,127))
+MAX_CLIENTS = 127 # clients in one room, ids are 7 bits on the wire
+MAX_CONNECTIONS = 1024 # clients across every room
 
 class ClientType(Enum):
     SPECTATOR = 0
@@ -39,101 +48,695 @@ class Client:
     def __init__(self, conn, addr):
         self.conn = conn
         self.addr = addr
+        self.outbox = Outbox(conn)
         self.thread = None
+        self.game = None # the room this client is in
         self.id = None
         self.type = ClientType.SPECTATOR
         self.timeout = None
         self.username = ""
+        self.board_format = "text" # how BOARDs are sent, one of BOARD_FORMATS (asked for in CONNECT)
+        self.boards = {} # board key -> (Board, version) this client last received, for sending deltas
         # used for protocol
-        self.incoming = bytearray()
+        self.decoder = FrameDecoder()
+        self.reassembler = Reassembler() # joins fragments of long messages from this client
+        self.send_lock = threading.RLock() # keeps the frames of one message on consecutive seqs
         self.seq_s = 0
-        self.send_window = []
+        self.send_window = SendWindow() # frames waiting for an ACK, with the round trip estimate
+        self.retransmit_timer = None # runs while send_window isn't empty
         self.seq_r = 0
-        self.recv_window = []
+        self.recv_window = ReceiveWindow() # frames received ahead of seq_r
+        # flow control, see check_backlog()
+        self.congested = False # more than HIGH_WATER bytes queued, not yet back down to LOW_WATER
+        self.drain_timer = None # checks whether a congested client has caught up
+        self.missed_boards = {} # board key -> (Board, show_hidden, expected) held back from a congested spectator
+        self.dropped_boards = 0 # BOARD messages held back, only the latest of each board is sent later
+    def link_stats(self):
+        # round trip, retransmission, queue and receive window figures for this connection
+        window = self.send_window
+        return {"id": self.id, "username": self.username, "rtt": window.srtt, "rto": window.rto,
+                "retransmits": window.retransmits, "timeouts": window.timeouts, "unacked": len(window),
+                "queued": self.outbox.depth(), "queued_peak": self.outbox.peak, "dropped_boards": self.dropped_boards,
+                "dropped_frames": self.recv_window.dropped}
+    def hold_back_board(self, key, board, show_hidden, expected):
+        # A congested spectator skips boards until it has caught up, then gets the latest version of each.
+        # Returns True if the board was held back.
+        if not self.congested or self.type != ClientType.SPECTATOR:
+            return False
+        with self.send_lock:
+            if not self.congested:
+                return False
+            self.missed_boards[key] = (board, show_hidden, expected)
+            self.dropped_boards += 1
+            return True
     def set_spectator(self):
         self.type = ClientType.SPECTATOR
+        self.outbox.priority = False
     def set_player(self):
         self.type = ClientType.PLAYER
+        self.outbox.priority = True
+
+class ClientRegistry:
+    """
+    The clients of one room, indexed by id, username and role so lookups don't scan lists.
+    Clients join and leave from their own threads (or the event loop) while the game thread and timers
+    send to them, so every change happens under the lock. The clients and spectators are kept as tuples
+    that are rebuilt on change, senders iterate over them without taking the lock.
+    """
+    def __init__(self, capacity=MAX_CLIENTS):
+        self.lock = threading.RLock()
+        self.free_ids = list(range(0, capacity)) # heap, lowest id is handed out first
+        self.reserved = 0 # ids handed out, including clients that are still being greeted
+        self.by_id = {} # client id -> Client, in the order they joined
+        self.by_username = {} # username -> Client
+        self.players = {} # client id -> Player, for the clients playing the current game
+        self.waiting = {} # username -> Player whose client disconnected during the game
+        self.clients = () # every client in the room
+        self.spectators = () # every client in the room that isn't playing
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, client):
+        return self.by_id.get(client.id) is client
+
+    def rebuild(self):
+        self.clients = tuple(self.by_id.values())
+        self.spectators = tuple(client for client in self.clients if client.id not in self.players)
+
+    def reserve_id(self):
+        with self.lock:
+            client_id = heapq.heappop(self.free_ids)
+            self.reserved += 1
+            return client_id
+
+    def release_id(self, client_id):
+        with self.lock:
+            heapq.heappush(self.free_ids, client_id)
+            self.reserved -= 1
+
+    def has_free_id(self):
+        return len(self.free_ids) > 0
+
+    """
+    Make a client (which already has an id) visible to the game.
+    """
+    def add(self, client):
+        with self.lock:
+            self.by_id[client.id] = client
+            if client.username:
+                self.by_username[client.username] = client
+            self.rebuild()
+
+    """
+    Remove a client from the room. Returns False if it wasn't in it.
+    """
+    def remove(self, client):
+        with self.lock:
+            if client not in self:
+                return False
+            del self.by_id[client.id]
+            if self.by_username.get(client.username) is client:
+                del self.by_username[client.username]
+            player = self.players.pop(client.id, None)
+            if player is not None and player.client is client:
+                player.client = None
+            self.rebuild()
+            return True
+
+    def set_username(self, client, username):
+        with self.lock:
+            if self.by_username.get(client.username) is client:
+                del self.by_username[client.username]
+            client.username = username
+            if client in self:
+                self.by_username[username] = client
+
+    def get(self, client_id):
+        return self.by_id.get(client_id)
+
+    def get_username(self, username):
+        return self.by_username.get(username)
+
+    def player_of(self, client_id):
+        return self.players.get(client_id)
+
+    """
+    Give a player a (new) client, None takes the client away and makes it a spectator again.
+    """
+    def assign(self, player, client):
+        with self.lock:
+            if player.client is not None and self.players.get(player.client.id) is player:
+                del self.players[player.client.id]
+            player.client = client
+            if client is not None:
+                self.players[client.id] = player
+            self.rebuild()
+
+    """
+    Take a disconnected client away from its player and remember the player until they come back.
+    Returns the player, or None if the client wasn't playing.
+    """
+    def player_left(self, client):
+        with self.lock:
+            player = self.players.get(client.id)
+            if player is None:
+                return None
+            self.assign(player, None)
+            self.waiting[client.username] = player
+            return player
+
+    """
+    Give a reconnecting client back the player it left, returns the player or None.
+    """
+    def reclaim(self, client):
+        with self.lock:
+            player = self.waiting.pop(client.username, None) if client.username else None
+            if player is not None:
+                self.assign(player, client)
+            return player
+
+    """
+    Forget the previous game's players, everyone is a spectator until the next players are picked.
+    """
+    def reset_players(self):
+        with self.lock:
+            self.players = {}
+            self.waiting = {}
+            self.rebuild()
+#endregion
+
+#region Outbox
+MAX_SEGMENTS = 1024 # most buffers a single sendmsg() call accepts (IOV_MAX on Linux)
+STREAM_BYTES = 1<<16 # an outbox holding this much is written straight away, even inside a SendBatch
+HIGH_WATER = 1<<18 # bytes queued for a client that make it congested, see check_backlog()
+LOW_WATER = 1<<16 # a congested client has caught up once it is back down to this many bytes
+MAX_QUEUE = 1<<22 # bytes queued for a spectator before it is disconnected
+PLAYER_QUEUE_FACTOR = 4 # players may queue this many times MAX_QUEUE
+MAX_UNACKED = 8192 # frames a client may leave unacknowledged before it is disconnected
+DRAIN_CHECK = 0.1 # seconds between checks whether a congested client has caught up
+SLOW_SPECTATORS = "drop" # what a congested spectator gets: "drop" (skip boards, send the latest later) or "disconnect"
+CLOSE_LINGER = 5.0 # seconds a connection being closed gets to take what is still queued for it
+
+class Outbox:
+    """
+    Frames waiting to be written to one client.
+    Frames queued inside a SendBatch are held until the batch ends and then written with one sendmsg(),
+    unless they add up to STREAM_BYTES first (a long message being fragmented), then they go out as they come.
+    Writing never blocks the sending thread: what the socket doesn't take stays queued and the
+    OutboxWriter thread writes it once the socket has room.
+    A connection that is done with is closed with close_when_written(), so the last frames queued for
+    it (a DISCONNECT, the end of the game) still go out.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.segments = []
+        self.size = 0 # bytes in self.segments
+        self.peak = 0 # most bytes ever queued, see depth()
+        self.priority = False # a player's outbox, written before spectators'
+        self.watched = False # the OutboxWriter is waiting to write what is left
+        self.closed = False # the client is being disconnected, nothing more is written
+        self.closing_at = None # deadline for writing what is queued before the connection is closed
+        self.lock = threading.Lock()
+
+    def put(self, segments):
+        with self.lock:
+            if self.closed or self.closing_at is not None:
+                return 0
+            self.segments.extend(segments)
+            self.size += sum(len(segment) for segment in segments)
+            return self.size
+
+    def depth(self):
+        # bytes written for the client that haven't reached the kernel, a StreamConn's transport holds its own
+        if isinstance(self.conn, StreamConn):
+            return self.size + self.conn.buffered()
+        return self.size
+
+    def flush(self, wait=False):
+        # Writes as much as the socket takes without blocking and leaves the rest to the OutboxWriter.
+        # wait=True blocks until everything is written, for a socket that is about to be handed over.
+        with self.lock:
+            if self.closed:
+                return
+            pending = [memoryview(segment) for segment in self.segments]
+            self.segments = []
+            self.size = 0
+            while pending:
+                try:
+                    sent = self.send(pending[:MAX_SEGMENTS], wait)
+                except BlockingIOError:
+                    break
+                # drop the buffers that went out completely and trim a partially sent one
+                done = 0
+                while done < len(pending) and sent >= len(pending[done]):
+                    sent -= len(pending[done])
+                    done += 1
+                del pending[:done]
+                if pending and sent:
+                    pending[0] = pending[0][sent:]
+            self.segments = pending
+            self.size = sum(len(segment) for segment in pending)
+            if self.closing_at is not None and (not pending or time.monotonic() >= self.closing_at):
+                self.close_connection()
+            elif pending and not self.watched:
+                self.watched = True
+                writer.watch(self)
+            elif not pending and self.watched:
+                self.watched = False
+                writer.forget(self)
+
+    def send(self, buffers, wait):
+        if wait or not isinstance(self.conn, socket.socket): # stand-ins and StreamConn never block
+            return self.conn.sendmsg(buffers)
+        return self.conn.sendmsg(buffers, (), socket.MSG_DONTWAIT)
+
+    def close(self):
+        # throw away what is queued, the connection is going away
+        with self.lock:
+            self.closed = True
+            self.segments = []
+            self.size = 0
+            if self.watched:
+                self.watched = False
+                writer.forget(self)
+            if self.closing_at is not None: # nobody else is going to close it
+                self.conn.close()
+
+    def close_when_written(self, timeout=CLOSE_LINGER):
+        # Close the connection once everything queued has been written, or after timeout seconds if the
+        # client doesn't take it, without waiting for either: the OutboxWriter finishes the writing.
+        # Nothing more can be queued. Safe to call again, or after close().
+        with self.lock:
+            if self.closed:
+                self.conn.close()
+                return
+            if self.closing_at is None:
+                self.closing_at = time.monotonic() + timeout
+        try:
+            self.flush()
+        except OSError:
+            self.close() # the connection is gone
+            return
+        if not self.closed:
+            writer.wake() # so it knows the deadline
+
+    def close_connection(self):
+        # with self.lock held
+        self.closed = True
+        self.segments = []
+        self.size = 0
+        if self.watched:
+            self.watched = False
+            writer.forget(self)
+        self.conn.close()
+
+class OutboxWriter:
+    """
+    Thread that finishes the writes flushes left behind because a socket buffer was full.
+    It polls the sockets of those outboxes for room and writes players' outboxes before spectators'.
+    A StreamConn takes everything it is given, its event loop does this job for the asyncio server.
+    """
+    def __init__(self):
+        self.outboxes = {} # outbox -> None, used as an ordered set of outboxes with bytes left
+        self.lock = threading.Lock()
+        self.wake_r, self.wake_w = socket.socketpair() # wakes the thread up when an outbox is added
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.thread = None
+
+    def watch(self, outbox):
+        with self.lock:
+            self.outboxes[outbox] = None
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.wake()
+
+    def wake(self):
+        # have the thread look at its outboxes again
+        try:
+            self.wake_w.send(b"\0")
+        except BlockingIOError:
+            pass # a wake-up is already pending
+
+    def forget(self, outbox):
+        with self.lock:
+            self.outboxes.pop(outbox, None)
+
+    def run(self):
+        while True:
+            with self.lock:
+                outboxes = list(self.outboxes)
+            # outboxes being closed are flushed once more at their deadline, which closes them
+            deadlines = [outbox.closing_at for outbox in outboxes if outbox.closing_at is not None]
+            timeout = max(0, (min(deadlines) - time.monotonic()) * 1000) if deadlines else None
+            poller = select.poll()
+            poller.register(self.wake_r, select.POLLIN)
+            by_fd = {}
+            for outbox in outboxes:
+                fd = outbox.conn.fileno()
+                if fd < 0: # closed without closing the outbox
+                    outbox.close()
+                    continue
+                by_fd[fd] = outbox
+                poller.register(fd, select.POLLOUT)
+
+            ready = [by_fd[fd] for fd, _ in poller.poll(timeout) if fd in by_fd]
+            now = time.monotonic()
+            ready += [outbox for outbox in by_fd.values() if outbox.closing_at is not None and outbox.closing_at <= now
+                      and outbox not in ready]
+            try:
+                self.wake_r.recv(4096)
+            except BlockingIOError:
+                pass
+            for outbox in sorted(ready, key=lambda outbox: not outbox.priority):
+                try:
+                    outbox.flush() # forgets the outbox once it is empty
+                except OSError:
+                    outbox.close() # the connection is gone, its receive loop handles the disconnect
+
+writer = OutboxWriter()
+
+# clients with frames held in their outbox by the SendBatch running on this thread
+_batch = threading.local()
+
+class SendBatch:
+    """
+    While a SendBatch is open on a thread, frames sent from that thread are collected in each client's
+    outbox and written together when the outermost batch closes, players' first.
+    """
+    def __enter__(self):
+        self.outermost = getattr(_batch, "clients", None) is None
+        if self.outermost:
+            _batch.clients = {} # dict keeps the order clients were first written to
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.outermost:
+            return False
+        clients = _batch.clients
+        _batch.clients = None
+        for client in sorted(clients, key=lambda client: client.type != ClientType.PLAYER):
+            try:
+                client.outbox.flush()
+            except OSError:
+                pass # the connection is gone, its receive loop handles the disconnect
+        return False
+
+def write_to(client, segments):
+    size = client.outbox.put(segments)
+    batch = getattr(_batch, "clients", None)
+    if batch is None or size >= STREAM_BYTES:
+        try:
+            client.outbox.flush()
+        except OSError:
+            pass # the connection is gone, its receive loop handles the disconnect
+    if batch is not None:
+        batch[client] = True
+    check_backlog(client)
+
+# Keeps what is queued for a client bounded. A client more than HIGH_WATER bytes behind is congested until it
+# is back down to LOW_WATER: a congested spectator is disconnected or, with SLOW_SPECTATORS = "drop", skips
+# boards (see Client.hold_back_board()). Players are never skipped. Any client past MAX_QUEUE (players get
+# PLAYER_QUEUE_FACTOR times as much) or leaving MAX_UNACKED frames unacknowledged is disconnected.
+def check_backlog(client):
+    outbox = client.outbox
+    if outbox.closed:
+        return
+    depth = outbox.depth()
+    outbox.peak = max(outbox.peak, depth)
+    limit = MAX_QUEUE * (PLAYER_QUEUE_FACTOR if client.type == ClientType.PLAYER else 1)
+    if depth > limit or len(client.send_window) > MAX_UNACKED:
+        drop_connection(client, f"{depth} bytes queued and {len(client.send_window)} frames unacknowledged")
+    elif depth > HIGH_WATER and not client.congested:
+        if client.type == ClientType.SPECTATOR and SLOW_SPECTATORS == "disconnect":
+            drop_connection(client, f"spectator is {depth} bytes behind")
+            return
+        with client.send_lock:
+            if client.congested:
+                return
+            client.congested = True
+        if client.drain_timer is None:
+            client.drain_timer = timers.arm(DRAIN_CHECK, check_drained, client)
+        else:
+            client.drain_timer.rearm(DRAIN_CHECK)
+
+# Runs on the timer thread until a congested client is back down to LOW_WATER, then sends it the latest
+# version of every board it skipped that is still in play.
+def check_drained(client):
+    if client.outbox.closed:
+        return
+    if client.outbox.depth() > LOW_WATER:
+        client.drain_timer.rearm(DRAIN_CHECK)
+        return
+    with client.send_lock:
+        client.congested = False
+        missed = client.missed_boards
+        client.missed_boards = {}
+    game = client.game
+    with SendBatch():
+        for board, show_hidden, expected in missed.values():
+            if any(player.board is board for player in game.players): # not a board of a finished game
+                game.send_board_to([client], board, show_hidden, expected)
+
+# Stop writing to a client that can't keep up. Its receive loop sees the connection close and handles the disconnect.
+def drop_connection(client, reason):
+    print(f"[INFO] Disconnecting client [{client.id}], {reason}")
+    rooms.slow_disconnect()
+    client.outbox.close()
+    try:
+        client.conn.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
 #endregion
 
 #region Send Messages
 def send_message_to(client, send_msg, new=True):
+    if new and send_msg.msg_len > MAX_PAYLOAD:
+        # too long for one frame, each fragment is written as soon as it is cut
+        with client.send_lock:
+            for fragment in send_msg.fragments():
+                send_message_to(client, fragment)
+        return
     msg = send_msg.copy() # used so that multiple users can send the same message with different seq
     if new:
-        msg.seq = client.seq_s
-        heapq.heappush(client.send_window, (msg.seq, msg))
+        with client.send_lock:
+            msg.seq = client.seq_s
+            client.send_window.add(msg)
+            client.seq_s = (client.seq_s+1)&((1<<16)-1)
+            if len(client.send_window) == 1:
+                start_retransmit_timer(client)
+    if DEBUG:
+        print(f"DEBUG SENDING: seq: {msg.seq}, pck_t: {msg.packet_type}, type: {msg.type}, expected: {msg.expected}, id: {msg.id}, msg_len: {msg.msg_len}, msg: {msg.msg}\n\n\n")
+    write_to(client, (msg.encode(),))
+
+def send_encoded_to(client, encoded):
+    # same as send_message_to() for a message that has already been encoded, only the seq changes
+    with client.send_lock:
+        seq = client.seq_s
+        client.send_window.add(encoded.with_seq(seq))
         client.seq_s = (client.seq_s+1)&((1<<16)-1)
-    print(f"DEBUG SENDING: seq: {msg.seq}, pck_t: {msg.packet_type}, type: {msg.type}, expected: {msg.expected}, id: {msg.id}, msg_len: {msg.msg_len}, msg: {msg.msg}\n\n\n")
-    client.conn.send(msg.encode()) 
+        if len(client.send_window) == 1:
+            start_retransmit_timer(client)
+    write_to(client, encoded.segments(seq))
 
 def send_message_to_all(clients, msg):
+    # encode once and only patch the seq for each client
+    if DEBUG:
+        print(f"DEBUG BROADCAST to {len(clients)} clients: pck_t: {msg.packet_type}, type: {msg.type}, expected: {msg.expected}, id: {msg.id}, msg_len: {msg.msg_len}, msg: {msg.msg}\n\n\n")
+    if msg.msg_len > MAX_PAYLOAD:
+        send_frames_to_all(clients, msg.fragments())
+        return
+    encoded = EncodedMessage(msg)
     for client in clients:
-        send_message_to(client, msg)
+        send_encoded_to(client, encoded)
+
+# Send the frames of one message (see fragment_message()) to every client. Each frame is encoded once and
+# written to everyone before the next one is produced, so a long message is never held whole. Every
+# client's send lock is held for the whole run, taken in a fixed order, so its frames get consecutive seqs.
+def send_frames_to_all(clients, frames):
+    with contextlib.ExitStack() as locks:
+        for client in sorted(clients, key=id):
+            locks.enter_context(client.send_lock)
+        for frame in frames:
+            encoded = EncodedMessage(frame)
+            for client in clients:
+                send_encoded_to(client, encoded)
 
 def send_ack(client, seq):
     ack = Message(id=client.id, type=MessageType.TEXT, expected=MessageType.TEXT, msg="",\
                            seq=seq, packet_type=PacketType.ACK)
     send_message_to(client, ack, False)
 
-def send_nack(client):
-    nack = Message(id=client.id, type=MessageType.TEXT, expected=MessageType.TEXT, msg="",\
-                           seq=0, packet_type=PacketType.NACK)
+def send_nack(client, first, count=1):
+    nack = Message(id=client.id, type=MessageType.TEXT, expected=MessageType.TEXT, msg=count,\
+                           seq=first, packet_type=PacketType.NACK)
     send_message_to(client, nack, False)
 
 def handle_chat(client, text):
+    game = client.game
     expected = MessageType.PLACE if game.state == GameState.PLACE else MessageType.FIRE
     msg = Message(SERVER_ID, MessageType.CHAT, expected, "[" + client.username + "]: " + text)
     ## send message to all except person sending
-    send_message_to_all([x for x in clients if x!= client], msg)
+    send_message_to_all([x for x in game.clients if x!= client], msg)
     pass
 #endregion
 
 #region Timeout
 
-## runs timers on a thread, def more elegant way to do it but odds are this wont break everything
-class Timer:
-    def __init__(self, client, duration):
+PLAYER_TIMEOUT = 30 # seconds a player can go without sending anything
+RECONNECT_TIMEOUT = 30 # seconds a disconnected player has to reconnect before the game ends
+
+class TimerHandle:
+    __slots__ = ("wheel", "callback", "args", "expires", "slot")
+    def __init__(self, wheel, callback, args):
+        self.wheel = wheel
+        self.callback = callback
+        self.args = args
+        self.expires = 0 # tick the timer fires on
+        self.slot = None # slot it is stored in, None once fired or cancelled
+
+    def rearm(self, duration):
+        self.wheel.rearm(self, duration)
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+class TimerWheel:
+    """
+    Hashed timer wheel run by a single thread.
+    A timer is stored in the slot for the tick it expires on (modulo the number of slots), so arming,
+    re-arming and cancelling are a dict insert/delete and the number of threads doesn't depend on
+    how many timers are running. Each tick the thread fires the due timers in one slot.
+    """
+    def __init__(self, tick=0.1, num_slots=512):
+        self.tick = tick
+        self.slots = [{} for _ in range(num_slots)] # handle -> None, used as an ordered set
+        self.start_time = time.monotonic()
+        self.current = 0 # last tick that has been processed
+        self.lock = threading.Lock()
         self.thread = None
-        self.client = client
-        self.active = True
 
-        self.start_timer_thread(duration, client)
-    
-    def timeout(self, duration, client):
-        print(f"[INFO] Starting timeout timer for Client [{client.id}]")
-        time.sleep(duration)
-        if self.active:
-            print(f"[INFO] Client [{self.client.id}] has timed out")
-            handle_disconnect(client)
-    
-    def start_timer_thread(self, duration, client):
-        thread = threading.Thread(target=self.timeout, args=(duration, client,))
-        thread.start()
-        self.thread = thread
-        return thread
+    def arm(self, duration, callback, *args):
+        handle = TimerHandle(self, callback, args)
+        self.rearm(handle, duration)
+        return handle
+
+    def rearm(self, handle, duration):
+        with self.lock:
+            if handle.slot is not None:
+                del self.slots[handle.slot][handle]
+            # round up so a timer never fires early, and never into a tick that's already been processed
+            handle.expires = max(self.current + 1, math.ceil((time.monotonic() - self.start_time + duration) / self.tick))
+            handle.slot = handle.expires % len(self.slots)
+            self.slots[handle.slot][handle] = None
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def cancel(self, handle):
+        with self.lock:
+            if handle.slot is not None:
+                del self.slots[handle.slot][handle]
+                handle.slot = None
+
+    def pop_expired(self, now_tick):
+        expired = []
+        with self.lock:
+            while self.current < now_tick:
+                self.current += 1
+                slot = self.slots[self.current % len(self.slots)]
+                # a slot also holds timers for later laps of the wheel
+                due = [handle for handle in slot if handle.expires <= self.current]
+                for handle in due:
+                    del slot[handle]
+                    handle.slot = None
+                expired.extend(due)
+        return expired
+
+    def run(self):
+        while True:
+            next_tick = self.start_time + (self.current + 1) * self.tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            now_tick = int((time.monotonic() - self.start_time) / self.tick)
+            for handle in self.pop_expired(now_tick):
+                try:
+                    handle.callback(*handle.args)
+                except Exception as e:
+                    print(f"[ERROR] timer callback {handle.callback.__name__} failed: {e}")
+
+timers = TimerWheel()
+
+# The retransmission timer of a client runs whenever it has unacknowledged frames and restarts on every
+# ACK that acknowledges something new. If it runs out the oldest frame is sent again, which recovers
+# frames that were lost rather than corrupted (nothing arrives to reveal the gap) and lost NACKs.
+def start_retransmit_timer(client):
+    if client.retransmit_timer is None:
+        client.retransmit_timer = timers.arm(client.send_window.rto, retransmit_timed_out, client)
+    else:
+        client.retransmit_timer.rearm(client.send_window.rto)
+
+# This runs on the timer thread every client shares, so it never waits for a connection: if another thread
+# is sending to the client it tries again later, and the frame is written as far as the socket takes it
+# without blocking (the OutboxWriter writes the rest). While frames are still queued the resend would only
+# go out behind them, so it waits for another rto instead, and only a frame actually resent counts as a
+# timeout and backs the rto off.
+def retransmit_timed_out(client):
+    if not client.send_lock.acquire(blocking=False):
+        start_retransmit_timer(client)
+        return
+    try:
+        window = client.send_window
+        if not len(window):
+            return
+        if client.outbox.size:
+            window.restart_timer()
+            try:
+                client.outbox.flush()
+            except OSError:
+                return # the connection is gone, its receive loop handles the disconnect
+        else:
+            write_to(client, (window.timed_out().encode(),)) # timed_out() also backs the rto off
+            if client.outbox.closed:
+                return # dropped by check_backlog(), or the connection is gone
+        start_retransmit_timer(client)
+    finally:
+        client.send_lock.release()
+
+def client_timed_out(client):
+    print(f"[INFO] Client [{client.id}] has timed out")
+    handle_disconnect(client)
 
 def end_game(game):
     print("ending game")
     game.state = GameState.END
+    game.notify_changed()
 
 #endregion
 
 #region Process Msg
 def process_client_messages(client):
+    game = client.game
+    start = client.seq_r
     while True:
-        try:
-            msg = heapq.heappop(client.recv_window)[1]
-        except IndexError: # all messages sent
+        msg = client.recv_window.pop(client.seq_r)
+        if msg is None: # everything in order has been processed, later frames wait for the missing ones
+            if client.seq_r != start:
+                send_ack(client, client.seq_r) # one cumulative ACK for everything processed
+                for first, count in client.recv_window.reopened(start, client.seq_r):
+                    send_nack(client, first, count)
             return
-        
-        if msg.seq < client.seq_r: # skip duplicates
-            continue
 
-        if msg.seq > client.seq_r: # end if message is a future packet
-            heapq.heappush(client.recv_window, (msg.seq, msg))
-            send_ack(client, client.seq_r)
-            return 
-        
+        # join the fragments of a long message, only the whole message is processed
+        if msg.packet_type == PacketType.FRAGMENT or client.reassembler.pending():
+            msg = client.reassembler.add(msg)
+            if msg is None:
+                client.seq_r = (client.seq_r+1)&((1<<16)-1) # loop around
+                continue
+
         # process the message
         try:
             ## Handles inputs out side of game world
@@ -144,20 +747,27 @@ def process_client_messages(client):
             
             ## should be the first message the server recieves from the client
             elif msg.type == MessageType.CONNECT:
-                client.username = msg.msg
+                username, options = decode_connect(msg.msg)
+                if options.get("boards") in BOARD_FORMATS:
+                    client.board_format = options["boards"]
+                client.game.registry.set_username(client, username)
                 client.seq_r = (client.seq_r+1)&((1<<16)-1) # loop around
 
-                if game.disconnected_player:
-                    if client.username == game.disconnected_player.username:
-                        print(f"reconnecting client {client.username}")
-                        game.players[game.disconnected_player_id].client = client
-                        handle_reconnect(client)
+                if not identify_client(client):
+                    return # the connection now belongs to another worker process
+                game = client.game
                 continue
 
             elif msg.type == MessageType.DISCONNECT:
                 handle_disconnect(client)
                 client.seq_r = (client.seq_r+1)&((1<<16)-1) # loop around
                 continue
+
+            ## the client's copy of a board fell out of step with a delta, send it the whole board
+            elif msg.type == MessageType.BOARD:
+                game.resend_board(client, msg.msg)
+                client.seq_r = (client.seq_r+1)&((1<<16)-1) # loop around
+                continue
             
             if client.type == ClientType.SPECTATOR:
                 client.seq_r = (client.seq_r+1)&((1<<16)-1) # loop around
@@ -165,7 +775,7 @@ def process_client_messages(client):
                 send_message_to(client, res)
                 continue
 
-            player = game.get_player(msg.id)
+            player = game.get_player(client.id)
             if player == None:
                 raise ValueError # a different type of error is probably better here
             
@@ -204,14 +814,31 @@ def process_client_messages(client):
         client.seq_r = (client.seq_r+1)&((1<<16)-1) # loop around
 #endregion
 
+# Send a client that has just given its username to the game waiting for it (if there is one).
+# Returns False if the connection was handed over to the worker process that owns that game.
+def identify_client(client, hand_off=True):
+    # a player coming back may have landed in a different room, move them to their game
+    if rooms.rejoin(client):
+        id_msg = Message(id=SERVER_ID, type=MessageType.CONNECT, expected=MessageType.CHAT, msg=client.id)
+        send_message_to(client, id_msg)
+    elif hand_off and shard and shard.hand_off(client): # or in a room on another worker process
+        return False
+
+    game = client.game
+    if game.registry.reclaim(client):
+        print(f"reconnecting client {client.username}")
+        handle_reconnect(client)
+    return True
+
 def handle_reconnect(client):
+    game = client.game
     if game.state == GameState.PAUSE:
         game.state = game.previous_state
         print(f"[INFO] player has reconnected and game is resuming to state [{game.state}]")
         rec_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"Welcome back {client.username}, the game will now resume")
         send_message_to(client, rec_msg)
         res_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"Player has reconnected, resuming game")
-        send_message_to_all(clients, res_msg)
+        send_message_to_all(game.clients, res_msg)
         if game.state == GameState.BATTLE:
             for player in game.players:
                 game.send_fire_prompt(player)
@@ -221,25 +848,26 @@ def handle_reconnect(client):
         
         game.disconnected_players -= 1
         
-        game.end_thread.cancel()
-        game.end_thread = None
+        game.end_timer.cancel()
+        game.end_timer = None
 
 #region Handle Client
-def handle_client(client):
-    socket = client.conn
-    with socket:
+# Send a new connection its id and tell it what is happening. Shared by the threaded and asyncio servers.
+def greet_client(client):
+    game = client.game
+    with SendBatch(): # hello frames go out together
         # send client their client ID
         id_msg = Message(id=SERVER_ID, type=MessageType.CONNECT, expected=MessageType.CHAT, msg=client.id)
         send_message_to(client, id_msg)
+        # only visible to the game once it has been given its id, so the id is always its first message
+        game.registry.add(client)
 
         # check if clients username matchs disconnection
         reconnecting_player = False
 
-        if game.disconnected_player:
-            if client.username == game.disconnected_player.username:
-                print(f"reconnecting client {client.username}")
-                game.players[game.disconnected_player_id].client = client
-                reconnecting_player = True
+        if game.registry.reclaim(client):
+            print(f"reconnecting client {client.username}")
+            reconnecting_player = True
 
         # send client a message indicating their status
         if game.state == GameState.WAIT:
@@ -254,95 +882,103 @@ def handle_client(client):
                 rec_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"Welcome back {client.username}, the game will now resume")
                 send_message_to(client, rec_msg)
                 res_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"Player has reconnected, resuming game")
-                send_message_to_all(clients, res_msg)
+                send_message_to_all(game.clients, res_msg)
                 if game.state == GameState.BATTLE:
                     for player in game.players:
                         game.send_fire_prompt(player)
                 if game.state == GameState.PLACE:
                     for player in game.players:
                         game.send_place_prompt(player)
-                
+
                 game.disconnected_players -= 1
-                
-                game.end_thread.cancel()
-                game.end_thread = None
-                
+
+                game.end_timer.cancel()
+                game.end_timer = None
+
             pass
         elif game.state == GameState.END:
             spec_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, "WAITING FOR NEW GAME TO START")
             send_message_to(client, spec_msg)
-#endregion
 
-#region Receive Msg
+    game.notify_changed() # a new client may be enough to start a game
+
+# Sort the frames decoded from one read: handle ACK/NACKs and queue data for process_client_messages().
+# Shared by the threaded and asyncio servers.
+def receive_frames(client, messages):
+    ## restart the timeout timer for players
+    if client.type == ClientType.PLAYER:
+        if client.timeout:
+            client.timeout.rearm(PLAYER_TIMEOUT)
+        else:
+            client.timeout = timers.arm(PLAYER_TIMEOUT, client_timed_out, client)
+
+    stale = False # frames that were already processed arrived
+    for msg in messages:
+        if msg.packet_type == PacketType.ACK: # everything before msg.seq has arrived
+            with client.send_lock:
+                if client.send_window.ack(msg.seq): # something new, the timer restarts for what is left
+                    if len(client.send_window):
+                        start_retransmit_timer(client)
+                    else:
+                        client.retransmit_timer.cancel()
+            continue
+
+        if msg.packet_type == PacketType.NACK: # resend only the frames asked for
+            with client.send_lock:
+                for sent in client.send_window.resend(*nack_range(msg)):
+                    send_message_to(client, sent, False)
+            continue
+
+        # a resend of a frame already processed means our ACK was lost
+        if seq_diff(msg.seq, client.seq_r) < 0:
+            stale = True
+            continue
+
+        # queue data for processing, gaps it reveals are NACKed, frames too far ahead are dropped
+        for first, count in client.recv_window.add(msg, client.seq_r):
+            send_nack(client, first, count)
+
+    if stale: # acknowledge again, once however many there were
+        send_ack(client, client.seq_r)
+    if client.decoder.checksum_failed:
+        for first, count in client.recv_window.corrupted(client.seq_r):
+            send_nack(client, first, count)
+
+def handle_client(client, greet=True):
+    try:
+        if greet:
+            greet_client(client)
+
         # recieve messages from client
         while True:
             try:
-                raw = client.conn.recv(BUFSIZE)
+                received = client.decoder.fill_from(client.conn)
             except:
                 # player disconnected
                 break
 
             ## not sure if this is needed anymore
-            if not raw:
+            if not received:
                 break
 
-            ## start timeout timer for players
-            if client.type == ClientType.PLAYER:
-                if client.timeout:
-                    client.timeout.active = False
-                client.timeout = Timer(client, 30)
-            
-            client.incoming += bytearray(raw)
-
-            while len(client.incoming) >= 9:
-                try:
-                    msg = Message.decode(client.incoming)
-                    client.incoming = client.incoming[9+msg.msg_len:]
-
-                    if msg.packet_type == PacketType.ACK:
-                        sent = heapq.heappop(client.send_window)
-                        while (sent[0] < msg.seq):
-                            sent = heapq.heapop(client.send_window)
-                        heapq.heappush(client.send_window, sent) # push the last element popped back on
-                        continue
-            
-                    if msg.packet_type == PacketType.NACK: # resend all messages
-                        messages = client.send_window.copy()
-                        while True:
-                            try:
-                                send_message_to(client, heapq.heappop(messages)[1], False) 
-                            except IndexError:
-                                break
-                        continue
-            
-                    if (msg.seq >= client.seq_r): # queue future packets
-                        heapq.heappush(client.recv_window, (msg.seq, msg))
-                        continue
-            
-                    if (msg.seq < client.seq_r): #ignore already received packets
-                        continue
-                
-                except NotEnoughBytesError:
-                    break
-
-                except ChecksumMismatchError:
-                    send_nack(client)
-                    client.incoming = bytearray()
-                    break
+            with SendBatch(): # everything produced while handling this read is written together
+                receive_frames(client, client.decoder.decode_frames())
+                process_client_messages(client)
 
-            process_client_messages(client)
-
-    # handle disconnect
-    handle_disconnect(client) # this is still part of handle_client()
+        # handle disconnect
+        handle_disconnect(client) # this is still part of handle_client()
+    finally:
+        # closes the socket once what is queued for it is written (at once if it was handed to another worker)
+        client.outbox.close_when_written()
 #endregion
 
 #region Game
 class Player:
-    def __init__(self, id):
+    def __init__(self, id, board_type=Board, board_size=BOARD_SIZE):
         self.id = id
         self.ships_placed = 0
         self.ship_orientation = 0
-        self.board = Board()
+        self.board = board_type(board_size)
         self.moves = 0
         self.client = None
     def set_client(self, client):
@@ -356,13 +992,28 @@ class GameState(Enum):
     END = 3
     PAUSE = 4
 
+NEW_GAME_DELAY = 5 # seconds between the end of one game and the start of the next
+
 class Game:
-    def __init__(self):
+    def __init__(self, room_id=0, restart_delay=NEW_GAME_DELAY, board_type=Board, board_size=BOARD_SIZE, ships=SHIPS):
+        self.room_id = room_id
         self.game_number = 0
+        self.games_completed = 0
+        self.restart_delay = restart_delay
+        self.board_type = board_type # Board backend from battleship.py
+        self.board_size = board_size
+        self.ships = ships # (name, size) of each ship the players place, in order
+        self.registry = ClientRegistry() # clients in this room
+        self.closed = False
+        self.thread = None
+        # notified whenever something the game loop waits on changes (clients joining or leaving,
+        # ships placed, shots fired, the game ending), so phases advance as soon as they can
+        self.changed = threading.Condition()
         self.new_game()
     def new_game(self):
         self.state = GameState.WAIT
-        self.players = [Player(0), Player(1)]
+        self.players = [Player(0, self.board_type, self.board_size), Player(1, self.board_type, self.board_size)]
+        self.registry.reset_players()
         self.previous_state = GameState.WAIT
         self.disconnected_player = None
         self.disconnected_player_id = 0
@@ -370,9 +1021,25 @@ class Game:
         self.disconnect_time = None
         self.player_turn = None
         if self.game_number > 0:
-            if self.end_thread:
-                self.end_thread.cancel()
-        self.end_thread = None
+            if self.end_timer:
+                self.end_timer.cancel()
+        self.end_timer = None
+#endregion
+
+#region Events
+    """
+    Wake the game loop so it re-checks whatever it is waiting for.
+    """
+    def notify_changed(self):
+        with self.changed:
+            self.changed.notify_all()
+
+    """
+    Block until predicate() is true, re-checking it every time notify_changed() is called.
+    """
+    def wait_until(self, predicate):
+        with self.changed:
+            self.changed.wait_for(predicate)
 #endregion
 
 #region Player Handling
@@ -380,9 +1047,9 @@ class Game:
     Sets a client as a spectator and removes them from the player list if they were previously a player.
     """
     def set_spectator(self, client, send_msg=False):
-        player_id = self.get_player(client.id)
-        if (player_id != None):
-            self.players[player_id] == None
+        player = self.get_player(client.id)
+        if (player != None):
+            self.registry.assign(player, None)
         client.set_spectator()
         if (send_msg):
             msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"YOU ARE A SPECTATOR")
@@ -393,7 +1060,7 @@ class Game:
     """
     def set_player(self, player_id, client):
         client.set_player()
-        self.players[player_id].client = client
+        self.registry.assign(self.players[player_id], client)
         msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"YOU ARE PLAYER {player_id}")
         send_message_to(client, msg)
 
@@ -401,9 +1068,9 @@ class Game:
     Decide on the next two players and set them as players.
     """
     def set_players(self):
-        num_clients = len(clients)
-        p0_index = (2*self.game_number)%(num_clients)
-        p1_index = (p0_index + 1)%(num_clients)
+        clients = self.registry.clients
+        p0_index = (2*self.game_number)%(len(clients))
+        p1_index = (p0_index + 1)%(len(clients))
         self.set_player(0, clients[p0_index])
         self.set_player(1, clients[p1_index])
     
@@ -411,19 +1078,14 @@ class Game:
     Get a player object from a client id, returns none if client id does not link to a player.
     """
     def get_player(self, client_id):
-        for player in self.players:
-            if player.client != None and player.client.id == client_id:
-                return player
-            
-        return None
+        return self.registry.player_of(client_id)
         
     def remove_player(self, client):
-        for player in self.players:
-            if player.client == client:
-                player.client = None
-                self.disconnected_player = client
-                self.disconnected_player_id = player.id
-                self.disconnected_players += 1
+        player = self.registry.player_left(client)
+        if player != None:
+            self.disconnected_player = client
+            self.disconnected_player_id = player.id
+            self.disconnected_players += 1
     
     """
     Return the opponent of player.
@@ -448,7 +1110,8 @@ class Game:
         send_message_to(self.get_opponent(player).client, msg)
         
         self.state = GameState.END
-        close_all_connections()
+        self.close_all_connections()
+        self.notify_changed()
     
     """
     Handle player timeout
@@ -461,46 +1124,142 @@ class Game:
         send_message_to(self.get_opponent(player).client, msg)
         
         self.state = GameState.END
-        close_all_connections()
+        self.close_all_connections()
+        self.notify_changed()
 #endregion
 
 #region Game Messages
+    """
+    Clients in the room, in the order they joined.
+    """
+    @property
+    def clients(self):
+        return self.registry.clients
+
     """
     Send a waiting message.
     """
     def send_waiting_message(self, client):
-        num_clients = len(clients)
+        num_clients = len(self.registry)
         res = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT,\
                       f"Waiting for game to start... Clients connected [{num_clients}/2]")
         send_message_to(client, res)
 
     """
-    Convert a board into a sendable string.
+    Convert a board into a sendable string: the column header and each row, ended by '|'.
+    Rows come from the board's render cache, so only rows changed since the last board are rebuilt.
     """
     def board_to_str(self, board, show_hidden=False):
-        grid_to_send = board.hidden_grid if show_hidden else board.display_grid
-        
-        board_msg = ""
-        board_msg = board_msg + "  " + " ".join(str(i+1).rjust(2) for i in range(board.size)) + '|'
-        for r in range(board.size):
-            row_label = chr(ord('A') + r)
-            row_str = " ".join(grid_to_send[r][c] for c in range(board.size))
-            board_msg = board_msg + f"{row_label:2} {row_str}" + "|"
-        
-        print(board_msg[17])
-        return board_msg
+        codec = board.codec
+        header = " " * codec.label_width + codec.column_header
+        return "|".join((header, *board.rendered_rows(show_hidden), ""))
     
+    """
+    Every cell of a board as one character each, row by row, taken from the board's cached rows.
+    """
+    def board_states(self, board, show_hidden=False):
+        start = board.codec.label_width + 1 # cells follow the label and a space, one space apart
+        return "".join([row[start::2] for row in board.rendered_rows(show_hidden)])
+
+    """
+    A whole board in a client's board format as (length, pieces), pieces() giving the snapshot a row at a
+    time so a long text board is fragmented and sent while the rest is still being produced. Binary
+    snapshots take an eighth of the room and are built whole.
+    """
+    def board_snapshot_pieces(self, board, show_hidden, board_format, key, version):
+        if board_format == "binary":
+            snapshot = self.board_snapshot(board, show_hidden, board_format, key, version)
+            return len(snapshot), lambda: (snapshot,)
+        codec = board.codec
+        rows = board.rendered_rows(show_hidden)
+        first = " " * codec.label_width + codec.column_header + "|"
+        if board_format == "delta":
+            first = encode_board_snapshot(key, version, first)
+        length = len(first) + sum(map(len, rows)) + len(rows)
+        return length, lambda: itertools.chain((first,), (row + "|" for row in rows))
+
+    """
+    A whole board in a client's board format: plain text, a text snapshot or a binary snapshot.
+    """
+    def board_snapshot(self, board, show_hidden, board_format, key, version):
+        if board_format == "binary":
+            return encode_board_binary(key, version, board.size, self.board_states(board, show_hidden))
+        text = self.board_to_str(board, show_hidden)
+        if board_format == "delta":
+            return encode_board_snapshot(key, version, text)
+        return text
+
+    """
+    Name of a board and view in BOARD snapshots and deltas, e.g. "0d" for player 0's board as their opponent sees it.
+    """
+    def board_key(self, board, show_hidden=False):
+        owner = 0 if board is self.players[0].board else 1
+        return f"{owner}{'h' if show_hidden else 'd'}"
+
+    """
+    Send a board to some clients. A client that already has an earlier version of the same board
+    only gets the cells that changed since (a delta), everyone else gets a snapshot of the whole board
+    in their board format. Clients with the plain "text" format always get the whole board as text.
+    Clients with the same format and version share one encoded message. Congested spectators skip
+    the board and get its latest version once they have caught up.
+    """
+    def send_board_to(self, clients, board, show_hidden, expected):
+        key = self.board_key(board, show_hidden)
+        version = board.version
+        groups = {} # (board format, version the clients have or None for no copy) -> clients
+        for client in clients:
+            if client == None or client.hold_back_board(key, board, show_hidden, expected):
+                continue
+            base = None
+            if client.board_format != "text":
+                sent = client.boards.get(key)
+                base = sent[1] if sent != None and sent[0] is board else None
+                client.boards[key] = (board, version)
+            groups.setdefault((client.board_format, base), []).append(client)
+
+        snapshots = {} # board format -> (length, pieces) of its snapshot
+        for (board_format, base), group in groups.items():
+            payload = None
+            if base != None:
+                changes = board.changes_since(base, show_hidden)
+                if changes != None:
+                    cells = [f"{board.codec.format(r, c)}{state}" for r, c, state in changes]
+                    payload = encode_board_delta(key, base, version, cells)
+            if payload == None or len(payload) > board.size * board.size // 4: # could be bigger than a snapshot
+                if board_format not in snapshots:
+                    snapshots[board_format] = self.board_snapshot_pieces(board, show_hidden, board_format, key, version)
+                length, pieces = snapshots[board_format]
+                if payload == None or length < len(payload):
+                    send_frames_to_all(group, fragment_message(SERVER_ID, MessageType.BOARD, expected, pieces()))
+                    continue
+            send_message_to_all(group, Message(SERVER_ID, MessageType.BOARD, expected, payload))
+
     """
     Send a player a board.
     """
     def send_board(self, to_player, board, show_hidden=False):
-        client = to_player.client
-        board_msg = self.board_to_str(board, show_hidden)
-        msg = Message(SERVER_ID, MessageType.BOARD, MessageType.PLACE, board_msg)
-        send_message_to(client, msg)
+        self.send_board_to([to_player.client], board, show_hidden, MessageType.PLACE)
         if self.state == GameState.BATTLE:
-            spec_msg = Message(SERVER_ID, MessageType.BOARD, MessageType.CHAT, board_msg)
-            self.announce_to_spectators(spec_msg)
+            self.send_board_to(self.registry.spectators, board, show_hidden, MessageType.CHAT)
+
+    """
+    Send a client a snapshot of the board named by key, after its copy fell out of step with a delta.
+    Only a player gets their own board with the ships showing.
+    """
+    def resend_board(self, client, key):
+        if len(key) < 2 or key[-1] not in "hd" or key[:-1] not in ("0", "1"):
+            return
+        owner = self.players[int(key[:-1])]
+        show_hidden = key[-1] == "h"
+        player = self.get_player(client.id)
+        if show_hidden and player is not owner:
+            return
+        if player == None:
+            expected = MessageType.CHAT
+        else:
+            expected = MessageType.PLACE if self.state == GameState.PLACE else MessageType.FIRE
+        client.boards.pop(key, None)
+        self.send_board_to([client], owner.board, show_hidden, expected)
     
     """
     Send a message to both players.
@@ -513,13 +1272,7 @@ class Game:
     Send a message to all spectators.
     """
     def announce_to_spectators(self, msg):
-        playerids = []
-        for player in self.players:
-            if player.client:
-                playerids.append(player.client.id)
-        for client in clients:
-            if (client.id not in playerids):
-                send_message_to(client, msg)
+        send_message_to_all(self.registry.spectators, msg)
 
 #endregion
 
@@ -534,14 +1287,14 @@ class Game:
     Send the player a prompt to place a ship.
     """
     def send_place_prompt(self, player):
-        if (player.ships_placed >= 5):
+        if (player.ships_placed >= len(self.ships)):
             self.send_board(player, player.board, show_hidden=True)
             msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, "All ships placed. Waiting for opponent...")
             send_message_to(player.client, msg)
             return
 
         self.send_board(player, player.board, show_hidden=True)
-        ship_name, ship_size = SHIPS[player.ships_placed] # Next ship to place
+        ship_name, ship_size = self.ships[player.ships_placed] # Next ship to place
         orientation = player.ship_orientation
         
         prompt_msg = f"Place {ship_name} (Size: {ship_size}) {self.orientation_str(orientation)}. Enter 'x' to change orientation."
@@ -560,24 +1313,24 @@ class Game:
             raise ValueError
         
         board = player.board
-        ship_name, ship_size = SHIPS[player.ships_placed] # Next ship to place
-        orientation = player.ship_orientation
-
-        if (player.ships_placed >= 5):
+        if (player.ships_placed >= len(self.ships)):
             msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, "All ships placed. Waiting for opponent...")
             send_message_to(player.client, msg)
             return
+
+        ship_name, ship_size = self.ships[player.ships_placed] # Next ship to place
+        orientation = player.ship_orientation
         
         # Get coordinates from message
         coords = coords.strip().upper()
         try:
-            # Change orientation
-            if coords[0] == 'X':
+            # Change orientation (boards with 24 or more rows have an X row, so X3 etc. are still coordinates)
+            if coords[:1] == 'X' and coords not in board.codec.cells:
                 player.ship_orientation = 1 - player.ship_orientation
                 self.send_place_prompt(player)
                 return
             # Coordinates
-            row, col = parse_coordinate(coords)
+            row, col = board.codec.parse(coords)
         except ValueError as e:
             msg = Message(SERVER_ID, MessageType.TEXT, MessageType.PLACE, f"[!] Invalid coordinate: {e}")
             send_message_to(player.client, msg)
@@ -585,13 +1338,9 @@ class Game:
             return
         
         # Check if we can place the ship
-        if board.can_place_ship(row, col, ship_size, orientation):
-            occupied_positions = board.do_place_ship(row, col, ship_size, orientation)
-            board.placed_ships.append({
-                "name": ship_name,
-                "positions": occupied_positions
-            })
+        if board.place_ship(ship_name, row, col, ship_size, orientation):
             player.ships_placed += 1
+            self.notify_changed()
             spec_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"PLAYER {player.id} PLACED THEIR {ship_name}")
             self.announce_to_spectators(spec_msg)
         else:
@@ -657,7 +1406,7 @@ class Game:
         
         # Attempt fire
         try:
-            row, col = parse_coordinate(coords)
+            row, col = opponent.board.codec.parse(coords)
             result, sunk_name = opponent.board.fire_at(row, col)
 
             # Let the player fire again if already shot
@@ -698,6 +1447,7 @@ class Game:
             self.announce_to_spectators(spec_msg)
             # End turn
             self.end_player_turn(player)
+            self.notify_changed()
         
         except ValueError as e:
             msg = Message(SERVER_ID, MessageType.TEXT, MessageType.FIRE, f"Invalid input: {e}")
@@ -710,23 +1460,25 @@ class Game:
     # seperate functions for each stage to make it easier to pause and resume
     def placing_stage(self):
         # Start placing phase
-        self.send_place_prompt(self.players[0])
-        self.send_place_prompt(self.players[1])
+        with SendBatch():
+            self.send_place_prompt(self.players[0])
+            self.send_place_prompt(self.players[1])
         
         # Wait for players to place all ships
-        while((self.players[0].ships_placed < 5 or self.players[1].ships_placed < 5) and (self.state == GameState.PLACE or self.state == GameState.PAUSE)):
-            time.sleep(1)
+        num_ships = len(self.ships)
+        self.wait_until(lambda: not ((self.players[0].ships_placed < num_ships or self.players[1].ships_placed < num_ships) and (self.state == GameState.PLACE or self.state == GameState.PAUSE)))
 
         return True
     
     def start_battle(self):
-        battle_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.FIRE, "BATTLE STARTING")
-        self.announce_to_players(battle_msg)
-        self.player_turn = randint(0,1)
-        # Send prompt to player who's turn is first and wait to other player
-        self.send_fire_prompt(self.players[self.player_turn])
-        wait_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.FIRE, "Waiting for opponent...")
-        send_message_to(self.players[1 - self.player_turn].client, wait_msg)
+        with SendBatch():
+            battle_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.FIRE, "BATTLE STARTING")
+            self.announce_to_players(battle_msg)
+            self.player_turn = randint(0,1)
+            # Send prompt to player who's turn is first and wait to other player
+            self.send_fire_prompt(self.players[self.player_turn])
+            wait_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.FIRE, "Waiting for opponent...")
+            send_message_to(self.players[1 - self.player_turn].client, wait_msg)
 
     def battle_stage(self):
         if (self.players[0].board.all_ships_sunk()):
@@ -743,20 +1495,22 @@ class Game:
         self.new_game()
         
         # Wait for players to connect
-        while(len(clients) < 2):
-            time.sleep(1)
+        self.wait_until(lambda: len(self.registry) >= 2 or self.closed)
+        if self.closed:
+            return
         
-        # Announce start
-        start_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, "GAME STARTING")
-        send_message_to_all(clients, start_msg)
-        self.state = GameState.PLACE
+        with SendBatch():
+            # Announce start
+            start_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, "GAME STARTING")
+            send_message_to_all(self.clients, start_msg)
+            self.state = GameState.PLACE
 
-        # Announce players
-        self.set_players()
-                
-        # Announce spectators
-        msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"YOU ARE A SPECTATOR")
-        self.announce_to_spectators(msg)
+            # Announce players
+            self.set_players()
+
+            # Announce spectators
+            msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"YOU ARE A SPECTATOR")
+            self.announce_to_spectators(msg)
 
         self.placing_stage()
         
@@ -770,142 +1524,733 @@ class Game:
         # Wait for battle to end
         winner = None
         loser = None
-        while (self.state == GameState.BATTLE or self.state == GameState.PAUSE) and winner == None:
+        if self.state == GameState.BATTLE:
+            self.wait_until(lambda: (self.state != GameState.BATTLE and self.state != GameState.PAUSE) or self.battle_stage()[0] != None)
             winner, loser = self.battle_stage()
-            time.sleep(1)
         
         self.state = GameState.END
         
-        # End game
-        end_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, "GAME OVER")
-        self.announce_to_players(end_msg)
-        
-        if winner:
-            # Game finished with a player winning
-            # Send win message
-            win_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, "YOU WIN!!!")
-            send_message_to(winner.client, win_msg)
-            win_stats_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"You won in {winner.moves} moves!")
-            send_message_to(winner.client, win_stats_msg)
-            
-            # Send lose message
-            loss_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, "You lose")
-            send_message_to(loser.client, loss_msg)
+        with SendBatch():
+            # End game
+            end_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, "GAME OVER")
+            self.announce_to_players(end_msg)
+
+            if winner:
+                # Game finished with a player winning
+                # Send win message
+                win_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, "YOU WIN!!!")
+                send_message_to(winner.client, win_msg)
+                win_stats_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"You won in {winner.moves} moves!")
+                send_message_to(winner.client, win_stats_msg)
+
+                # Send lose message
+                loss_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, "You lose")
+                send_message_to(loser.client, loss_msg)
+
+                # Announce to spectators
+                spec_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"GAME OVER! PLAYER {winner.id} WINS!")
+                self.announce_to_spectators(spec_msg)
 
-            # Announce to spectators
-            spec_msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"GAME OVER! PLAYER {winner.id} WINS!")
-            self.announce_to_spectators(spec_msg)
+        if winner:
+            self.games_completed += 1
 
         self.game_number += 1
 
-        time.sleep(5) # Wait 5 seconds before starting new game (can be removed later)
+        time.sleep(self.restart_delay) # Give everyone time to see the result before starting a new game
     
     """
-    Run games in a loop indefinately.
+    Run games in a loop until the room is closed.
     """
     def run(self):
-        while True:
+        while not self.closed:
             self.play_game()
-        close_all_connections()
 
-game = Game()
-game_manager = None
+    """
+    Start the room's game manager thread.
+    """
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    """
+    Stop the game manager thread once the room is empty.
+    """
+    def close(self):
+        self.closed = True
+        self.state = GameState.END
+        if self.end_timer:
+            self.end_timer.cancel()
+        self.notify_changed()
+
+    def close_all_connections(self):
+        for client in self.clients:
+            client.outbox.close_when_written() # after the goodbyes queued for it
+#endregion
+
+#region Rooms
+class RoomManager:
+    """
+    Hosts many Games (rooms) behind one listener.
+    New clients fill the oldest room that still has space and a room is opened when every room is full.
+    A room is reused for the next game while it has clients and torn down once the last one leaves.
+    Every Client keeps a reference to its room, so finding the game for a message is O(1).
+    """
+    def __init__(self, room_size=MAX_CLIENTS, restart_delay=NEW_GAME_DELAY, board_type=Board, board_size=BOARD_SIZE, ships=SHIPS):
+        self.room_size = room_size
+        self.restart_delay = restart_delay
+        self.board_type = board_type
+        self.board_size = board_size
+        self.ships = ships
+        self.rooms = {} # room id -> Game
+        self.open_rooms = {} # rooms with space, oldest first (dict used as an ordered set)
+        self.disconnected = {} # username of a disconnected player -> room waiting for them to reconnect
+        self.next_room_id = 0
+        self.connections = 0 # clients across every room
+        self.games_completed = 0 # by rooms that have been torn down
+        self.slow_disconnects = 0 # clients disconnected for falling too far behind, see check_backlog()
+        self.lock = threading.Lock()
+
+    def open_room(self):
+        room = Game(self.next_room_id, self.restart_delay, self.board_type, self.board_size, self.ships)
+        self.next_room_id += 1
+        self.rooms[room.room_id] = room
+        self.open_rooms[room.room_id] = room
+        room.start()
+        return room
+
+    def add(self, room, client):
+        client.id = room.registry.reserve_id()
+        client.game = room
+        if room.registry.reserved >= self.room_size:
+            self.open_rooms.pop(room.room_id, None)
+
+    def remove(self, client):
+        room = client.game
+        room.registry.remove(client)
+        room.registry.release_id(client.id)
+        if room.registry.reserved == 0:
+            # tear down the empty room
+            self.games_completed += room.games_completed
+            del self.rooms[room.room_id]
+            self.open_rooms.pop(room.room_id, None)
+            room.close()
+        elif room.registry.reserved < self.room_size:
+            self.open_rooms[room.room_id] = room
+
+    """
+    Put a new client in a room and give it an id within that room.
+    """
+    def join(self, client):
+        with self.lock:
+            if self.open_rooms:
+                room = next(iter(self.open_rooms.values()))
+            else:
+                room = self.open_room()
+            self.add(room, client)
+            self.connections += 1
+        return room
+
+    """
+    Take a client out of its room.
+    """
+    def leave(self, client):
+        with self.lock:
+            self.remove(client)
+            self.connections -= 1
+
+    """
+    Remember which room a disconnected player belongs to so they can be sent back there.
+    """
+    def player_left(self, client):
+        with self.lock:
+            self.disconnected[client.username] = client.game
+        if shard:
+            shard.player_left(client.username)
+
+    """
+    Move a reconnecting player into the room waiting for them.
+    Returns True if the client changed rooms (and so has a new id).
+    """
+    def rejoin(self, client):
+        with self.lock:
+            room = self.disconnected.get(client.username)
+            if room is None or room is client.game:
+                return False
+            del self.disconnected[client.username]
+            if shard:
+                shard.claimed(client.username)
+            if room.closed or client.username not in room.registry.waiting or not room.registry.has_free_id():
+                return False
+            self.remove(client)
+            self.add(room, client)
+            room.registry.add(client)
+            return True
+
+    def slow_disconnect(self):
+        with self.lock:
+            self.slow_disconnects += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "rooms": len(self.rooms),
+                "clients": self.connections,
+                "games_completed": self.games_completed + sum(room.games_completed for room in self.rooms.values()),
+                "slow_disconnects": self.slow_disconnects,
+                "links": link_summary([client for room in self.rooms.values() for client in room.clients]),
+            }
+
+rooms = RoomManager()
+
+LINK_STATS_WORST = 5 # connections listed one by one in the stats, the rest only count towards the totals
+
+def link_summary(clients):
+    # retransmission and queue figures over many connections, kept small enough for a stats datagram however many there are
+    links = [client.link_stats() for client in clients]
+    rtts = [link["rtt"] for link in links if link["rtt"] is not None]
+    return {
+        "rtt_mean": sum(rtts) / len(rtts) if rtts else None,
+        "rtt_max": max(rtts, default=None),
+        "rto_max": max((link["rto"] for link in links), default=None),
+        "retransmits": sum(link["retransmits"] for link in links),
+        "timeouts": sum(link["timeouts"] for link in links),
+        "unacked": sum(link["unacked"] for link in links),
+        "queued": sum(link["queued"] for link in links),
+        "queued_max": max((link["queued"] for link in links), default=0),
+        "queued_peak": max((link["queued_peak"] for link in links), default=0),
+        "dropped_boards": sum(link["dropped_boards"] for link in links),
+        "dropped_frames": sum(link["dropped_frames"] for link in links),
+        "worst": heapq.nlargest(LINK_STATS_WORST, links, key=lambda link: (link["retransmits"], link["unacked"], link["queued"])),
+    }
+
+# Answer every connection to port with one line of JSON from stats(), for a server without workers
+def serve_stats_forever(host, port, stats):
+    listener = socket.create_server((host, port))
+    print(f"[INFO] Stats on {host}:{port}")
+    while True:
+        conn, _ = listener.accept()
+        with conn:
+            try:
+                conn.sendall((json.dumps(stats()) + "\n").encode())
+            except OSError:
+                pass
 #endregion
 
 #region Connections
 def handle_disconnect(client : Client):
-    global num_clients
     ## it looks like this is firing twice, not sure why, have to look into it
     print(f"[INFO] Client [{client.id}] disconnected.")
     
-    if client not in clients:
+    game = client.game
+    if client not in game.registry:
         return
 
     if client.timeout:
-        client.timeout.active = False
+        client.timeout.cancel()
     
-    heapq.heappush(free_ids, client.id)
-    clients.remove(client)
-    num_clients -= 1
+    is_player = game.get_player(client.id) != None
+    game.remove_player(client) # while the room still knows the client's role
+    rooms.leave(client)
     
-    if game.get_player(client.id):
+    if is_player:
         msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"[INFO] player [{client.username}] has disconnected, waiting for reconnect")
+        rooms.player_left(client)
     else:
         msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"[INFO] spectator [{client.username}] has disconnected, waiting for reconnect")
     
-    send_message_to_all(clients, msg)
-    
-    game.remove_player(client)
+    send_message_to_all(game.clients, msg)
 
     try:
         msg = Message(SERVER_ID, MessageType.DISCONNECT, MessageType.DISCONNECT, "disconnected")
         send_message_to(client, msg)
     except:
         pass
+    if client.retransmit_timer: # after the last send, which would start it again
+        client.retransmit_timer.cancel()
+    if client.drain_timer:
+        client.drain_timer.cancel()
 
-    client.conn.close()
+    client.outbox.close_when_written() # the DISCONNECT and anything still queued go out first
+
+    if game.closed: # that was the last client in the room
+        return
 
     ## check if all players have disconnected and end game
     if game.disconnected_players >= 2:
         game.state = GameState.END
+        game.notify_changed()
         return
 
     if game.state != GameState.PAUSE:
         game.previous_state = game.state
 
     game.state = GameState.PAUSE
-    if game.end_thread:
+    game.notify_changed()
+    if game.end_timer:
         return
     
     ## disable other players timeout timer
-    for other_client in clients:
+    for other_client in game.clients:
         if other_client.timeout:
-            other_client.timeout.active = False
+            other_client.timeout.cancel()
     
-    game.end_thread = threading.Timer(30, end_game, args=(game,))
-    game.end_thread.start()
+    game.end_timer = timers.arm(RECONNECT_TIMEOUT, end_game, game)
 
     msg = Message(SERVER_ID, MessageType.TEXT, MessageType.CHAT, f"[INFO] player [{client.id}] has disconnected, waiting for reconnect")
     game.announce_to_players(msg)
 
 
-def close_all_connections():
-    for client in clients:
-        client.conn.close()
+def register_client(conn, addr):
+    print(f"[INFO] Client connected from {addr}")
 
-# main thread accepts clients in a loop
-def main():
-    global num_clients
+    client = Client(conn, addr)
+    rooms.join(client)
+    return client
 
-    print(f"[INFO] Server listening on {HOST}:{PORT}")
+# main thread accepts clients in a loop, one thread per client
+def serve_threaded(host, port, reuse_port=False):
+    print(f"[INFO] Server listening on {host}:{port}")
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port: # several worker processes share the port, the kernel spreads connections between them
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        s.bind((host, port))
+        s.listen(MAX_CLIENTS)
 
-        # start the game manager thread
-        game_manager = threading.Thread(target=game.run)
-        game_manager.daemon = True
-        game_manager.start()
-        
         # listen for connections
         try:
             while True: # keeps thread open when max clients is full and allows for clients to decrease
-                while num_clients < MAX_CLIENTS:
-                    s.listen(1)
+                while rooms.connections < MAX_CONNECTIONS:
                     conn, addr = s.accept()
-                    print(f"[INFO] Client connected from {addr}")
-
-                    client = Client(conn, addr)
-                    clients.append(client)
-                    num_clients += 1
-                    client.id = heapq.heappop(free_ids)
+                    client = register_client(conn, addr)
 
                     thread = threading.Thread(target=handle_client, args=[client])
                     thread.daemon = True
                     client.thread = thread
                     thread.start()
+                time.sleep(1)
         except KeyboardInterrupt:
             return
-#end region
+#endregion
+
+#region Asyncio Server
+class StreamConn:
+    """
+    Socket-like wrapper around an asyncio StreamWriter.
+    The game manager and timer threads keep writing with sendmsg()/close(), writes from those threads are
+    handed over to the event loop.
+    """
+    def __init__(self, writer):
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+
+    def call_in_loop(self, func, *args):
+        if threading.get_ident() == self.loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def sendmsg(self, buffers):
+        if self.writer.is_closing():
+            raise BrokenPipeError
+        data = b"".join(buffers)
+        self.call_in_loop(self.writer.write, data)
+        return len(data)
+
+    def send(self, data):
+        return self.sendmsg((data,))
+
+    def close(self):
+        self.call_in_loop(self.close_in_loop)
+
+    def close_in_loop(self):
+        # the transport writes what it still holds before closing, a client that doesn't take it is cut off
+        self.writer.close()
+        self.loop.call_later(CLOSE_LINGER, self.writer.transport.abort)
+
+    def shutdown(self, how):
+        # drops whatever the transport still holds, the read side sees the connection close
+        self.call_in_loop(self.writer.transport.abort)
+
+    def buffered(self):
+        # bytes written that the transport hasn't handed to the kernel yet
+        return self.writer.transport.get_write_buffer_size()
+
+    def fileno(self):
+        return self.writer.get_extra_info("socket").fileno()
+
+    async def drain(self):
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass # the read side notices the disconnect
+
+async def send_message_to_async(client, msg, new=True):
+    send_message_to(client, msg, new)
+    await client.conn.drain()
+
+async def process_client_messages_async(client):
+    with SendBatch():
+        process_client_messages(client)
+    await client.conn.drain()
+
+async def handle_client_async(reader, writer):
+    conn = StreamConn(writer)
+    addr = writer.get_extra_info("peername")
+
+    if rooms.connections >= MAX_CONNECTIONS:
+        print(f"[INFO] Server full, turning away {addr}")
+        # a one-off frame written directly, no Client (send window, retransmit timer) for a connection that closes now
+        writer.write(Message(SERVER_ID, MessageType.DISCONNECT, MessageType.DISCONNECT, "server full").encode())
+        try:
+            await writer.drain()
+        except OSError:
+            pass
+        writer.close()
+        return
+
+    client = register_client(conn, addr)
+    greet_client(client)
+    await conn.drain()
+    await serve_client_async(client, reader)
+
+async def serve_client_async(client, reader):
+    while True:
+        try:
+            data = await reader.read(BUFSIZE)
+        except ConnectionError:
+            break
+        if not data:
+            break
+
+        with SendBatch():
+            receive_frames(client, client.decoder.feed(data))
+        await process_client_messages_async(client)
+
+    handle_disconnect(client)
+
+# one event loop serves every connection
+async def serve_async(host, port, reuse_port=False):
+    if shard:
+        shard.loop = asyncio.get_running_loop()
+    server = await asyncio.start_server(handle_client_async, host, port, reuse_address=True, reuse_port=reuse_port, backlog=MAX_CLIENTS)
+    print(f"[INFO] Server listening on {host}:{port} (asyncio)")
+    async with server:
+        await server.serve_forever()
+#endregion
+
+#region Shards
+STATS_INTERVAL = 1 # seconds between stats reports from a worker to the coordinator
+shard = None # link to the coordinator when running as one of several worker processes
+
+class ShardLink:
+    """
+    A worker process' side of its unix socket pair with the coordinator, one JSON object per datagram.
+    Reports the worker's stats and disconnected players, and hands over connections for games it doesn't own.
+    """
+    def __init__(self, index, channel):
+        self.index = index
+        self.channel = channel
+        self.owners = {} # username of a player waiting on another worker -> that worker's index
+        self.loop = None # event loop of an asyncio worker, connections handed to us are served on it
+        self.lock = threading.Lock()
+
+    def send(self, op, fds=(), **fields):
+        data = json.dumps({"op": op, **fields}).encode()
+        with self.lock:
+            try:
+                socket.send_fds(self.channel, [data], list(fds))
+            except OSError:
+                pass # the coordinator has gone, run() is about to take the worker down
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        self.report()
+
+    def report(self):
+        self.send("stats", pid=os.getpid(), **rooms.stats())
+        timers.arm(STATS_INTERVAL, self.report)
+
+    def player_left(self, username):
+        self.send("left", username=username)
+
+    def claimed(self, username):
+        self.send("claimed", username=username)
+
+    """
+    Pass a client whose game is on another worker over to that worker, with its sequence numbers and
+    anything it sent that hasn't been processed yet. Returns False if no other worker is waiting for it.
+    """
+    def hand_off(self, client):
+        owner = self.owners.get(client.username)
+        if owner is None or owner == self.index:
+            return False
+
+        print(f"[INFO] Handing {client.username} over to worker {owner}")
+        streamed = isinstance(client.conn, StreamConn)
+        if streamed: # what the client sends from now on is for the other worker
+            client.conn.writer.transport.pause_reading()
+        try:
+            client.outbox.flush(wait=True)
+        except OSError:
+            pass
+        unprocessed = b"".join(msg.encode() for msg in client.recv_window.messages(client.seq_r))
+        unprocessed += bytes(client.decoder.buffer[client.decoder.start:client.decoder.end])
+        state = dict(shard=owner, username=client.username, board_format=client.board_format,
+                     seq_s=client.seq_s, seq_r=client.seq_r, pending=unprocessed.hex())
+
+        if client.timeout:
+            client.timeout.cancel()
+        if client.retransmit_timer:
+            client.retransmit_timer.cancel()
+        if client.drain_timer:
+            client.drain_timer.cancel()
+        client.outbox.close()
+        rooms.leave(client)
+        if streamed:
+            # flush() only queued the bytes on the transport, they have to be on the socket before it moves
+            asyncio.ensure_future(self.hand_off_stream(client.conn, state))
+            return True
+        self.send("handoff", fds=[client.conn.fileno()], **state)
+        client.conn.close() # the other worker has its own copy of the socket
+        return True
+
+    async def hand_off_stream(self, conn, state):
+        transport = conn.writer.transport
+        transport.set_write_buffer_limits(high=0) # drain() now waits until the buffer is empty
+        try:
+            await conn.writer.drain()
+        except ConnectionError:
+            conn.writer.close()
+            return
+        if transport.get_write_buffer_size() == 0 and not transport.is_closing():
+            self.send("handoff", fds=[conn.fileno()], **state)
+        conn.writer.close() # the other worker has its own copy of the socket
+
+    def run(self):
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(self.channel, 1<<16, 1)
+            except OSError:
+                data = b""
+            if not data: # the coordinator has gone, take the worker down with it
+                os._exit(0)
+
+            msg = json.loads(data)
+            if msg["op"] == "owner":
+                self.owners[msg["username"]] = msg["shard"]
+            elif msg["op"] == "release":
+                self.owners.pop(msg["username"], None)
+            elif msg["op"] == "handoff":
+                self.adopt(socket.socket(fileno=fds[0]), msg)
+
+    def adopt(self, conn, state):
+        if self.loop:
+            asyncio.run_coroutine_threadsafe(adopt_client_async(conn, state), self.loop)
+            return
+        conn.setblocking(True)
+        client = adopt_client(conn, conn.getpeername(), state)
+        thread = threading.Thread(target=handle_client, args=[client, False])
+        thread.daemon = True
+        client.thread = thread
+        thread.start()
+
+# Take over a connection handed over by another worker. It goes through the same steps as a new client
+# that then sends its username, and carries on from the sequence numbers it had on the other worker.
+def adopt_client(conn, addr, state):
+    client = Client(conn, addr)
+    client.username = state["username"]
+    client.board_format = state["board_format"]
+    client.seq_s = state["seq_s"]
+    client.seq_r = state["seq_r"]
+    rooms.join(client)
+
+    with SendBatch():
+        greet_client(client)
+        identify_client(client, hand_off=False)
+        receive_frames(client, client.decoder.feed(bytes.fromhex(state["pending"])))
+        process_client_messages(client)
+    return client
+
+async def adopt_client_async(conn, state):
+    reader, writer = await asyncio.open_connection(sock=conn)
+    client = adopt_client(StreamConn(writer), writer.get_extra_info("peername"), state)
+    await client.conn.drain()
+    await serve_client_async(client, reader)
+
+def run_worker(index, channel, coordinator_channels, args):
+    global shard
+    for other in coordinator_channels: # so the worker notices when the coordinator exits
+        other.close()
+    shard = ShardLink(index, channel)
+    shard.start()
+
+    if args.mode == "asyncio":
+        try:
+            asyncio.run(serve_async(args.host, args.port, reuse_port=True))
+        except KeyboardInterrupt:
+            return
+    else:
+        serve_threaded(args.host, args.port, reuse_port=True)
+
+class Coordinator:
+    """
+    Runs in the launching process with --workers. Starts worker processes that each listen on the same port with
+    SO_REUSEPORT and host their own rooms, so games are spread across cores. It collects the workers' stats and
+    remembers which worker owns the game of every disconnected player, so a player that reconnects to another
+    worker is handed over (socket and all) to the right one.
+    """
+    def __init__(self, num_workers, host=HOST, stats_port=None):
+        self.channels = [] # our end of each worker's socket pair
+        self.worker_channels = []
+        for _ in range(num_workers):
+            ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            self.channels.append(ours)
+            self.worker_channels.append(theirs)
+        self.workers = []
+        self.host = host
+        self.stats_port = stats_port
+        self.stats = {} # worker index -> last stats it reported
+        self.owners = {} # username of a disconnected player -> index of the worker with their game
+
+    def start(self, args):
+        for index, channel in enumerate(self.worker_channels):
+            worker = multiprocessing.Process(target=run_worker, args=(index, channel, self.channels, args))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        for channel in self.worker_channels:
+            channel.close()
+
+    def send(self, index, op, fds=(), **fields):
+        socket.send_fds(self.channels[index], [json.dumps({"op": op, **fields}).encode()], list(fds))
+
+    def broadcast(self, sender, op, **fields):
+        for index in range(len(self.channels)):
+            if index != sender and self.workers[index].is_alive():
+                self.send(index, op, **fields)
+
+    def handle(self, index, msg, fds):
+        op = msg.pop("op")
+        if op == "stats":
+            self.stats[index] = msg
+        elif op == "left":
+            self.owners[msg["username"]] = index
+            self.broadcast(index, "owner", username=msg["username"], shard=index)
+        elif op == "claimed":
+            if self.owners.get(msg["username"]) == index:
+                del self.owners[msg["username"]]
+                self.broadcast(index, "release", username=msg["username"])
+        elif op == "handoff":
+            self.send(msg["shard"], "handoff", fds=fds, **msg)
+        for fd in fds: # the receiving worker has its own copy now
+            os.close(fd)
+
+    def totals(self):
+        shards = [self.stats[index] for index in sorted(self.stats)]
+        return {
+            "workers": len(shards),
+            "rooms": sum(stats["rooms"] for stats in shards),
+            "clients": sum(stats["clients"] for stats in shards),
+            "games_completed": sum(stats["games_completed"] for stats in shards),
+            "retransmits": sum(stats["links"]["retransmits"] for stats in shards),
+            "timeouts": sum(stats["links"]["timeouts"] for stats in shards),
+            "dropped_boards": sum(stats["links"]["dropped_boards"] for stats in shards),
+            "slow_disconnects": sum(stats["slow_disconnects"] for stats in shards),
+            "shards": shards,
+        }
+
+    # answer every connection to the stats port with one line of JSON
+    def serve_stats(self, listener):
+        conn, _ = listener.accept()
+        with conn:
+            conn.sendall((json.dumps(self.totals()) + "\n").encode())
+
+    def run(self):
+        print(f"[INFO] Coordinating {len(self.workers)} workers")
+        selector = selectors.DefaultSelector()
+        for index, channel in enumerate(self.channels):
+            selector.register(channel, selectors.EVENT_READ, index)
+        if self.stats_port:
+            listener = socket.create_server((self.host, self.stats_port), reuse_port=False)
+            selector.register(listener, selectors.EVENT_READ, None)
+            print(f"[INFO] Stats on {self.host}:{self.stats_port}")
+
+        while True:
+            for key, _ in selector.select():
+                if key.data is None:
+                    self.serve_stats(key.fileobj)
+                    continue
+                data, fds, _, _ = socket.recv_fds(key.fileobj, 1<<16, 1)
+                if not data:
+                    print(f"[ERROR] worker {key.data} exited")
+                    selector.unregister(key.fileobj)
+                    continue
+                self.handle(key.data, json.loads(data), fds)
+#endregion
+
+def main():
+    global SLOW_SPECTATORS
+    parser = argparse.ArgumentParser(description="BEER battleship server")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded",
+                        help="thread per client (default) or a single asyncio event loop")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--restart-delay", type=float, default=NEW_GAME_DELAY,
+                        help="seconds to wait between the end of a game and the start of the next")
+    parser.add_argument("--room-size", type=int, default=MAX_CLIENTS,
+                        help="clients per room, 2 gives every pair of clients their own game (default: one room for everyone)")
+    parser.add_argument("--board", choices=sorted(BOARD_BACKENDS), default="grid",
+                        help="board backend, grid (lists of characters, default) or bitboard (integer bitmasks)")
+    parser.add_argument("--board-size", type=int, default=BOARD_SIZE,
+                        help="rows and columns of each board, rows past Z are labelled AA, AB, ... (default: 10)")
+    parser.add_argument("--fleet", default=None,
+                        help="ships to place as Name:size,Name:size,... (default: the standard five ship fleet)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="run this many worker processes sharing the port (default: serve from this process)")
+    parser.add_argument("--stats-port", type=int, default=None,
+                        help="port answering every connection with the server's stats as JSON (combined over workers with --workers)")
+    parser.add_argument("--slow-spectators", choices=["drop", "disconnect"], default=SLOW_SPECTATORS,
+                        help="what a spectator that falls behind gets: skip to the latest boards (drop, default) or disconnected")
+    args = parser.parse_args()
+
+    SLOW_SPECTATORS = args.slow_spectators
+    rooms.room_size = max(2, min(args.room_size, MAX_CLIENTS))
+    rooms.restart_delay = args.restart_delay
+    rooms.board_type = BOARD_BACKENDS[args.board]
+    if args.board_size < 1:
+        parser.error("--board-size must be at least 1")
+    rooms.board_size = args.board_size
+    if args.fleet is not None:
+        try:
+            rooms.ships = parse_fleet(args.fleet)
+        except ValueError as e:
+            parser.error(f"--fleet: {e}")
+    try:
+        FleetPlacer(rooms.board_size).place(rooms.ships) # every ship has to fit, or players could never finish placing
+    except ValueError as e:
+        parser.error(f"--fleet doesn't fit on a {rooms.board_size}x{rooms.board_size} board: {e}")
+    CoordinateCodec.for_size(rooms.board_size) # build it before any workers fork
+
+    if args.stats_port and args.workers == 0:
+        threading.Thread(target=serve_stats_forever, args=[args.host, args.stats_port, rooms.stats], daemon=True).start()
+
+    if args.workers > 0:
+        coordinator = Coordinator(args.workers, args.host, args.stats_port)
+        coordinator.start(args)
+        try:
+            coordinator.run()
+        except KeyboardInterrupt:
+            return
+    elif args.mode == "asyncio":
+        try:
+            asyncio.run(serve_async(args.host, args.port))
+        except KeyboardInterrupt:
+            return
+    else:
+        serve_threaded(args.host, args.port)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,67 @@
+"""
+tests/test_boards.py
+
+Both board backends have to reject the same bad shots and placements, the same way.
+"""
+
+import pytest
+
+from battleship import BOARD_BACKENDS, BOARD_SIZE
+
+BACKENDS = list(BOARD_BACKENDS.values())
+OFF_BOARD = [(-1, 0), (0, -1), (BOARD_SIZE, 0), (0, BOARD_SIZE), (BOARD_SIZE - 1, BOARD_SIZE), (BOARD_SIZE, BOARD_SIZE)]
+
+@pytest.mark.parametrize("board_type", BACKENDS)
+@pytest.mark.parametrize("row, col", OFF_BOARD)
+def test_fire_off_the_board(board_type, row, col):
+    board = board_type()
+    board.place_ship("Carrier", 0, 0, 5, 0)
+    with pytest.raises(IndexError):
+        board.fire_at(row, col)
+    # nothing on the board changed
+    assert board.version == 5
+    assert all(cell == '.' for row in board.display_grid for cell in row)
+
+@pytest.mark.parametrize("board_type", BACKENDS)
+@pytest.mark.parametrize("row, col, size, orientation", [
+    (-1, 0, 2, 0), (0, -1, 2, 1), (BOARD_SIZE, 0, 2, 0), (0, BOARD_SIZE, 2, 1),
+    (0, BOARD_SIZE - 1, 2, 0), (BOARD_SIZE - 1, 0, 2, 1),
+])
+def test_place_off_the_board(board_type, row, col, size, orientation):
+    board = board_type()
+    assert not board.can_place_ship(row, col, size, orientation)
+    assert not board.place_ship("Destroyer", row, col, size, orientation)
+    with pytest.raises(IndexError):
+        board.do_place_ship(row, col, size, orientation)
+    assert board.version == 0 and board.placed_ships == []
+
+@pytest.mark.parametrize("board_type", BACKENDS)
+@pytest.mark.parametrize("row, col, size, orientation", [(0, 0, 5, 0), (0, 4, 3, 1), (2, 2, 2, 0), (1, 3, 4, 1)])
+def test_overlapping_placement(board_type, row, col, size, orientation):
+    board = board_type()
+    assert board.place_ship("Carrier", 0, 2, 5, 1)  # column 2, rows 0-4
+    assert board.place_ship("Destroyer", 2, 3, 2, 0)  # row 2, columns 3-4
+    before = board.hidden_grid
+    assert not board.can_place_ship(row, col, size, orientation)
+    assert not board.place_ship("Cruiser", row, col, size, orientation)
+    with pytest.raises(ValueError):
+        board.do_place_ship(row, col, size, orientation)
+    assert board.hidden_grid == before and len(board.placed_ships) == 2
+
+@pytest.mark.parametrize("board_type", BACKENDS)
+def test_placement_on_a_shot_cell(board_type):
+    board = board_type()
+    assert board.fire_at(4, 4) == ('miss', None)
+    assert not board.place_ship("Destroyer", 4, 3, 2, 0)
+    with pytest.raises(ValueError):
+        board.do_place_ship(4, 3, 2, 0)
+
+def test_backends_agree():
+    boards = [board_type() for board_type in BACKENDS]
+    for board in boards:
+        assert board.place_ship("Destroyer", 0, 0, 2, 0)
+    shots = [(0, 0), (0, 0), (5, 5), (0, 1), (0, 1)]
+    results = [[board.fire_at(r, c) for r, c in shots] for board in boards]
+    assert results[0] == [('hit', None), ('already_shot', None), ('miss', None), ('hit', 'Destroyer'), ('already_shot', None)]
+    assert all(result == results[0] for result in results)
+    assert all(board.all_ships_sunk() for board in boards)
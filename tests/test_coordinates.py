@@ -0,0 +1,27 @@
+"""
+tests/test_coordinates.py
+
+Coordinate names and the column header of boards of every size.
+"""
+
+from coordinates import CoordinateCodec
+
+def test_names_round_trip():
+    for size in (1, 10, 27, 120):
+        codec = CoordinateCodec.for_size(size)
+        for r in range(size):
+            for c in range(size):
+                assert codec.parse(codec.format(r, c)) == (r, c)
+
+def test_standard_header_is_unchanged():
+    assert CoordinateCodec.for_size(10).column_header == " 1  2  3  4  5  6  7  8  9 10"
+
+def test_header_pads_to_the_largest_column_number():
+    for size in (9, 99, 100, 120):
+        header = CoordinateCodec.for_size(size).column_header
+        numbers = header.split()
+        assert numbers == [str(c + 1) for c in range(size)]
+        width = max(2, len(str(size)))
+        # every column number ends at the same place in its own equal-width column
+        assert len(header) == size * (width + 1) - 1
+        assert all(header[c * (width + 1):c * (width + 1) + width].strip() == str(c + 1) for c in range(size))
@@ -0,0 +1,37 @@
+"""
+tests/test_crc.py
+
+crc32() has to produce the same 4 bytes as the bitwise routine peers still run, for every packet.
+"""
+
+import random
+
+from protocol import crc32, crc32_bitwise
+
+def check(pack):
+    assert crc32(pack) == bytes(crc32_bitwise(pack)), f"crc32 mismatch for packet {pack.hex()}"
+
+def test_empty_packet():
+    check(b"")
+
+def test_every_final_byte():
+    for byte in range(256):
+        check(bytes([byte]))
+        check(bytes([0x5A, byte]))
+
+def test_random_packets():
+    # header (seq + type byte + id/len) followed by 0..511 bytes of payload
+    rng = random.Random(3002)
+    for _ in range(300):
+        check(bytes(rng.getrandbits(8) for _ in range(5 + rng.randint(0, 511))))
+
+def test_packets_differing_before_the_last_byte():
+    # the routines must agree when only earlier bytes change, including the first and the one before last
+    rng = random.Random(3003)
+    for _ in range(100):
+        pack = bytearray(rng.getrandbits(8) for _ in range(rng.randint(2, 520)))
+        for index in {0, len(pack) // 2, len(pack) - 2}:
+            changed = bytearray(pack)
+            changed[index] ^= 1 << rng.randrange(8)
+            check(bytes(pack))
+            check(bytes(changed))
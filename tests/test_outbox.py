@@ -0,0 +1,60 @@
+"""
+tests/test_outbox.py
+
+Closing a connection with close_when_written(): what is queued still goes out, however far the client
+is behind, unless it stops reading altogether.
+"""
+
+import socket
+import time
+
+import server
+
+def socketpair():
+    ours, theirs = socket.socketpair()
+    ours.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    theirs.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    return ours, theirs
+
+def read_all(conn, timeout=5):
+    conn.settimeout(timeout)
+    data = bytearray()
+    while chunk := conn.recv(1<<16):
+        data += chunk
+    return bytes(data)
+
+def test_queued_frames_are_written_before_closing():
+    ours, theirs = socketpair()
+    outbox = server.Outbox(ours)
+    payload = bytes(range(256)) * 4096 # 1 MB, far more than the socket buffers hold
+    outbox.put((payload,))
+    outbox.flush()
+    assert outbox.size > server.LOW_WATER # the old close would have thrown this away
+    outbox.close_when_written()
+    assert outbox.put((b"more",)) == 0 # nothing can be added once it is closing
+    assert read_all(theirs) == payload # everything, then the connection closes
+    assert outbox.closed and ours.fileno() == -1
+    theirs.close()
+
+def test_client_that_stops_reading_is_cut_off():
+    ours, theirs = socketpair()
+    outbox = server.Outbox(ours)
+    outbox.put((bytes(1<<20),))
+    outbox.flush()
+    outbox.close_when_written(0.2)
+    assert not outbox.closed
+    deadline = time.monotonic() + 5
+    while not outbox.closed and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert outbox.closed and ours.fileno() == -1
+    theirs.close()
+
+def test_empty_outbox_closes_at_once():
+    ours, theirs = socketpair()
+    outbox = server.Outbox(ours)
+    outbox.put((b"bye",))
+    outbox.close_when_written()
+    assert outbox.closed and ours.fileno() == -1
+    assert read_all(theirs) == b"bye"
+    outbox.close_when_written() # again is harmless
+    theirs.close()
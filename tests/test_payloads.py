@@ -0,0 +1,68 @@
+"""
+tests/test_payloads.py
+
+Message payloads on the wire: text is UTF-8 and binary board snapshots are raw bytes, in one frame
+or cut into fragments.
+"""
+
+import pytest
+
+from protocol import *
+
+def frames(msg):
+    # encode every frame of msg, decode them again and join the fragments
+    reassembler = Reassembler()
+    decoder = FrameDecoder()
+    wholes = []
+    for seq, frame in enumerate(msg.fragments()):
+        frame.seq = seq
+        for received in decoder.feed(frame.encode()):
+            whole = reassembler.add(received)
+            if whole is not None:
+                wholes.append(whole)
+    assert len(wholes) == 1
+    return wholes[0]
+
+def test_text_outside_latin1():
+    for text in ("héllo", "Ζεύς fired at B5", "宝船 sank", "🚢🚢"):
+        msg = Message(1, MessageType.CHAT, MessageType.TEXT, text)
+        assert msg.msg_len == len(text.encode("utf-8"))
+        assert Message.decode(msg.encode()).msg == text
+
+def test_fragments_split_characters():
+    # every split point falls inside a 2, 3 or 4 byte character somewhere
+    for char in ("é", "宝", "🚢"):
+        for offset in range(4):
+            text = "x" * offset + char * 700
+            msg = Message(1, MessageType.CHAT, MessageType.TEXT, text)
+            assert msg.msg_len > MAX_PAYLOAD
+            assert frames(msg).msg == text
+
+def test_fragment_message_from_pieces():
+    rows = ["ü" * 100 + "|" for _ in range(20)]
+    pieces = list(fragment_message(1, MessageType.CHAT, MessageType.TEXT, rows))
+    assert all(piece.msg_len <= MAX_PAYLOAD for piece in pieces)
+    assert b"".join(piece.data for piece in pieces) == "".join(rows).encode("utf-8")
+
+def test_binary_board_bytes_unchanged():
+    for size in (10, 100):
+        states = ("SXo." * size * size)[:size * size]
+        payload = encode_board_binary("0h", 3, size, states)
+        msg = Message(0, MessageType.BOARD, MessageType.TEXT, payload)
+        assert msg.msg_len == len(payload) # one byte per packed cell byte
+        kind, key, _, version, (decoded_size, data) = decode_board_payload(frames(msg).msg)
+        assert (kind, key, version, decoded_size) == (BOARD_BINARY, "0h", 3, size)
+        assert unpack_cells(data, size * size) == states
+
+def test_text_board_starting_like_binary_is_utf8():
+    # only BOARD payloads are ever binary
+    msg = Message(1, MessageType.CHAT, MessageType.TEXT, "#1 ünïcode")
+    assert Message.decode(msg.encode()).msg == "#1 ünïcode"
+
+def test_oversized_payload_is_not_cut():
+    msg = Message(1, MessageType.CHAT, MessageType.TEXT, "x" * (MAX_PAYLOAD + 1))
+    with pytest.raises(ValueError):
+        msg.encode()
+    assert msg.msg_len == MAX_PAYLOAD + 1 # the message itself is untouched
+    assert Message.decode(Message(1, MessageType.CHAT, MessageType.TEXT, "x" * MAX_PAYLOAD).encode()).msg_len == MAX_PAYLOAD
+    assert frames(msg).msg == msg.msg
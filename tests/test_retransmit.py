@@ -0,0 +1,69 @@
+"""
+tests/test_retransmit.py
+
+The server's retransmission timer: only a frame that is actually resent counts as a timeout and backs
+the rto off, and the resend goes through write_to() like any other frame.
+"""
+
+import socket
+
+import pytest
+
+import server
+from protocol import *
+
+class Timers:
+    # stands in for server.timers, nothing fires on its own
+    def __init__(self):
+        self.armed = []
+    def arm(self, duration, callback, *args):
+        self.armed.append(duration)
+        return self
+    def rearm(self, duration):
+        self.armed.append(duration)
+    def cancel(self):
+        pass
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "timers", Timers())
+    ours, theirs = socket.socketpair()
+    theirs.setblocking(False)
+    client = server.Client(ours, ("loopback", 0))
+    client.id = 1
+    client.theirs = theirs
+    yield client
+    ours.close()
+    theirs.close()
+
+def received(client):
+    decoder = FrameDecoder()
+    decoder.fill_from(client.theirs, 1<<16)
+    return decoder.decode_frames()
+
+def test_no_resend_behind_queued_frames(client):
+    server.send_message_to(client, Message(server.SERVER_ID, MessageType.TEXT, MessageType.TEXT, "first"))
+    received(client)
+    client.outbox.put((b"queued",)) # written by the next flush, ahead of any resend
+    server.retransmit_timed_out(client)
+    window = client.send_window
+    assert (window.retransmits, window.timeouts, window.backoff) == (0, 0, 0)
+    assert client.theirs.recv(64) == b"queued"
+    assert server.timers.armed[-1] == window.rto == INITIAL_RTO
+
+def test_resend_counts_and_backs_off(client, monkeypatch):
+    checked = []
+    monkeypatch.setattr(server, "check_backlog", checked.append)
+    server.send_message_to(client, Message(server.SERVER_ID, MessageType.TEXT, MessageType.TEXT, "first"))
+    received(client)
+    checked.clear()
+    server.retransmit_timed_out(client)
+    window = client.send_window
+    assert (window.retransmits, window.timeouts, window.backoff) == (1, 1, 1)
+    assert [msg.msg for msg in received(client)] == ["first"]
+    assert checked == [client] # the resend went through check_backlog() like any other write
+    assert server.timers.armed[-1] == window.rto == 2 * INITIAL_RTO
+
+def test_nothing_unacknowledged(client):
+    server.retransmit_timed_out(client)
+    assert client.send_window.timeouts == 0 and server.timers.armed == []